@@ -0,0 +1,377 @@
+'''
+Benchmark of the per-packet work done by GT7Proxy.py, fed with synthetic encrypted packets, and of the
+time it takes to start (imports, then launch to first packet forwarded to XSim).
+'''
+import argparse
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import random
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from salsa20 import Salsa20_xor
+
+import gt_dashboard
+from gt_engine import ProxyEngine, QueueSource, QueueSink
+from gt_packet_definition import GTDataView, GTForwardPacket, packet_layouts, FLAG_PAUSED
+from gt_processing import salsa20_dec, LapCounter, orientation, make_xsim_packet, XSimForwarder
+
+KEY = b'Simulator Interface Packet GT7 ver 0.0'
+MAGIC = 0x47375330
+PERCENTILES = (50, 99, 99.9)
+# Give up on a launch that has not forwarded anything after this many seconds
+STARTUP_TIMEOUT = 30.0
+
+
+def salsa20_enc(plain, seed, xor):
+    # Inverse of salsa20_dec: the IV seed is left in clear at 0x40 like the Playstation does
+    iv = (seed ^ xor).to_bytes(4, 'little') + seed.to_bytes(4, 'little')
+    edata = bytearray(Salsa20_xor(bytes(plain), iv, KEY[0:32]))
+    edata[0x40:0x44] = seed.to_bytes(4, 'little')
+    return bytes(edata)
+
+
+def synthetic_packet(pkt_id, rnd, layout):
+    values = {}
+    for name, code in zip(layout.fields, layout.format[1:]):
+        if code == 'f':
+            values[name] = rnd.uniform(-1, 1)
+        elif code == 'c':
+            values[name] = b'\x00'
+        elif code == 'B':
+            values[name] = rnd.randrange(256)
+        else:
+            values[name] = rnd.randrange(8)
+    values['magic'] = MAGIC
+    # unit quaternion and plausible driving values
+    q = [rnd.gauss(0, 1) for _ in range(4)]
+    n = math.sqrt(sum(x * x for x in q))
+    for name, x in zip(('rotation_x', 'rotation_y', 'rotation_z', 'northorientation'), q):
+        values[name] = x / n
+    for name in ('world_velocity_x', 'world_velocity_y', 'world_velocity_z'):
+        values[name] = rnd.uniform(-60, 60)
+    values['rpm'] = rnd.uniform(800, 9000)
+    values['fuel_level'] = 40.0
+    values['fuel_capacity'] = 100.0
+    values['speed'] = rnd.uniform(0, 90)
+    values['pkt_id'] = pkt_id
+    values['current_lap'] = 1 + pkt_id // 6000
+    values['total_laps'] = 5
+    values['best_lap_time'] = values['last_lap_time'] = -1
+    values['car_code'] = 1234
+    plain = struct.pack(layout.format, *(values[name] for name in layout.fields))
+    return salsa20_enc(plain, rnd.getrandbits(32), layout.xor)
+
+
+def percentile(ordered, pct):
+    # nearest rank
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+def summarize(timings_ns):
+    ordered = sorted(timings_ns)
+    total = sum(ordered)
+    result = {'mean_us': total / len(ordered) / 1000}
+    for pct in PERCENTILES:
+        result['p{}_us'.format(pct)] = percentile(ordered, pct) / 1000
+    result['max_us'] = ordered[-1] / 1000
+    result['packets_per_s'] = len(ordered) / (total / 1e9) if total else 0
+    return result
+
+
+def run_stage(func, inputs, warmup):
+    for item in inputs[:warmup]:
+        func(item)
+    timings = []
+    clock = time.perf_counter_ns
+    for item in inputs:
+        start = clock()
+        func(item)
+        timings.append(clock() - start)
+    return timings
+
+
+# Stages, mirroring the main loop of GT7Proxy.py
+
+
+class Decrypt:
+    def __init__(self, layout):
+        self.xor = layout.xor
+
+    def __call__(self, data):
+        return salsa20_dec(data, self.xor)
+
+
+class DecodeView:
+    # one view rebound to every packet, reading the fields forwarded to XSim
+    def __init__(self):
+        self.view = GTDataView(b'')
+
+    def __call__(self, ddata):
+        view = self.view.rebind(ddata)
+        return view.pkt_id, view.speed, view.rpm, view.flags, view.rotation_x, view.car_code
+
+
+def stage_orientation(telemetry):
+    return orientation(telemetry.rotation_x, telemetry.rotation_y, telemetry.rotation_z, telemetry.northorientation,
+                       telemetry.world_velocity_x, telemetry.world_velocity_y, telemetry.world_velocity_z)
+
+
+def stage_xsim_packet(telemetry):
+    return make_xsim_packet(telemetry, telemetry.suggestedgear_gear & 0b00001111, 1.0, 2.0, 3.0, 4.0)
+
+
+class Forward:
+    # what the proxy does instead of decode + xsim_packet: forwarded fields only, XSim bytes sliced out
+    def __init__(self, layout):
+        self.forwarder = XSimForwarder(layout)
+
+    def __call__(self, ddata):
+        telemetry = GTForwardPacket(ddata)
+        return self.forwarder.packet(ddata, telemetry, telemetry.suggestedgear_gear & 0b00001111, 1.0, 2.0, 3.0, 4.0)
+
+
+class EngineStep:
+    # One turn of the proxy loop itself, fed from memory: receive, decrypt, order, decode and forward
+    def __init__(self, packet_version):
+        self.source = QueueSource()
+        self.engine = ProxyEngine(self.source, [QueueSink()], packet_version)
+        self.engine.start()
+
+    def __call__(self, data):
+        self.source.put(data)
+        self.engine.step()
+
+
+class Dashboard:
+    # A full frame drawn for every packet, written to an in-memory sink swapped for sys.stdout.
+    # With --refresh_rate the proxy only pays this cost a few times per second.
+    def __init__(self, silent):
+        self.silent = silent
+        self.lapcounter = LapCounter()
+        self.curLapTime = datetime.timedelta(seconds=42)
+
+    def __call__(self, item):
+        telemetry, ddata = item
+        self.lapcounter.update(telemetry.current_lap, telemetry.flags & FLAG_PAUSED != 0, telemetry.pkt_id,
+                               telemetry.last_lap_time)
+        gt_dashboard.draw_telemetry(telemetry, ddata, self.lapcounter.laptime(), self.curLapTime,
+                                    telemetry.suggestedgear_gear & 0b00001111, telemetry.suggestedgear_gear >> 4,
+                                    1.0, 2.0, 3.0, 4.0, (5.0, 6.0, 7.0), self.silent)
+        gt_dashboard.screen.render()
+
+
+class EndToEnd(Dashboard):
+    def __init__(self, silent, layout, refresh_rate):
+        Dashboard.__init__(self, silent)
+        self.layout = layout
+        self.forwarder = XSimForwarder(layout)
+        gt_dashboard.screen.set_refresh_rate(refresh_rate)
+
+    def __call__(self, data):
+        ddata = salsa20_dec(data, self.layout.xor)
+        telemetry = GTForwardPacket(ddata)
+        cgear = telemetry.suggestedgear_gear & 0b00001111
+        lvx, lvy, lvz, roll, pitch, yaw, slip_angle = stage_orientation(telemetry)
+        self.forwarder.packet(ddata, telemetry, cgear, roll, pitch, yaw, slip_angle)
+        self.lapcounter.update(telemetry.current_lap, telemetry.flags & FLAG_PAUSED != 0, telemetry.pkt_id,
+                               telemetry.last_lap_time)
+        if gt_dashboard.screen.due():
+            gt_dashboard.draw_telemetry(self.layout.record(ddata), ddata, self.lapcounter.laptime(), self.curLapTime, cgear,
+                                        telemetry.suggestedgear_gear >> 4, roll, pitch, yaw, slip_angle,
+                                        (lvx, lvy, lvz), self.silent)
+            gt_dashboard.screen.render()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(packets, warmup, silent, seed, packet_version='B', refresh_rate=15):
+    layout = packet_layouts[packet_version]
+    rnd = random.Random(seed)
+    raw = [synthetic_packet(pkt_id, rnd, layout) for pkt_id in range(1, packets + 1)]
+    decrypted = [salsa20_dec(data, layout.xor) for data in raw]
+    decoded = [layout.record(ddata) for ddata in decrypted]
+
+    stages = {}
+    stages['decrypt'] = run_stage(Decrypt(layout), raw, warmup)
+    stages['decode'] = run_stage(layout.record, decrypted, warmup)
+    stages['decode_view'] = run_stage(DecodeView(), decrypted, warmup)
+    stages['orientation'] = run_stage(stage_orientation, decoded, warmup)
+    stages['xsim_packet'] = run_stage(stage_xsim_packet, decoded, warmup)
+    stages['forward'] = run_stage(Forward(layout), decrypted, warmup)
+    stages['engine'] = run_stage(EngineStep(packet_version), raw, warmup)
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        gt_dashboard.draw_layout(silent)
+        gt_dashboard.screen.render()
+        stages['dashboard'] = run_stage(Dashboard(silent), list(zip(decoded, decrypted)), warmup)
+        stages['end_to_end'] = run_stage(EndToEnd(silent, layout, refresh_rate), raw, warmup)
+    finally:
+        sys.stdout = stdout
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'packets': packets,
+        'packet_version': packet_version,
+        'silent': silent,
+        'refresh_rate': refresh_rate,
+        'stages': {name: summarize(timings) for name, timings in stages.items()},
+    }
+
+
+def time_command(command, runs):
+    # Wall clock milliseconds of complete runs of command, the first run warms the OS file cache
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def time_first_packet(command, capture, runs, packet_version):
+    # Milliseconds from launching the proxy on a replayed capture to the first datagram received on the
+    # XSim port, that is imports, argument parsing, setup and the first packet through the loop
+    timings = []
+    for run in range(runs + 1):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(('127.0.0.1', 0))
+        sink.settimeout(STARTUP_TIMEOUT)
+        start = time.perf_counter()
+        proxy = subprocess.Popen(command + ['--replay', capture, '--packet_version', packet_version,
+                                           '--xsim_port', str(sink.getsockname()[1])],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            sink.recvfrom(4096)
+            elapsed = (time.perf_counter() - start) * 1000
+        finally:
+            proxy.kill()
+            proxy.wait()
+            sink.close()
+        if run:
+            timings.append(elapsed)
+    return timings
+
+
+def run_startup(runs, seed, packet_version='B', command=None):
+    # command is the proxy to launch, python GT7Proxy.py by default or a frozen build (dist/GT7Proxy)
+    here = os.path.dirname(os.path.abspath(__file__))
+    python = [sys.executable, '-c', 'pass']
+    imports = [sys.executable, '-c', 'import sys; sys.path.insert(0, {!r}); import GT7Proxy'.format(here)]
+    command = command or [sys.executable, os.path.join(here, 'GT7Proxy.py')]
+    layout = packet_layouts[packet_version]
+    rnd = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        capture = os.path.join(directory, 'startup.raw.cap')
+        with open(capture, 'wb') as f:
+            for pkt_id in range(1, 61):
+                f.write(synthetic_packet(pkt_id, rnd, layout))
+        timings = {
+            'python': time_command(python, runs),
+            'import': time_command(imports, runs),
+            'first_packet': time_first_packet(command, capture, runs, packet_version),
+        }
+    return {name: {'median_ms': statistics.median(values), 'min_ms': min(values), 'max_ms': max(values)}
+            for name, values in timings.items()}
+
+
+def print_results(results, baseline=None):
+    print('{} packets ({}), python {}, revision {}'.format(results['packets'], results['packet_version'],
+                                                          results['python'], results['revision']))
+    print('{:<16}{:>10}{:>10}{:>10}{:>10}{:>12}'.format('stage', 'p50 us', 'p99 us', 'p99.9 us', 'max us',
+                                                         'packets/s'))
+    for name, stats in results['stages'].items():
+        line = '{:<16}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.0f}'.format(
+            name, stats['p50_us'], stats['p99_us'], stats['p99.9_us'], stats['max_us'], stats['packets_per_s'])
+        if baseline and name in baseline['stages']:
+            previous = baseline['stages'][name]['p50_us']
+            line += '  p50 x{:.2f} vs {}'.format(stats['p50_us'] / previous if previous else 0,
+                                                  baseline.get('revision'))
+        print(line)
+    if 'startup' in results:
+        print('{:<16}{:>10}{:>10}{:>10}'.format('startup', 'median ms', 'min ms', 'max ms'))
+        for name, stats in results['startup'].items():
+            line = '{:<16}{:>10.1f}{:>10.1f}{:>10.1f}'.format(name, stats['median_ms'], stats['min_ms'],
+                                                             stats['max_ms'])
+            if baseline and name in baseline.get('startup', {}):
+                previous = baseline['startup'][name]['median_ms']
+                line += '  median x{:.2f} vs {}'.format(stats['median_ms'] / previous if previous else 0,
+                                                        baseline.get('revision'))
+            print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets",
+                        type=int,
+                        default=20000,
+                        help="Number of synthetic packets pushed through every stage. Default is 20000")
+    parser.add_argument("--warmup",
+                        type=int,
+                        default=500,
+                        help="Packets processed before timing starts. Default is 500")
+    parser.add_argument("--silent",
+                        type=bool,
+                        default=False,
+                        help="Benchmark the reduced dashboard drawn with --silent. Default is False")
+    parser.add_argument("--refresh_rate",
+                        type=float,
+                        default=15,
+                        help="Dashboard refresh rate applied to the end to end stage, see GT7Proxy.py --refresh_rate. Default is 15")
+    parser.add_argument("--packet_version",
+                        type=str,
+                        default='B',
+                        choices=list(packet_layouts),
+                        help="Layout of the synthetic packets, see GT7Proxy.py --packet_version. Default is B")
+    parser.add_argument("--seed",
+                        type=int,
+                        default=7,
+                        help="Seed of the synthetic packet generator. Default is 7")
+    parser.add_argument("--output",
+                        type=str,
+                        default=None,
+                        help="Save results as JSON in this file")
+    parser.add_argument("--compare",
+                        type=str,
+                        default=None,
+                        help="JSON results of a previous run to compare against")
+    parser.add_argument("--startup",
+                        type=int,
+                        default=0,
+                        help="Also time this many launches: python alone, importing GT7Proxy and launch to first packet forwarded to XSim. Default is 0")
+    parser.add_argument("--startup_command",
+                        type=str,
+                        default=None,
+                        help="Proxy launched by --startup, for instance dist/GT7Proxy to time the frozen executable. Default is python GT7Proxy.py")
+    args = parser.parse_args()
+
+    results = run(args.packets, args.warmup, args.silent, args.seed, args.packet_version, args.refresh_rate)
+    if args.startup:
+        results['startup'] = run_startup(args.startup, args.seed, args.packet_version,
+                                         args.startup_command.split() if args.startup_command else None)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
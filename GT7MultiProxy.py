@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+
+from gt_async import load_config, run_proxy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proxy several Playstations from one process, as described in a JSON config file")
+    parser.add_argument("--config",
+                        required=True,
+                        type=str,
+                        help="JSON file listing the consoles and the UDP targets of each of them, see GT7MultiProxy.example.json")
+
+    parser.add_argument("--status_interval",
+                        type=float,
+                        default=5,
+                        help="Seconds between two status reports, 0 disables them. Default is 5")
+
+    parser.add_argument("--workers",
+                        type=int,
+                        default=0,
+                        help="Processes decrypting and decoding the consoles, each console is handled by one of them. 0 does everything in this process. Default is 0")
+
+    args = parser.parse_args()
+    if args.workers < 0:
+        parser.error('--workers cannot be negative')
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        # json.JSONDecodeError is a ValueError
+        parser.error("--config {}: {}".format(args.config, e))
+    try:
+        asyncio.run(run_proxy(config, args.status_interval, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+# The guard matters with --workers: where processes are spawned (Windows, macOS) workers import this module
+if __name__ == '__main__':
+    main()
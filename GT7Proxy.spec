@@ -13,7 +13,8 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Only used by the offline tools (gt_batch, gt_export), not by the proxy
+    excludes=['numpy', 'scipy', 'pandas', 'pyarrow', 'matplotlib', 'tkinter', 'IPython', 'pytest'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -0,0 +1,183 @@
+'''
+Lap and sector analytics computed packet by packet: lap time from packet ids (60 per second, pauses
+excluded), live delta to a reference lap at the same place on track, sector splits and per lap aggregates.
+The reference is the best lap kept as a track map (see gt_trackmap), saved per track when a directory is
+given so that later sessions compare with it from their first lap.
+'''
+import math
+from array import array
+from collections import namedtuple
+from struct import Struct
+
+from gt_packet_definition import gather_format, FLAG_PAUSED
+from gt_trackmap import TrackMap, TrackMaps, TRACE_STEP
+
+# Fields read from the decrypted packet, in packet order, same offsets in every layout
+ANALYTICS_FIELDS = ('position_x', 'position_y', 'position_z', 'fuel_level', 'speed', 'tire_temp_FL',
+                    'tire_temp_FR', 'tire_temp_RL', 'tire_temp_RR', 'pkt_id', 'current_lap', 'last_lap_time',
+                    'flags', 'road_plane_dist')
+ANALYTICS_STRUCT = Struct(gather_format(ANALYTICS_FIELDS))
+
+TICKS_PER_SECOND = 60
+SECTORS = 3
+# More than this between two packets is a teleport (pit, reset, replay jump), not driving
+TELEPORT_DISTANCE = 50.0
+# Metres around the line where the reference map is still on the previous lap
+LINE_MARGIN = 100.0
+# Metres driven between two looks for a saved map while there is no reference (pit exit, grid, off the map)
+SEARCH_STEP = 250.0
+
+LapSummary = namedtuple('LapSummary', ['lap', 'time', 'distance', 'max_speed', 'fuel_used', 'tyre_temps',
+                                       'sectors'])
+
+
+class LapAnalytics:
+    # update() is called for every packet on the analytics thread, the dashboard reads the attributes.
+    # Nothing is allocated per packet apart from the unpacked values, traces grow in place.
+    # trackmaps is a directory where reference laps are loaded from and saved to, read once here.
+    def __init__(self, trace_step=TRACE_STEP, sectors=SECTORS, trackmaps=None):
+        self.trace_step = trace_step
+        self.sectors = sectors
+        self.trackmaps = TrackMaps(trackmaps) if trackmaps else None
+        self.lap = -1
+        self.complete = False  # the lap in progress was seen from its start
+        self.tick = None
+        self.ticks = 0
+        self.px = self.py = self.pz = None
+        self.distance = 0.0
+        # seconds into the lap and position at every trace_step metres
+        self.trace = array('d')
+        self.trace_x = array('d')
+        self.trace_z = array('d')
+        self.road_plane = 0.0
+        self.delta = None  # seconds behind (positive) or ahead of the reference lap at the same place
+        self.sector = 0
+        self.sector_start = 0.0
+        self.sector_times = [None] * sectors
+        self.max_speed = 0.0
+        self.fuel_start = None
+        self.fuel = 0.0
+        self.tyre_sums = [0.0] * 4
+        self.samples = 0
+        self.best = None  # LapSummary
+        self.best_sectors = [None] * sectors
+        self.laps = []
+        self.reference = None  # TrackMap of the best lap, this session or a saved one
+        self.cursor = None
+        self.next_search = 0.0  # distance into the lap at which saved maps are looked up again
+
+    def update(self, ddata):
+        self.step(*ANALYTICS_STRUCT.unpack_from(ddata))
+
+    def step(self, x, y, z, fuel, speed, fl, fr, rl, rr, pkt_id, lap, last_lap_time, flags, road_plane):
+        if lap != self.lap:
+            self.new_lap(lap, last_lap_time, fuel)
+        paused = flags & FLAG_PAUSED
+        if paused or lap <= 0:
+            # Time and distance stand still in menus, replays and before the start
+            self.tick = pkt_id
+            self.px = None
+            return
+        if self.tick is not None and pkt_id > self.tick:
+            self.ticks += pkt_id - self.tick
+        self.tick = pkt_id
+        if self.px is not None:
+            moved = math.sqrt((x - self.px) ** 2 + (y - self.py) ** 2 + (z - self.pz) ** 2)
+            if moved < TELEPORT_DISTANCE:
+                self.distance += moved
+        self.px, self.py, self.pz = x, y, z
+        seconds = self.ticks / TICKS_PER_SECOND
+        trace = self.trace
+        if len(trace) * self.trace_step <= self.distance:
+            trace.append(seconds)
+            self.trace_x.append(x)
+            self.trace_z.append(z)
+            self.road_plane += road_plane
+        if self.reference is None and self.trackmaps is not None and self.distance >= self.next_search:
+            self.next_search = self.distance + SEARCH_STEP
+            self.use_reference(self.trackmaps.find(x, z))
+        if self.complete and self.reference is not None:
+            self.compare(seconds, x, z)
+        if speed > self.max_speed:
+            self.max_speed = speed
+        self.fuel = fuel
+        sums = self.tyre_sums
+        sums[0] += fl
+        sums[1] += fr
+        sums[2] += rl
+        sums[3] += rr
+        self.samples += 1
+
+    def compare(self, seconds, x, z):
+        # Delta and sector splits against the reference lap at the closest place on its map
+        reference = self.reference
+        position = self.cursor.follow(x, z)
+        if position is None:
+            self.delta = None
+            return
+        along = reference.distance_at(position)
+        if along > reference.length - LINE_MARGIN and self.distance < LINE_MARGIN:
+            # Just past the line, the map has not started over yet
+            return
+        self.delta = seconds - reference.time_at(position)
+        if self.sector < self.sectors - 1 and along >= reference.length * (self.sector + 1) / self.sectors:
+            self.sector_times[self.sector] = seconds - self.sector_start
+            self.sector_start = seconds
+            self.sector += 1
+
+    def use_reference(self, reference):
+        self.reference = reference
+        self.cursor = reference.cursor() if reference is not None else None
+
+    def new_lap(self, lap, last_lap_time, fuel):
+        if self.complete and lap == self.lap + 1 and self.lap > 0:
+            self.finish(last_lap_time)
+        # Joining in the middle of a lap, or going back to an earlier lap (restart), gives no usable lap
+        self.complete = self.lap >= 0 and lap == self.lap + 1
+        self.lap = lap
+        self.ticks = 0
+        self.distance = 0.0
+        self.px = None
+        self.next_search = 0.0
+        self.trace = array('d')
+        self.trace_x = array('d')
+        self.trace_z = array('d')
+        self.road_plane = 0.0
+        if self.cursor is not None:
+            self.cursor.reset(0)
+        self.delta = None
+        self.sector = 0
+        self.sector_start = 0.0
+        self.sector_times = [None] * self.sectors
+        self.max_speed = 0.0
+        self.fuel_start = fuel
+        self.fuel = fuel
+        self.tyre_sums = [0.0] * 4
+        self.samples = 0
+
+    def finish(self, last_lap_time):
+        # The game lap time is authoritative, packet ids are a fallback
+        time = last_lap_time / 1000 if last_lap_time > 0 else self.ticks / TICKS_PER_SECOND
+        sectors = list(self.sector_times)
+        if self.sector == self.sectors - 1:
+            sectors[-1] = time - self.sector_start
+        summary = LapSummary(self.lap, time, self.distance, self.max_speed * 3.6, self.fuel_start - self.fuel,
+                             tuple(total / self.samples for total in self.tyre_sums) if self.samples else None,
+                             tuple(sectors))
+        self.laps.append(summary)
+        if self.best is None or time < self.best.time:
+            self.best = summary
+        if (self.reference is None or time < self.reference.lap_time) and len(self.trace) >= 3:
+            self.use_reference(TrackMap(self.trace_x, self.trace_z, self.trace, time,
+                                        self.road_plane / len(self.trace)))
+            if self.trackmaps is not None:
+                self.trackmaps.save(self.reference)
+        for i, sector in enumerate(sectors):
+            if sector is not None and (self.best_sectors[i] is None or sector < self.best_sectors[i]):
+                self.best_sectors[i] = sector
+
+    def tyre_trend(self):
+        # Average tyre temperatures of the last lap minus those of the lap before
+        if len(self.laps) < 2 or not self.laps[-1].tyre_temps or not self.laps[-2].tyre_temps:
+            return None
+        return tuple(a - b for a, b in zip(self.laps[-1].tyre_temps, self.laps[-2].tyre_temps))
@@ -0,0 +1,253 @@
+'''
+asyncio proxy core: several consoles on one host, each stream fanned out to any number of UDP targets.
+'''
+import asyncio
+import json
+import socket
+
+from gt_heartbeat import HeartbeatScheduler, HEARTBEAT_INTERVAL, GAP_TIMEOUT
+from gt_packet_definition import packet_layouts, GTForwardPacket
+from gt_processing import salsa20_dec, orientation, XSimForwarder, PacketValidator
+from gt_sequence import SequenceTracker
+
+# GT7 always sends telemetry to this port of the host that sent the heartbeat,
+# every console therefore shares the receive socket and streams are told apart by source address
+RECEIVE_PORT = 33740
+SEND_PORT = 33739
+
+# What a target receives
+TARGET_FORMATS = ('xsim', 'decrypted', 'raw')
+
+
+def parse_address(text, default_port):
+    host, _, port = text.rpartition(':')
+    if not host:
+        return text, default_port
+    return host, int(port)
+
+
+def load_config(filename):
+    # {
+    #   "receive_port": 33740, "send_port": 33739, "heartbeat_interval": 1.0, "gap_timeout": 0.05,
+    #   "consoles": [
+    #     {"name": "rig1", "ps_ip": "192.168.1.10", "packet_version": "B",
+    #      "targets": ["127.0.0.1:33800", {"address": "192.168.1.20:20777", "format": "raw"}]}
+    #   ]
+    # }
+    # A target given as a plain string receives XSim packets.
+    with open(filename) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError('expected a JSON object, not {}'.format(type(config).__name__))
+    config.setdefault('receive_port', RECEIVE_PORT)
+    config.setdefault('send_port', SEND_PORT)
+    config.setdefault('heartbeat_interval', HEARTBEAT_INTERVAL)
+    config.setdefault('gap_timeout', GAP_TIMEOUT)
+    names = set()
+    for i, console in enumerate(config.get('consoles', [])):
+        console.setdefault('name', console.get('ps_ip', 'console{}'.format(i + 1)))
+        console.setdefault('packet_version', 'B')
+        if 'ps_ip' not in console:
+            raise ValueError('console {}: ps_ip is missing'.format(console['name']))
+        if console['packet_version'] not in packet_layouts:
+            raise ValueError('console {}: unknown packet_version {}'.format(console['name'],
+                                                                             console['packet_version']))
+        if console['name'] in names:
+            raise ValueError('console {} is defined twice'.format(console['name']))
+        names.add(console['name'])
+        targets = []
+        for target in console.get('targets', []):
+            if isinstance(target, str):
+                target = {'address': target}
+            target.setdefault('format', 'xsim')
+            if target['format'] not in TARGET_FORMATS:
+                raise ValueError('console {}: unknown target format {}'.format(console['name'], target['format']))
+            targets.append(target)
+        console['targets'] = targets
+    if not config.get('consoles'):
+        raise ValueError('no console defined in {}'.format(filename))
+    return config
+
+
+class ConsoleStream:
+    # One console: decrypted and decoded once per packet, then sent to every target
+    def __init__(self, name, ps_ip, packet_version, targets, heartbeat=None):
+        self.name = name
+        self.ps_ip = ps_ip
+        self.packet_version = packet_version
+        self.layout = packet_layouts[packet_version]
+        self.forwarder = XSimForwarder(self.layout)
+        self.validator = PacketValidator(self.layout, ps_ip)
+        self.heartbeat = heartbeat or HeartbeatScheduler()
+        self.targets = {fmt: [] for fmt in TARGET_FORMATS}
+        for target in targets:
+            self.targets[target['format']].append(parse_address(target['address'], 33800))
+        self.protocol = None  # GT7Protocol, sends go through it
+        self.pktid = 0
+        # no reorder window here, packets go out as they come, older ones are dropped
+        self.sequence = SequenceTracker()
+        self.slip_angle = 0
+        self.received = 0
+        self.forwarded = 0
+        self.invalid = 0
+        self.send_errors = 0
+        self.dropped = 0  # not handed to a decode worker, its ring was full
+        # Written only by the thread collecting the frames of a decode worker, the event loop keeps the others
+        self.worker_invalid = 0
+        self.worker_send_errors = 0
+
+    def handle(self, data, sender):
+        if self.accept(data, sender):
+            self.decode(data)
+
+    def accept(self, data, sender):
+        # Bookkeeping that stays with the receive socket: validation, heartbeat, raw targets
+        self.received += 1
+        if not self.validator.check(data, sender):
+            self.invalid += 1
+            return False
+        self.heartbeat.packet_received()
+        for address in self.targets['raw']:
+            self.send(data, address)
+        return True
+
+    def decode(self, data):
+        ddata = salsa20_dec(data, self.layout.xor)
+        if len(ddata) < self.layout.size:
+            self.invalid += 1
+            return
+        telemetry = GTForwardPacket(ddata)
+        if not self.sequence.push(telemetry.pkt_id, None, 0):
+            return
+        self.pktid = telemetry.pkt_id
+        if self.targets['decrypted']:
+            self.output('decrypted', ddata)
+        if self.targets['xsim']:
+            lvx, lvy, lvz, roll, pitch, yaw, self.slip_angle = orientation(
+                telemetry.rotation_x, telemetry.rotation_y, telemetry.rotation_z, telemetry.northorientation,
+                telemetry.world_velocity_x, telemetry.world_velocity_y, telemetry.world_velocity_z, self.slip_angle)
+            xsim_packet = self.forwarder.packet(ddata, telemetry, telemetry.suggestedgear_gear & 0b00001111, roll,
+                                                pitch, yaw, self.slip_angle)
+            self.output('xsim', xsim_packet)
+        self.forwarded += 1
+
+    def output(self, fmt, data):
+        for address in self.targets[fmt]:
+            self.send(data, address)
+
+    def send(self, data, address):
+        # Datagram transports buffer instead of blocking and never raise, a failed send is counted by
+        # GT7Protocol.error_received()
+        self.protocol.sendto(data, address, self)
+
+
+class GT7Protocol(asyncio.DatagramProtocol):
+    # Receive socket shared by all consoles. With a pool (gt_workers.ShardPool) decryption and decoding are
+    # done by worker processes, only the checks and raw targets are done here.
+    def __init__(self, streams, pool=None):
+        self.streams = streams  # source ip -> ConsoleStream
+        self.pool = pool
+        self.unknown = 0
+        self.transport = None
+        self.sending = None  # stream a send is in progress for
+        self.errors = 0  # socket errors outside of a send
+
+    def datagram_received(self, data, addr):
+        stream = self.streams.get(addr[0])
+        if stream is None:
+            self.unknown += 1
+            return
+        if self.pool is None:
+            stream.handle(data, addr)
+        elif stream.accept(data, addr):
+            self.pool.submit(stream, data)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def sendto(self, data, address, stream):
+        # What the streams send through: a send that fails right away is reported to error_received() from
+        # within transport.sendto(), while sending still tells which stream it was for
+        self.sending = stream
+        try:
+            self.transport.sendto(data, address)
+        finally:
+            self.sending = None
+
+    def error_received(self, exc):
+        # Errors of buffered sends and ICMP errors (Windows reports them on receive) come later, from the loop,
+        # with no address: they cannot be tied to a console
+        if self.sending is not None:
+            self.sending.send_errors += 1
+        else:
+            self.errors += 1
+
+
+async def heartbeat(stream, send_port):
+    scheduler = stream.heartbeat
+    while True:
+        if scheduler.poll():
+            stream.send(stream.layout.heartbeat, (stream.ps_ip, send_port))
+        await asyncio.sleep(scheduler.wait())
+
+
+async def report(streams, protocol, interval, printer=print):
+    previous = {stream.name: 0 for stream in streams}
+    while True:
+        await asyncio.sleep(interval)
+        lines = []
+        for stream in streams:
+            rate = (stream.forwarded - previous[stream.name]) / interval
+            previous[stream.name] = stream.forwarded
+            lines.append('{:<16} {:<16} {:>6.1f} pkt/s  id {:>10}  received {:>8}  invalid {:>6}  send errors {:>6}  '
+                         'lost {:>6}  gaps {:>5}  longest {:>6.0f} ms  resubscribed {:>5}'.format(
+                             stream.name, stream.ps_ip, rate, stream.pktid, stream.received,
+                             stream.invalid + stream.worker_invalid, stream.send_errors + stream.worker_send_errors,
+                             stream.sequence.lost, stream.heartbeat.gaps, stream.heartbeat.longest_gap * 1000,
+                             stream.heartbeat.resubscriptions))
+            if stream.dropped:
+                lines[-1] += '  dropped {:>6}'.format(stream.dropped)
+        if protocol.unknown:
+            lines.append('{} datagrams from unknown sources'.format(protocol.unknown))
+        if protocol.errors:
+            lines.append('{} socket errors not tied to a console'.format(protocol.errors))
+        printer('\n'.join(lines))
+
+
+async def run_proxy(config, status_interval=5, workers=0):
+    # workers > 0 hands decryption and decoding to that many processes, see gt_workers
+    loop = asyncio.get_running_loop()
+    streams = []
+    for console in config['consoles']:
+        infos = await loop.getaddrinfo(console['ps_ip'], None, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        ps_ip = infos[0][4][0]
+        scheduler = HeartbeatScheduler(config['heartbeat_interval'], config['gap_timeout'])
+        streams.append(ConsoleStream(console['name'], ps_ip, console['packet_version'], console['targets'], scheduler))
+    by_ip = {stream.ps_ip: stream for stream in streams}
+    if len(by_ip) != len(streams):
+        raise ValueError('several consoles resolve to the same address')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', config['receive_port']))
+    pool = None
+    if workers:
+        from gt_workers import ShardPool
+        pool = ShardPool(streams, workers)
+        pool.start()
+    transport, protocol = await loop.create_datagram_endpoint(lambda: GT7Protocol(by_ip, pool), sock=sock)
+    for stream in streams:
+        stream.protocol = protocol
+
+    tasks = [asyncio.create_task(heartbeat(stream, config['send_port'])) for stream in streams]
+    if status_interval:
+        tasks.append(asyncio.create_task(report(streams, protocol, status_interval)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        transport.close()
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,126 @@
+'''
+Batch decryption and decoding of captured GT7 packets with NumPy, for offline analysis.
+'''
+import numpy as np
+
+from gt_capture import CaptureReader
+from gt_packet_definition import packet_layouts
+from gt_replay import read_capture
+
+KEY = b'Simulator Interface Packet GT7 ver 0.0'[0:32]
+MAGIC = 0x47375330
+
+# Salsa20 "expand 32-byte k" constants and key words, shared by every packet
+SIGMA = np.frombuffer(b'expand 32-byte k', dtype='<u4')
+KEY_WORDS = np.frombuffer(KEY, dtype='<u4')
+
+# struct codes used by the packet formats and their NumPy equivalent
+NUMPY_CODES = {'i': '<i4', 'f': '<f4', 'h': '<i2', 'B': 'u1', 'c': 'S1'}
+
+
+def packet_dtype(layout):
+    # structured dtype matching the packed little-endian packet, one column per field
+    return np.dtype([(name, NUMPY_CODES[code]) for name, code in zip(layout.fields, layout.format[1:])])
+
+
+def rotl(x, n):
+    return (x << np.uint32(n)) | (x >> np.uint32(32 - n))
+
+
+def salsa20_keystream(nonces, nblocks):
+    # Keystream of nblocks 64-byte blocks for every (low, high) nonce pair, all packets at once.
+    # Returns a (len(nonces), nblocks * 64) uint8 array.
+    count = len(nonces)
+    state = np.empty((16, count, nblocks), dtype=np.uint32)
+    state[0] = SIGMA[0]
+    state[1:5] = KEY_WORDS[0:4, None, None]
+    state[5] = SIGMA[1]
+    state[6] = nonces[:, 0, None]
+    state[7] = nonces[:, 1, None]
+    state[8] = np.arange(nblocks, dtype=np.uint32)
+    state[9] = 0
+    state[10] = SIGMA[2]
+    state[11:15] = KEY_WORDS[4:8, None, None]
+    state[15] = SIGMA[3]
+
+    x = [word.copy() for word in state]
+    for _ in range(10):
+        # column round
+        x[4] ^= rotl(x[0] + x[12], 7)
+        x[8] ^= rotl(x[4] + x[0], 9)
+        x[12] ^= rotl(x[8] + x[4], 13)
+        x[0] ^= rotl(x[12] + x[8], 18)
+        x[9] ^= rotl(x[5] + x[1], 7)
+        x[13] ^= rotl(x[9] + x[5], 9)
+        x[1] ^= rotl(x[13] + x[9], 13)
+        x[5] ^= rotl(x[1] + x[13], 18)
+        x[14] ^= rotl(x[10] + x[6], 7)
+        x[2] ^= rotl(x[14] + x[10], 9)
+        x[6] ^= rotl(x[2] + x[14], 13)
+        x[10] ^= rotl(x[6] + x[2], 18)
+        x[3] ^= rotl(x[15] + x[11], 7)
+        x[7] ^= rotl(x[3] + x[15], 9)
+        x[11] ^= rotl(x[7] + x[3], 13)
+        x[15] ^= rotl(x[11] + x[7], 18)
+        # row round
+        x[1] ^= rotl(x[0] + x[3], 7)
+        x[2] ^= rotl(x[1] + x[0], 9)
+        x[3] ^= rotl(x[2] + x[1], 13)
+        x[0] ^= rotl(x[3] + x[2], 18)
+        x[6] ^= rotl(x[5] + x[4], 7)
+        x[7] ^= rotl(x[6] + x[5], 9)
+        x[4] ^= rotl(x[7] + x[6], 13)
+        x[5] ^= rotl(x[4] + x[7], 18)
+        x[11] ^= rotl(x[10] + x[9], 7)
+        x[8] ^= rotl(x[11] + x[10], 9)
+        x[9] ^= rotl(x[8] + x[11], 13)
+        x[10] ^= rotl(x[9] + x[8], 18)
+        x[12] ^= rotl(x[15] + x[14], 7)
+        x[13] ^= rotl(x[12] + x[15], 9)
+        x[14] ^= rotl(x[13] + x[12], 13)
+        x[15] ^= rotl(x[14] + x[13], 18)
+
+    words = np.stack([x[i] + state[i] for i in range(16)], axis=-1)  # (count, nblocks, 16)
+    return words.astype('<u4', copy=False).view(np.uint8).reshape(count, nblocks * 64)
+
+
+def as_packet_array(packets, size):
+    # (N, size) uint8 array from a list of datagrams or from a buffer of back to back packets.
+    # Datagrams of another size than the layout one are dropped.
+    if isinstance(packets, (list, tuple)):
+        packets = b''.join(data for data in packets if len(data) == size)
+    raw = np.frombuffer(packets, dtype=np.uint8)
+    return raw[:len(raw) - len(raw) % size].reshape(-1, size)
+
+
+def decrypt_batch(packets, packet_version='B'):
+    # Decrypt all packets at once. Returns the decrypted (N, size) array and the mask of
+    # packets carrying the GT7 magic.
+    layout = packet_layouts[packet_version]
+    raw = as_packet_array(packets, layout.size)
+    seeds = raw[:, 0x40:0x44].copy().view('<u4')[:, 0]
+    nonces = np.empty((len(raw), 2), dtype=np.uint32)
+    nonces[:, 0] = seeds ^ np.uint32(layout.xor)
+    nonces[:, 1] = seeds
+    nblocks = -(-layout.size // 64)
+    ddata = raw ^ salsa20_keystream(nonces, nblocks)[:, :layout.size]
+    valid = ddata[:, 0:4].copy().view('<u4')[:, 0] == MAGIC
+    return ddata, valid
+
+
+def decode_batch(packets, packet_version='B'):
+    # Structured array with one row per valid packet and one column per GTDataPacket field
+    ddata, valid = decrypt_batch(packets, packet_version)
+    return np.ascontiguousarray(ddata[valid]).view(packet_dtype(packet_layouts[packet_version]))[:, 0]
+
+
+def decode_capture(filename, packet_version='B', start_lap=None):
+    # GT7packets.raw.cap is read in a single call, GT7packets.cap still has to be unpickled record by record.
+    # A .gt7 capture knows its packet version and can start at a given lap.
+    if filename.endswith('.gt7'):
+        with CaptureReader(filename) as reader:
+            start = 0 if start_lap is None else reader.lap_start(start_lap)
+            return decode_batch([data for ns, data in reader.records(start)], reader.packet_version)
+    if filename.endswith('.raw.cap'):
+        return decode_batch(np.fromfile(filename, dtype=np.uint8), packet_version)
+    return decode_batch([data for timestamp, delta, data in read_capture(filename)], packet_version)
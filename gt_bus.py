@@ -0,0 +1,221 @@
+'''
+Telemetry bus: the latest decoded packets published in a named shared memory region, for dashboards, overlays
+and loggers on the same PC. They read it at their own rate, without a socket and without decrypting anything.
+
+Region layout, native byte order and alignment:
+  header   magic b'GT7T', format version, slots, slot size, packet size, heartbeat character,
+           publisher pid (0 once it is gone), frames published so far (8 bytes, offset 32)
+  slots    from offset 64, one per frame, frame n in slot (n - 1) % slots:
+           sequence (8 bytes): 2n - 1 while frame n is written, 2n once it is complete
+           the decrypted GT7 packet (the GTDataPacket layout of the heartbeat), padded to PACKET_AREA
+           derived values, see DERIVED_FIELDS
+
+A reader reads the sequence of a slot, the frame, then the sequence again: the frame is whole when both are 2n.
+'''
+import os
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+from struct import Struct
+
+from gt_packet_definition import packet_layouts
+
+BUS_NAME = 'gt7telemetry'
+# About 4 seconds of history at 60Hz
+BUS_SLOTS = 256
+MAGIC = b'GT7T'
+BUS_VERSION = 1
+HEADER = Struct('@4sIIIIIIxxxxQ')
+COUNT = Struct('@Q')
+COUNT_OFFSET = HEADER.size - COUNT.size
+# Slots start on a cache line, and so does every slot
+HEADER_AREA = 64
+SEQUENCE = Struct('@Q')
+# Large enough for every layout, the '~' packet is the longest
+PACKET_AREA = max(layout.size for layout in packet_layouts.values())
+# Computed by the proxy for every packet, the arrival time of the packet in nanoseconds since the epoch first
+DERIVED_FIELDS = ('time_ns', 'local_velocity_x', 'local_velocity_y', 'local_velocity_z', 'roll', 'pitch', 'yaw',
+                  'slip_angle')
+DERIVED = Struct('<q7f')
+PACKET_OFFSET = SEQUENCE.size
+DERIVED_OFFSET = PACKET_OFFSET + PACKET_AREA
+SLOT_SIZE = (DERIVED_OFFSET + DERIVED.size + 63) // 64 * 64
+
+Derived = namedtuple('Derived', DERIVED_FIELDS)
+
+# Regions published by this process, registered with its resource tracker for the publisher to unlink
+published = set()
+
+
+class TelemetryBus:
+    # Publisher side, one per proxy. publish() is called from the receive loop: two copies into the region and
+    # three counter updates.
+    def __init__(self, name=BUS_NAME, packet_version='B', slots=BUS_SLOTS):
+        self.layout = packet_layouts[packet_version]
+        self.slots = slots
+        size = HEADER_AREA + slots * SLOT_SIZE
+        try:
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a proxy that was killed, taken over. A region another proxy still publishes to is not.
+            stale = attach(name)
+            pid = HEADER.unpack_from(stale.buf)[6] if stale.size >= HEADER.size else 0
+            stale.close()
+            if pid and process_alive(pid):
+                raise FileExistsError('telemetry bus {} is used by process {}'.format(name, pid))
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = name
+        published.add(name)
+        self.buffer = self.memory.buf
+        self.count = 0
+        HEADER.pack_into(self.buffer, 0, MAGIC, BUS_VERSION, slots, SLOT_SIZE, self.layout.size,
+                         self.layout.heartbeat[0], os.getpid(), 0)
+
+    def publish(self, ddata, time_ns, derived):
+        # time_ns: arrival of the packet in ns since the epoch, the kernel timestamp when there is one.
+        # derived: local velocity x, y, z, roll, pitch, yaw and slip angle
+        count = self.count + 1
+        base = HEADER_AREA + (count - 1) % self.slots * SLOT_SIZE
+        buffer = self.buffer
+        SEQUENCE.pack_into(buffer, base, 2 * count - 1)
+        buffer[base + PACKET_OFFSET:base + PACKET_OFFSET + len(ddata)] = ddata
+        DERIVED.pack_into(buffer, base + DERIVED_OFFSET, time_ns, *derived)
+        SEQUENCE.pack_into(buffer, base, 2 * count)
+        COUNT.pack_into(buffer, COUNT_OFFSET, count)
+        self.count = count
+
+    def close(self):
+        if self.buffer is None:
+            return
+        # Readers still attached see the pid go to 0, new ones no longer find the region
+        HEADER.pack_into(self.buffer, 0, MAGIC, BUS_VERSION, self.slots, SLOT_SIZE, self.layout.size,
+                         self.layout.heartbeat[0], 0, self.count)
+        self.buffer = None
+        self.memory.close()
+        self.memory.unlink()
+        published.discard(self.name)
+
+
+class TelemetryBusReader:
+    # Reader side, any number of them in any process. latest() is the newest frame, read() what was published
+    # after a given frame and is still in the ring, oldest first. Frames are (n, packet record, Derived).
+    def __init__(self, name=BUS_NAME):
+        self.memory = attach(name)
+        self.buffer = self.memory.buf
+        magic, version, self.slots, self.slot_size, packet_size, heartbeat, pid, count = \
+            HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != BUS_VERSION:
+            self.close()
+            raise ValueError('{} is not a version {} telemetry bus'.format(name, BUS_VERSION))
+        self.layout = packet_layouts[chr(heartbeat)]
+        self.record = self.layout.record
+
+    @property
+    def live(self):
+        # False once the proxy has closed the bus, a new proxy publishes to a new region
+        return HEADER.unpack_from(self.buffer)[6] != 0
+
+    @property
+    def count(self):
+        return COUNT.unpack_from(self.buffer, COUNT_OFFSET)[0]
+
+    def frame(self, n):
+        # Frame n if it is still in the ring and was not overwritten while being read, None otherwise
+        base = HEADER_AREA + (n - 1) % self.slots * self.slot_size
+        buffer = self.buffer
+        if SEQUENCE.unpack_from(buffer, base)[0] != 2 * n:
+            return None
+        packet = self.record(buffer, base + PACKET_OFFSET)
+        derived = Derived._make(DERIVED.unpack_from(buffer, base + DERIVED_OFFSET))
+        if SEQUENCE.unpack_from(buffer, base)[0] != 2 * n:
+            return None
+        return n, packet, derived
+
+    def latest(self):
+        # None before the first frame
+        while True:
+            n = self.count
+            if not n:
+                return None
+            frame = self.frame(n)
+            if frame is not None:
+                return frame
+            # Overwritten while being read, there is a newer one
+
+    def read(self, after=0):
+        n = self.count
+        frames = []
+        for i in range(max(after + 1, n - self.slots + 1, 1), n + 1):
+            frame = self.frame(i)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+    def close(self):
+        if self.buffer is None:
+            return
+        self.buffer = None
+        self.memory.close()
+
+
+def attach(name):
+    # Opens an existing region without leaving it to the resource tracker, which unlinks what a process opened
+    # when it exits and would take the bus away from the proxy. Python 3.13 has track=False for this, before
+    # that the region is unregistered once opened (the tracker only exists on POSIX), unless this process
+    # publishes it: the tracker holds a name once, and that registration is the publisher's.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    memory = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix' and name not in published:
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+def process_alive(pid):
+    # Signal 0 only checks on POSIX, on Windows os.kill() terminates. A region there goes away with its last
+    # handle, so one that exists is in use.
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Print what GT7Proxy publishes on its telemetry bus')
+    parser.add_argument("--bus",
+                        type=str,
+                        default=BUS_NAME,
+                        help="Name of the shared memory region. Default is " + BUS_NAME)
+    parser.add_argument("--rate",
+                        type=float,
+                        default=10,
+                        help="Lines per second. Default is 10")
+    args = parser.parse_args()
+    try:
+        reader = TelemetryBusReader(args.bus)
+    except (OSError, ValueError) as e:
+        raise SystemExit(e)
+    try:
+        while reader.live:
+            frame = reader.latest()
+            if frame is not None:
+                n, packet, derived = frame
+                print('{:>8}  id {:>10}  lap {:>3}  {:>6.1f} km/h  rpm {:>6.0f}  roll {:>6.3f}  pitch {:>6.3f}  '
+                      'yaw {:>6.3f}  slip {:>6.3f}'.format(n, packet.pkt_id, packet.current_lap, packet.speed * 3.6,
+                                                           packet.rpm, derived.roll, derived.pitch, derived.yaw,
+                                                           derived.slip_angle))
+            time.sleep(1 / args.rate)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
@@ -0,0 +1,346 @@
+'''
+GT7 capture files (.gt7): length-prefixed packets with nanosecond timestamps, grouped in optionally
+compressed chunks, with an index of chunks and lap boundaries for random access.
+
+Layout, all little-endian:
+    header   'GT7CAP', format version, packet version (A, B or ~), flags, wall clock start in ns
+    chunks   'CHNK', flags, packet count, stored size, raw size, number of its first packet,
+             then the (zlib compressed if flagged) records: ns since start (u64), length (u16), data
+    index    'GIDX', chunk and lap counts, one entry per chunk then one per lap
+    trailer  offset of the index, 'GT7E'
+A capture whose writer was killed has no index, it is rebuilt by walking the chunks.
+'''
+import datetime
+import mmap
+import struct
+import sys
+import time
+import zlib
+from bisect import bisect_right
+
+from gt_packet_definition import packet_layouts, gt_offsets
+from gt_processing import salsa20_dec
+
+CAPTURE_MAGIC = b'GT7CAP'
+CAPTURE_VERSION = 1
+COMPRESSED = 1
+
+HEADER = struct.Struct('<6sHcBxxq')
+CHUNK = struct.Struct('<4sBxxxIIIQ')
+RECORD = struct.Struct('<QH')
+INDEX = struct.Struct('<4sII')
+CHUNK_ENTRY = struct.Struct('<QIQQii')  # offset, count, first packet, first ns, first and last pkt_id
+LAP_ENTRY = struct.Struct('<iQi')  # lap, first packet, its pkt_id
+TRAILER = struct.Struct('<Q4s')
+
+# 10s of telemetry per chunk
+CHUNK_PACKETS = 600
+
+PKT_ID = struct.Struct('<i')
+CURRENT_LAP = struct.Struct('<h')
+
+
+class CaptureError(ValueError):
+    pass
+
+
+def packet_index(data, layout):
+    # pkt_id and lap of an encrypted packet, (None, None) when it does not decrypt
+    ddata = salsa20_dec(data, layout.xor)
+    if len(ddata) < layout.size:
+        return None, None
+    return PKT_ID.unpack_from(ddata, gt_offsets['pkt_id'][0])[0], \
+        CURRENT_LAP.unpack_from(ddata, gt_offsets['current_lap'][0])[0]
+
+
+def capture_packet_version(filename):
+    # Packet version recorded in the header, without mapping the file nor reading its index
+    with open(filename, 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size or header[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+        raise CaptureError('{} is not a GT7 capture'.format(filename))
+    return HEADER.unpack(header)[2].decode()
+
+
+class CaptureWriter:
+    # Packets are buffered into a chunk, a chunk reaches the disk once full or on close()
+    def __init__(self, filename, packet_version='B', compress=False, chunk_packets=CHUNK_PACKETS):
+        self.layout = packet_layouts[packet_version]
+        self.compress = compress
+        self.chunk_packets = chunk_packets
+        self.f = open(filename, 'wb')
+        self.f.write(HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, packet_version.encode(),
+                                 COMPRESSED if compress else 0, time.time_ns()))
+        self.start_ns = None
+        self.packets = 0
+        self.chunks = []
+        self.laps = []
+        self.lap = None
+        self.buffer = bytearray()
+        self.count = 0
+        self.first_ns = 0
+        self.first_pkt_id = -1
+        self.last_pkt_id = -1
+
+    def write(self, data, ns=None, pkt_id=None, lap=None):
+        # ns is a time.monotonic_ns() reading taken when the packet was received. pkt_id and lap come from the
+        # decrypted packet, packets given without them (not decrypted, not valid) are stored but not indexed.
+        if ns is None:
+            ns = time.monotonic_ns()
+        if self.start_ns is None:
+            self.start_ns = ns
+        ns -= self.start_ns
+        if self.count == 0:
+            self.first_ns = ns
+            self.first_pkt_id = -1
+        if pkt_id is not None:
+            self.index_packet(pkt_id, lap)
+        self.buffer += RECORD.pack(ns, len(data))
+        self.buffer += data
+        self.count += 1
+        self.packets += 1
+        if self.count >= self.chunk_packets:
+            self.flush_chunk()
+
+    def index_packet(self, pkt_id, lap):
+        if self.first_pkt_id < 0:
+            self.first_pkt_id = pkt_id
+        self.last_pkt_id = pkt_id
+        if lap != self.lap:
+            self.lap = lap
+            self.laps.append((lap, self.packets, pkt_id))
+
+    def flush_chunk(self):
+        if not self.count:
+            return
+        payload = self.buffer
+        flags = 0
+        if self.compress:
+            # encrypted packets hardly compress, a chunk that would grow is stored as is
+            compressed = zlib.compress(self.buffer, 1)
+            if len(compressed) < len(self.buffer):
+                payload = compressed
+                flags = COMPRESSED
+        offset = self.f.tell()
+        self.f.write(CHUNK.pack(b'CHNK', flags, self.count, len(payload), len(self.buffer),
+                                self.packets - self.count))
+        self.f.write(payload)
+        self.chunks.append((offset, self.count, self.packets - self.count, self.first_ns, self.first_pkt_id,
+                            self.last_pkt_id))
+        self.buffer = bytearray()
+        self.count = 0
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.flush_chunk()
+        offset = self.f.tell()
+        self.f.write(INDEX.pack(b'GIDX', len(self.chunks), len(self.laps)))
+        for entry in self.chunks:
+            self.f.write(CHUNK_ENTRY.pack(*entry))
+        for entry in self.laps:
+            self.f.write(LAP_ENTRY.pack(*entry))
+        self.f.write(TRAILER.pack(offset, b'GT7E'))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    # The file is mapped, only the chunks that are actually read get decompressed
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, 'rb')
+        try:
+            self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.f.close()
+            raise CaptureError('{} is empty'.format(filename))
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise CaptureError('{} is not a GT7 capture'.format(filename))
+        magic, version, packet_version, self.flags, self.wall_start_ns = HEADER.unpack_from(self.map)
+        if magic != CAPTURE_MAGIC:
+            self.close()
+            raise CaptureError('{} is not a GT7 capture'.format(filename))
+        if version > CAPTURE_VERSION:
+            self.close()
+            raise CaptureError('{} uses capture format {}, only {} is supported'.format(filename, version,
+                                                                                         CAPTURE_VERSION))
+        self.packet_version = packet_version.decode()
+        self.chunks = []
+        self.laps = []
+        if not self.read_index():
+            self.rebuild_index()
+        self.chunk_starts = [entry[2] for entry in self.chunks]
+
+    def read_index(self):
+        if len(self.map) < HEADER.size + TRAILER.size:
+            return False
+        offset, magic = TRAILER.unpack_from(self.map, len(self.map) - TRAILER.size)
+        if magic != b'GT7E' or offset + INDEX.size > len(self.map):
+            return False
+        tag, nchunks, nlaps = INDEX.unpack_from(self.map, offset)
+        if tag != b'GIDX':
+            return False
+        offset += INDEX.size
+        for i in range(nchunks):
+            self.chunks.append(CHUNK_ENTRY.unpack_from(self.map, offset))
+            offset += CHUNK_ENTRY.size
+        for i in range(nlaps):
+            self.laps.append(LAP_ENTRY.unpack_from(self.map, offset))
+            offset += LAP_ENTRY.size
+        return True
+
+    def rebuild_index(self):
+        # Writer did not close the file: walk the complete chunks, decrypting packets to find the laps
+        layout = packet_layouts[self.packet_version]
+        offset = HEADER.size
+        lap = None
+        while offset + CHUNK.size <= len(self.map):
+            tag, flags, count, stored, raw, first = CHUNK.unpack_from(self.map, offset)
+            if tag != b'CHNK' or offset + CHUNK.size + stored > len(self.map):
+                break
+            first_ns = None
+            first_pkt_id = last_pkt_id = -1
+            for i, (ns, data) in enumerate(self.chunk_records(offset)):
+                if first_ns is None:
+                    first_ns = ns
+                pkt_id, current_lap = packet_index(data, layout)
+                if pkt_id is None:
+                    continue
+                if first_pkt_id < 0:
+                    first_pkt_id = pkt_id
+                last_pkt_id = pkt_id
+                if current_lap != lap:
+                    lap = current_lap
+                    self.laps.append((lap, first + i, pkt_id))
+            self.chunks.append((offset, count, first, first_ns or 0, first_pkt_id, last_pkt_id))
+            offset += CHUNK.size + stored
+
+    def chunk_records(self, offset):
+        tag, flags, count, stored, raw, first = CHUNK.unpack_from(self.map, offset)
+        start = offset + CHUNK.size
+        if flags & COMPRESSED:
+            payload = zlib.decompress(self.map[start:start + stored])
+            pos = 0
+        else:
+            # slicing the map copies, no view is left behind to keep it from being closed
+            payload = self.map
+            pos = start
+        for i in range(count):
+            ns, length = RECORD.unpack_from(payload, pos)
+            pos += RECORD.size
+            yield ns, payload[pos:pos + length]
+            pos += length
+
+    def __len__(self):
+        if not self.chunks:
+            return 0
+        return self.chunks[-1][2] + self.chunks[-1][1]
+
+    def records(self, start=0):
+        # (ns since the capture started, packet) from packet number start onwards
+        chunk = max(bisect_right(self.chunk_starts, start) - 1, 0)
+        for offset, count, first, first_ns, first_pkt_id, last_pkt_id in self.chunks[chunk:]:
+            for i, record in enumerate(self.chunk_records(offset)):
+                if first + i >= start:
+                    yield record
+
+    def lap_start(self, lap):
+        # Number of the first packet of the first occurrence of lap
+        for current_lap, packet, pkt_id in self.laps:
+            if current_lap == lap:
+                return packet
+        raise CaptureError('lap {} is not in {}'.format(lap, self.filename))
+
+    def pkt_id_start(self, pkt_id):
+        # Number of the first packet of the chunk holding pkt_id, ids restart when GT7 does
+        for offset, count, first, first_ns, first_pkt_id, last_pkt_id in self.chunks:
+            if first_pkt_id <= pkt_id <= last_pkt_id:
+                return first
+        raise CaptureError('pkt_id {} is not in {}'.format(pkt_id, self.filename))
+
+    def close(self):
+        self.map.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_gt7_capture(filename, start_lap=None):
+    # Same records as gt_replay.read_capture, the delta being rebuilt from the timestamps.
+    # The file is opened and the lap looked up right away so that errors show before the replay starts.
+    reader = CaptureReader(filename)
+    try:
+        start = 0 if start_lap is None else reader.lap_start(start_lap)
+    except CaptureError:
+        reader.close()
+        raise
+    return gt7_records(reader, start)
+
+
+def gt7_records(reader, start):
+    with reader:
+        previous = None
+        for ns, data in reader.records(start):
+            delta = datetime.timedelta(microseconds=(ns - (ns if previous is None else previous)) / 1000)
+            previous = ns
+            yield [ns, delta, data]
+
+
+def convert(source, destination, packet_version='B', compress=False):
+    # GT7packets.cap (pickle) or GT7packets.raw.cap to .gt7, timestamps are rebuilt from the deltas
+    from gt_replay import open_capture, DEFAULT_INTERVAL
+    # Packets are decrypted here for the index, the proxy hands over the ids it has already decrypted
+    layout = packet_layouts[packet_version]
+    ns = 0
+    with CaptureWriter(destination, packet_version, compress) as writer:
+        for timestamp, delta, data in open_capture(source, layout.size):
+            ns += int(DEFAULT_INTERVAL * 1e9) if delta is None else delta // datetime.timedelta(microseconds=1) * 1000
+            writer.write(data, ns, *packet_index(data, layout))
+    return writer.packets
+
+
+def info(filename):
+    with CaptureReader(filename) as reader:
+        print('{}: packet version {}, {} packets in {} chunks{}, started {:%Y-%m-%d %H:%M:%S}'.format(
+            filename, reader.packet_version, len(reader), len(reader.chunks),
+            ' (compressed)' if reader.flags & COMPRESSED else '',
+            datetime.datetime.fromtimestamp(reader.wall_start_ns / 1e9)))
+        for lap, packet, pkt_id in reader.laps:
+            print('lap {:>4}  packet {:>9}  pkt_id {:>10}'.format(lap, packet, pkt_id))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Inspect .gt7 captures or convert older captures to them')
+    parser.add_argument("capture",
+                        type=str,
+                        help="Capture to inspect, or GT7packets.cap / GT7packets.raw.cap to convert")
+    parser.add_argument("--convert",
+                        type=str,
+                        default=None,
+                        help="Write the capture as this .gt7 file")
+    parser.add_argument("--packet_version",
+                        type=str,
+                        default='B',
+                        choices=list(packet_layouts),
+                        help="Packet layout of the capture being converted. Default is B")
+    args = parser.parse_args()
+    try:
+        if args.convert:
+            print('{} packets written to {}'.format(convert(args.capture, args.convert, args.packet_version),
+                                                   args.convert))
+        else:
+            info(args.capture)
+    except CaptureError as e:
+        sys.exit(e)
@@ -0,0 +1,466 @@
+'''
+Live telemetry dashboard drawn with ANSI escape sequences.
+'''
+import struct
+import sys
+import time
+from datetime import timedelta as td
+
+from gt_processing import secondsToLaptime
+
+# ansi prefix
+pref = "\033["
+
+
+class Screen:
+    # Model of the terminal. printAt only records what a region should show, render() then
+    # writes the regions that changed since the previous frame in a single write.
+    # refresh_rate caps the number of frames per second, independently of the telemetry rate.
+    def __init__(self, refresh_rate=15, out=None):
+        self.regions = {}  # (row, column) -> [style, text, shown style, shown text]
+        self.dirty = {}  # regions to write, in the order they were printed
+        self.interval = 1.0 / refresh_rate if refresh_rate > 0 else 0
+        self.next_frame = 0.0
+        self.out = out
+        self.frames = 0
+
+    def set_refresh_rate(self, refresh_rate):
+        self.interval = 1.0 / refresh_rate if refresh_rate > 0 else 0
+
+    def put(self, text, row, column, style):
+        key = (row, column)
+        region = self.regions.get(key)
+        if region is None:
+            self.regions[key] = [style, text, None, None]
+            self.dirty[key] = None
+        elif region[0] != style or region[1] != text:
+            region[0] = style
+            region[1] = text
+            self.dirty[key] = None
+
+    def due(self):
+        # True when a new frame may be drawn
+        now = time.monotonic()
+        if now < self.next_frame:
+            return False
+        self.next_frame = now + self.interval
+        return True
+
+    def render(self):
+        if not self.dirty:
+            return
+        parts = []
+        for key in self.dirty:
+            region = self.regions[key]
+            style, text, shown_style, shown_text = region
+            if text == shown_text and style == shown_style:
+                continue
+            row, column = key
+            if style == shown_style and shown_text is not None and len(text) == len(shown_text):
+                # same layout, only rewrite from the first to the last changed character
+                start = 0
+                while text[start] == shown_text[start]:
+                    start += 1
+                end = len(text)
+                while text[end - 1] == shown_text[end - 1]:
+                    end -= 1
+                parts.append('{}{};{}H{}{}'.format(pref, row, column + start, style, text[start:end]))
+            else:
+                parts.append('{}{};{}H{}{}'.format(pref, row, column, style, text))
+            region[2] = style
+            region[3] = text
+        self.dirty.clear()
+        if parts:
+            out = self.out or sys.stdout
+            out.write(''.join(parts))
+            out.flush()
+            self.frames += 1
+
+
+screen = Screen()
+
+# generic print function, draws on the module screen
+
+
+def printAt(text, row=1, column=1, bold=0, underline=0, reverse=0):
+    style = '{}0m'.format(pref)
+    if reverse:
+        style += '{}7m'.format(pref)
+    if bold:
+        style += '{}1m'.format(pref)
+    if underline:
+        style += '{}4m'.format(pref)
+    # text = str(text.encode('cp850'))
+    screen.put(text, row, column, style)
+
+
+# static part of the screen, drawn once
+
+
+def draw_layout(silent):
+    printAt('GT7 Telemetry Display and XSim Proxy 1.8.0 (ctrl-c to quit)', 1, 1, bold=1)
+    printAt('Packet ID:', 1, 73)
+    printAt('{:<92}'.format('Current Track Data'), 3, 1, reverse=1, bold=1)
+    printAt('Time on track:', 3, 41, reverse=1, bold=1)
+    printAt('Laps:    /', 5, 1)
+    printAt('Position:   /', 5, 21)
+    printAt('Best Lap Time:', 7, 1)
+    printAt('Current Lap Time: ', 7, 31)
+    printAt('Last Lap Time:', 8, 1)
+    printAt('Calc Lap Time: ', 8, 31)
+    printAt('{:<92}'.format('Current Car Data'), 10, 1, reverse=1, bold=1)
+    printAt('Car ID:', 10, 41, reverse=1, bold=1)
+    printAt('Throttle:    %', 12, 1)
+    printAt('RPM:        rpm', 12, 21)
+    printAt('Speed:        km/h', 12, 41)
+    printAt('Brake:       %', 13, 1)
+    printAt('Gear:   ( )', 13, 21)
+
+    if not silent:
+        printAt('Clutch:       /', 15, 1)
+        printAt('RPM After Clutch:        rpm', 15, 31)
+        printAt('Boost:        kPa', 13, 41)
+        printAt('Oil Temperature:       °C', 17, 1)
+        printAt('Water Temperature:       °C', 17, 31)
+        printAt('Oil Pressure:          bar', 18, 1)
+        printAt('Body/Ride Height:        mm', 18, 31)
+        printAt('Rev Warning       rpm', 12, 71)
+        printAt('Rev Limiter       rpm', 13, 71)
+        printAt('Max:', 14, 21)
+        printAt('Est. Speed        kph', 14, 71)
+
+        printAt('Tyre Data', 20, 1, underline=1)
+        printAt('FL:        °C', 21, 1)
+        printAt('FR:        °C', 21, 21)
+        printAt('ø:      /       cm', 21, 41)
+        printAt('           kph', 22, 1)
+        printAt('           kph', 22, 21)
+        printAt('Δ:      /       ', 22, 41)
+        printAt('RL:        °C', 25, 1)
+        printAt('RR:        °C', 25, 21)
+        printAt('ø:      /       cm', 25, 41)
+        printAt('           kph', 26, 1)
+        printAt('           kph', 26, 21)
+        printAt('Δ:      /       ', 26, 41)
+
+        printAt('Gearing', 29, 1, underline=1)
+        printAt('1st:', 30, 1)
+        printAt('2nd:', 31, 1)
+        printAt('3rd:', 32, 1)
+        printAt('4th:', 33, 1)
+        printAt('5th:', 34, 1)
+        printAt('6th:', 35, 1)
+        printAt('7th:', 36, 1)
+        printAt('8th:', 37, 1)
+        printAt('???:', 39, 1)
+
+        printAt('Position (m)', 29, 21, underline=1)
+        printAt('X:', 30, 21)
+        printAt('Y:', 31, 21)
+        printAt('Z:', 32, 21)
+
+        printAt('World. Vel (km/h)', 29, 41, underline=1)
+        printAt('X:', 30, 41)
+        printAt('Y:', 31, 41)
+        printAt('Z:', 32, 41)
+
+        printAt('Loc. Vel (km/h)', 29, 58, underline=1)
+        printAt('X:', 30, 58)
+        printAt('Y:', 31, 58)
+        printAt('Z:', 32, 58)
+
+        printAt('Rotation (°)', 34, 21, underline=1)
+        printAt('X/Pitch:', 35, 21)
+        printAt('Y/Yaw:', 36, 21)
+        printAt('Z/Roll:', 37, 21)
+
+        printAt('Angular (r/s)', 34, 41, underline=1)
+        printAt('X:', 35, 41)
+        printAt('Y:', 36, 41)
+        printAt('Z:', 37, 41)
+
+        printAt('Traction Loss', 39, 41, underline=1)
+        printAt('Slip:', 40, 41)
+
+        printAt('Acceleration (G)', 34, 58, underline=1)
+        printAt('X/Sway:', 35, 58)
+        printAt('Y/Heave:', 36, 58)
+        printAt('Z/Surge:', 37, 58)
+
+        printAt('N/S:', 39, 21)
+
+
+# values refreshed for every packet
+
+
+def draw_telemetry(telemetry, ddata, laptime, curLapTime, cgear, sgear, roll, pitch, yaw, slip_angle, Local_Velocity,
+                   silent):
+    curlap = telemetry.current_lap
+    bstlap = telemetry.best_lap_time
+    lstlap = telemetry.last_lap_time
+    pktid = telemetry.pkt_id
+    if curlap > 0:
+        printAt('{:>9}'.format(secondsToLaptime(
+            curLapTime.total_seconds())), 7, 49)
+    else:
+        printAt('{:>9}'.format(''), 7, 49)
+    if cgear < 1:
+        cgear = 'R'
+    if sgear > 14:
+        sgear = '–'
+    boost = telemetry.boost - 1
+    hasTurbo = True if boost > -1 else False
+    tyreDiamFL = telemetry.tire_radius_FL
+    tyreDiamFR = telemetry.tire_radius_FR
+    tyreDiamRL = telemetry.tire_radius_RL
+    tyreDiamRR = telemetry.tire_radius_RR
+    tyreSpeedFL = abs(3.6 * tyreDiamFL * telemetry.tire_rps_FL)
+    tyreSpeedFR = abs(3.6 * tyreDiamFR * telemetry.tire_rps_FR)
+    tyreSpeedRL = abs(3.6 * tyreDiamRL * telemetry.tire_rps_RL)
+    tyreSpeedRR = abs(3.6 * tyreDiamRR * telemetry.tire_rps_RR)
+    carSpeed = telemetry.speed
+    if carSpeed > 0:
+        tyreSlipRatioFL = '{:6.2f}'.format(tyreSpeedFL / carSpeed)
+        tyreSlipRatioFR = '{:6.2f}'.format(tyreSpeedFR / carSpeed)
+        tyreSlipRatioRL = '{:6.2f}'.format(tyreSpeedRL / carSpeed)
+        tyreSlipRatioRR = '{:6.2f}'.format(tyreSpeedRR / carSpeed)
+    else:
+        tyreSlipRatioFL = '  –  '
+        tyreSlipRatioFR = '  –  '
+        tyreSlipRatioRL = '  -  '
+        tyreSlipRatioRR = '  –  '
+    printAt('{:>8}'.format(str(td(seconds=round(telemetry.day_progression_ms / 1000)))),
+            3, 56, reverse=1)  # time of day on track
+    printAt('{:3.0f}'.format(curlap), 5, 7)  # current lap
+    printAt('{:3.0f}'.format(telemetry.total_laps),
+            5, 11)  # total laps
+    printAt('{:2.0f}'.format(telemetry.pre_race_start_position),
+            5, 31)  # current position
+    printAt('{:2.0f}'.format(telemetry.pre_race_num_cars),
+            5, 34)  # total positions
+    if bstlap != -1:
+        printAt('{:>9}'.format(secondsToLaptime(
+            bstlap / 1000)), 7, 16)  # best lap time
+    else:
+        printAt('{:>9}'.format(''), 7, 16)
+    if lstlap != -1:
+        printAt('{:>9}'.format(secondsToLaptime(
+            lstlap / 1000)), 8, 16)  # last lap time
+    else:
+        printAt('{:>9}'.format(''), 8, 16)
+    printAt(str(laptime), 8, 49)
+    printAt('{:5.0f}'.format(telemetry.car_code),
+            10, 48, reverse=1)  # car id
+    printAt('{:3.0f}'.format(telemetry.throttle / 2.55),
+            12, 11)  # throttle
+    printAt('{:7.0f}'.format(telemetry.rpm), 12, 25)  # rpm
+    printAt('{:7.1f}'.format(carSpeed * 3.6), 12, 47)  # speed kph
+    printAt('{:3.0f}'.format(telemetry.brake / 2.55), 13, 11)  # brake
+    printAt('{}'.format(cgear), 13, 27)  # actual gear
+    printAt('{}'.format(sgear), 13, 30)  # suggested gear
+    printAt('{:>10}'.format(pktid), 1, 83)  # packet id
+
+    if not silent:
+        fuelCapacity = telemetry.fuel_capacity
+        isEV = False if fuelCapacity > 0 else True
+        if isEV:
+            printAt('Charge:', 14, 1)
+            printAt('{:3.0f} kWh'.format(telemetry.fuel_level),
+                    14, 11)  # charge remaining
+            printAt('??? kWh'.format(telemetry.fuel_capacity),
+                    14, 29)  # max battery capacity
+        else:
+            printAt('Fuel:  ', 14, 1)
+            printAt('{:3.0f} lit'.format(
+                telemetry.fuel_level), 14, 11)  # fuel
+            printAt('{:3.0f} lit'.format(
+                telemetry.fuel_capacity), 14, 29)  # max fuel
+
+        if hasTurbo:
+            printAt('{:7.2f}'.format(
+                telemetry.boost - 1), 13, 47)  # boost
+        else:
+            printAt('{:>7}'.format('–'), 13, 47)  # no turbo
+
+        printAt('{:5.0f}'.format(telemetry.max_alert_rpm),
+                13, 83)  # rpm rev limiter
+        printAt('{:5.0f}'.format(telemetry.min_alert_rpm),
+                12, 83)  # rpm rev warning
+        printAt('{:5.0f}'.format(telemetry.calculated_max_speed),
+                14, 83)  # estimated top speed
+        printAt('{:5.3f}'.format(
+            telemetry.clutch_pedal), 15, 9)  # clutch
+        printAt('{:5.3f}'.format(telemetry.clutch_engagement),
+                15, 17)  # clutch engaged
+        printAt('{:7.0f}'.format(telemetry.rpm_clutch_gearbox),
+                15, 48)  # rpm after clutch
+        printAt('{:6.1f}'.format(telemetry.oil_temperature),
+                17, 17)  # oil temp
+        printAt('{:6.1f}'.format(telemetry.water_temperature),
+                17, 49)  # water temp
+        printAt('{:6.2f}'.format(telemetry.oil_pressure_bar),
+                18, 17)  # oil pressure
+        printAt('{:6.0f}'.format(1000 * telemetry.body_height),
+                18, 49)  # ride height
+        printAt('{:6.1f}'.format(telemetry.tire_temp_FL),
+                21, 5)  # tyre temp FL
+        printAt('{:6.1f}'.format(telemetry.tire_temp_FR),
+                21, 25)  # tyre temp FR
+        printAt('{:6.1f}'.format(telemetry.tire_temp_RL),
+                25, 5)  # tyre temp RL
+        printAt('{:6.1f}'.format(telemetry.tire_temp_RR),
+                25, 25)  # tyre temp RR
+        printAt('{:6.1f}'.format(200 * tyreDiamFL),
+                21, 43)  # tyre diameter FL
+        printAt('{:6.1f}'.format(200 * tyreDiamFR),
+                21, 50)  # tyre diameter FR
+        printAt('{:6.1f}'.format(200 * tyreDiamRL),
+                25, 43)  # tyre diameter RL
+        printAt('{:6.1f}'.format(200 * tyreDiamRR),
+                25, 50)  # tyre diameter RR
+        printAt('{:6.1f}'.format(tyreSpeedFL), 22, 5)  # tyre speed FL
+        printAt('{:6.1f}'.format(tyreSpeedFR), 22, 25)  # tyre speed FR
+        printAt('{:6.1f}'.format(tyreSpeedRL), 26, 5)  # tyre speed RL
+        printAt('{:6.1f}'.format(tyreSpeedRR), 26, 25)  # tyre speed RR
+        printAt(tyreSlipRatioFL, 22, 43)  # tyre slip ratio FL
+        printAt(tyreSlipRatioFR, 22, 50)  # tyre slip ratio FR
+        printAt(tyreSlipRatioRL, 26, 43)  # tyre slip ratio RL
+        printAt(tyreSlipRatioRR, 26, 50)  # tyre slip ratio RR
+        printAt('{:6.3f}'.format(telemetry.susp_height_FL),
+                23, 5)  # suspension FL
+        printAt('{:6.3f}'.format(telemetry.susp_height_FR),
+                23, 25)  # suspension FR
+        printAt('{:6.3f}'.format(telemetry.susp_height_RL),
+                27, 5)  # suspension RL
+        printAt('{:6.3f}'.format(telemetry.susp_height_RR),
+                27, 25)  # suspension RR
+        printAt('{:7.3f}'.format(
+            telemetry.gear_ratio1), 30, 5)  # 1st gear
+        printAt('{:7.3f}'.format(
+            telemetry.gear_ratio2), 31, 5)  # 2nd gear
+        printAt('{:7.3f}'.format(
+            telemetry.gear_ratio3), 32, 5)  # 3rd gear
+        printAt('{:7.3f}'.format(
+            telemetry.gear_ratio4), 33, 5)  # 4th gear
+        printAt('{:7.3f}'.format(
+            telemetry.gear_ratio5), 34, 5)  # 5th gear
+        printAt('{:7.3f}'.format(
+            telemetry.gear_ratio6), 35, 5)  # 6th gear
+        printAt('{:7.3f}'.format(
+            telemetry.gear_ratio7), 36, 5)  # 7th gear
+        printAt('{:7.3f}'.format(
+            telemetry.gear_ratio8), 37, 5)  # 8th gear
+        printAt('{:7.3f}'.format(
+            telemetry.transmission_top_speed), 39, 5)  # ??? gear
+        printAt('{:11.4f}'.format(
+            telemetry.position_x), 30, 28)  # pos X
+        printAt('{:11.4f}'.format(
+            telemetry.position_y), 31, 28)  # pos Y
+        printAt('{:11.4f}'.format(
+            telemetry.position_z), 32, 28)  # pos Z
+        printAt('{:11.4f}'.format(telemetry.world_velocity_x * 3.6),
+                30, 43)  # velocity X
+        printAt('{:11.4f}'.format(telemetry.world_velocity_y * 3.6),
+                31, 43)  # velocity Y
+        printAt('{:11.4f}'.format(telemetry.world_velocity_z * 3.6),
+                32, 43)  # velocity Z
+        printAt('{:9.4f}'.format(pitch), 35, 28)  # rot Pitch
+        printAt('{:9.4f}'.format(yaw), 36, 28)  # rot Yaw
+        printAt('{:9.4f}'.format(roll), 37, 28)  # rot Roll
+        # printAt('{:9.4f}'.format(telemetry.rotation_x), 35, 28)			# rot Pitch
+        # printAt('{:9.4f}'.format(telemetry.rotation_y), 36, 28)			# rot Yaw
+        # printAt('{:9.4f}'.format(telemetry.rotation_z), 37, 28)			# rot Roll
+        printAt('{:9.4f}'.format(telemetry.angularvelocity_x), 35, 45)
+        printAt('{:9.4f}'.format(telemetry.angularvelocity_y), 36, 45)
+        printAt('{:9.4f}'.format(telemetry.angularvelocity_z), 37, 45)
+        printAt('{:9.4f}'.format(slip_angle), 40, 45)
+        # Local velocity X
+        printAt('{:9.4f}'.format(Local_Velocity[0] * 3.6), 30, 60)
+        # Local velocity  Y
+        printAt('{:9.4f}'.format(Local_Velocity[1] * 3.6), 31, 60)
+        # Local velocity  Z
+        printAt('{:9.4f}'.format(Local_Velocity[2] * 3.6), 32, 60)
+        printAt('{:9.4f}'.format(telemetry.Sway), 35, 65)  # acceleration X
+        printAt('{:9.4f}'.format(telemetry.Heave), 36, 65)  # acceleration Y
+        printAt('{:9.4f}'.format(telemetry.Surge), 37, 65)  # acceleration Z
+        printAt('{:7.4f}'.format(
+            telemetry.northorientation), 39, 25)  # rot ???
+        printAt('0x8E BITS  =  {:0>8}'.format(
+            bin(struct.unpack('B', ddata[0x8E:0x8E + 1])[0])[2:]), 23, 71)
+        # various flags (see https://github.com/Nenkai/PDTools/blob/master/PDTools.SimulatorInterface/SimulatorPacket.cs)
+        printAt('0x8F BITS  =  {:0>8}'.format(
+            bin(struct.unpack('B', ddata[0x8F:0x8F + 1])[0])[2:]), 24, 71)
+        printAt('0x93 BITS  =  {:0>8}'.format(
+            bin(struct.unpack('B', ddata[0x93:0x93 + 1])[0])[2:]), 25, 71)  # 0x93 = ???
+        printAt('Map X {:11.5f}'.format(
+            telemetry.road_plane_x), 27, 73)  # 0x94 = ???
+        printAt('Map Y {:11.5f}'.format(
+            telemetry.road_plane_y), 28, 73)  # 0x98 = ???
+        printAt('Map Z {:11.5f}'.format(
+            telemetry.road_plane_z), 29, 73)  # 0x9C = ???
+        printAt('Map Dist {:11.5f}'.format(
+            telemetry.road_plane_dist), 30, 73)  # 0xA0 = ???
+    # printAt('0xD4 FLOAT {:11.5f}'.format(struct.unpack('f', ddata[0xD4:0xD4+4])[0]), 32, 71)			# 0xD4 = ???
+    # printAt('0xD8 FLOAT {:11.5f}'.format(struct.unpack('f', ddata[0xD8:0xD8+4])[0]), 33, 71)			# 0xD8 = ???
+    # printAt('0xDC FLOAT {:11.5f}'.format(struct.unpack('f', ddata[0xDC:0xDC+4])[0]), 34, 71)			# 0xDC = ???
+    # printAt('0xE0 FLOAT {:11.5f}'.format(struct.unpack('f', ddata[0xE0:0xE0+4])[0]), 35, 71)			# 0xE0 = ???
+
+    # printAt('0xE4 FLOAT {:11.5f}'.format(struct.unpack('f', ddata[0xE4:0xE4+4])[0]), 36, 71)			# 0xE4 = ???
+    # printAt('0xE8 FLOAT {:11.5f}'.format(struct.unpack('f', ddata[0xE8:0xE8+4])[0]), 37, 71)			# 0xE8 = ???
+    # printAt('0xEC FLOAT {:11.5f}'.format(struct.unpack('f', ddata[0xEC:0xEC+4])[0]), 38, 71)			# 0xEC = ???
+    # printAt('0xF0 FLOAT {:11.5f}'.format(struct.unpack('f', ddata[0xF0:0xF0+4])[0]), 39, 71)			# 0xF0 = ???#
+
+
+# items dropped by outputs that could not keep up (see gt_pipeline)
+
+
+def draw_drops(consumers):
+    printAt('Dropped: {:>10}'.format(sum(consumer.dropped for consumer in consumers)), 2, 73)
+
+
+# stream gaps and resubscriptions (see gt_heartbeat)
+
+
+def draw_heartbeat(heartbeat):
+    printAt('Gaps: {:>5}  Last: {:>6.0f} ms  Longest: {:>6.0f} ms  Resubscribed: {:>5}'.format(
+        heartbeat.gaps, heartbeat.last_gap * 1000, heartbeat.longest_gap * 1000, heartbeat.resubscriptions), 2, 1)
+
+
+# packets lost, late or put back in order, game restarts (see gt_sequence)
+
+
+def draw_sequence(sequence):
+    printAt('Lost: {:>7}  Late: {:>5}  Reordered: {:>5}  Restarts: {:>3}'.format(
+        sequence.lost, sequence.late, sequence.reordered, sequence.resets), 2, 95)
+
+
+# live delta, sectors and lap aggregates (see gt_analytics)
+
+
+def draw_analytics(analytics):
+    printAt('{:<40}'.format('Lap Analytics'), 3, 95, reverse=1, bold=1)
+    if analytics.delta is None:
+        printAt('Delta:  {:>8}'.format('-'), 5, 95)
+    else:
+        printAt('Delta: {:>+8.3f}'.format(analytics.delta), 5, 95, bold=1)
+    best = analytics.best
+    printAt('Best:   {:>9}'.format(secondsToLaptime(best.time) if best else '-'), 5, 113)
+    reference = analytics.reference
+    printAt('Reference lap: {:>9}'.format(secondsToLaptime(reference.lap_time) if reference else '-'), 6, 95)
+    for i in range(analytics.sectors):
+        current = analytics.sector_times[i]
+        last = analytics.laps[-1].sectors[i] if analytics.laps else None
+        printAt('S{}: {:>8}  last {:>8}  best {:>8}'.format(
+            i + 1, '{:.3f}'.format(current) if current is not None else '-',
+            '{:.3f}'.format(last) if last is not None else '-',
+            '{:.3f}'.format(analytics.best_sectors[i]) if analytics.best_sectors[i] is not None else '-'),
+            7 + i, 95)
+    if analytics.laps:
+        last = analytics.laps[-1]
+        printAt('Last lap {:>3}: {:>6.1f} km/h max  {:>5.2f} l fuel  {:>6.0f} m'.format(
+            last.lap, last.max_speed, last.fuel_used, last.distance), 11, 95)
+        if last.tyre_temps:
+            printAt('Tyres °C  FL {:>5.1f}  FR {:>5.1f}  RL {:>5.1f}  RR {:>5.1f}'.format(*last.tyre_temps), 12, 95)
+        trend = analytics.tyre_trend()
+        if trend:
+            printAt('Trend °C  FL {:>+5.1f}  FR {:>+5.1f}  RL {:>+5.1f}  RR {:>+5.1f}'.format(*trend), 13, 95)
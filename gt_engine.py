@@ -0,0 +1,419 @@
+'''
+Proxy core of GT7Proxy.py without the command line nor the terminal: ProxyEngine receives packets from a
+source, decrypts them, puts them in order and forwards XSim frames to sinks, feeding the outputs of gt_pipeline
+on the way. It can be embedded in another program or driven flat out from memory.
+A source is anything that behaves like the GT7 socket: recvfrom(), sendto() for heartbeats, settimeout() and
+close(). A UDP socket (udp_source), a ReplaySocket or a QueueSource. It raises ReplayFinished when exhausted.
+A sink has send(frame) and close(): UdpSink for XSim, QueueSink to keep the frames.
+'''
+import queue
+import socket
+import time
+from datetime import datetime as dt
+from functools import partial
+from itertools import chain
+
+from gt_heartbeat import HeartbeatScheduler
+from gt_metrics import Metrics, INTERVAL_BUCKETS, JITTER_BUCKETS
+from gt_motion import Upsampler
+from gt_packet_definition import packet_layouts, GTForwardPacket, FLAG_PAUSED
+from gt_processing import salsa20_dec, LapCounter, orientation, XSimForwarder, PacketValidator
+from gt_replay import ReplayFinished
+from gt_sequence import SequenceTracker, INTERPOLATE_MAX
+
+# GT7 answers heartbeats sent to SEND_PORT by sending telemetry to RECEIVE_PORT
+RECEIVE_PORT = 33740
+SEND_PORT = 33739
+XSIM_PORT = 33800
+
+
+def console_address(host):
+    # IP the console sends from, None when heartbeats are broadcast and any console may answer
+    ip = socket.gethostbyname(host)
+    return None if ip.endswith('.255') else ip
+
+
+def udp_source(port=RECEIVE_PORT):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(('0.0.0.0', port))
+    return s
+
+
+class QueueSource:
+    # Encrypted packets handed over in memory. Given packets are followed by the end of the stream,
+    # otherwise put() them from another thread and finish() when done. Heartbeats are kept in sent.
+    def __init__(self, packets=None, address=('memory', 0)):
+        self.queue = queue.Queue()
+        self.address = address
+        self.timeout = None
+        self.packets = 0
+        self.sent = []
+        if packets is not None:
+            for data in packets:
+                self.queue.put(data)
+            self.finish()
+
+    def put(self, data):
+        self.queue.put(data)
+
+    def finish(self):
+        self.queue.put(None)
+
+    def recvfrom(self, bufsize):
+        try:
+            data = self.queue.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout('timed out')
+        if data is None:
+            # Stays finished for the next call
+            self.queue.put(None)
+            raise ReplayFinished('{} packets received from memory'.format(self.packets))
+        self.packets += 1
+        return data[:bufsize], self.address
+
+    def sendto(self, data, address):
+        self.sent.append((data, address))
+        return len(data)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def close(self):
+        pass
+
+
+class UdpSink:
+    def __init__(self, address=('127.0.0.1', XSIM_PORT)):
+        self.address = address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.settimeout(5)
+
+    def send(self, frame):
+        self.socket.sendto(frame, self.address)
+
+    def close(self):
+        self.socket.close()
+
+
+class QueueSink:
+    # Frames are views overwritten by the next one, a copy is queued
+    def __init__(self, maxsize=0):
+        self.queue = queue.Queue(maxsize)
+
+    def send(self, frame):
+        self.queue.put(bytes(frame))
+
+    def frames(self):
+        # What was queued so far
+        frames = []
+        while not self.queue.empty():
+            frames.append(self.queue.get_nowait())
+        return frames
+
+    def close(self):
+        pass
+
+
+class ProxyEngine:
+    # step() is one turn of the receive loop, run() loops until the source is exhausted. Nothing here touches
+    # the terminal or signals: the dashboard is one more consumer, fed through on_frame.
+    # Outputs are gt_pipeline consumers started by start() and flushed by close(), each with its own items:
+    # packet_logger gets what was received, csv_logger, export_logger and analytics what was decoded.
+    # on_frame(ddata, laptime, curLapTime, cgear, sgear, roll, pitch, yaw, slip_angle, Local_Velocity) is called
+    # when frame_due() says so, on_error(kind, exception) when sending ('send') or a packet ('packet') failed.
+    def __init__(self, source, sinks=(), packet_version='B', ps_address=None, heartbeat=None, reorder_window=0.0,
+                 interpolate=False, motion=None, upsample=1, packet_logger=None, csv_logger=None,
+                 export_logger=None, analytics=None, bus=None, on_frame=None, frame_due=None, on_error=None):
+        self.source = source
+        # Sources with drain() hand over everything queued at once, see gt_ingest
+        self.drain = getattr(source, 'drain', None)
+        self.sinks = list(sinks)
+        self.layout = packet_layouts[packet_version]
+        # Heartbeats go out of the source socket, nowhere when there is no console (replays, memory)
+        self.ps_address = ps_address
+        self.heartbeat = heartbeat or HeartbeatScheduler()
+        # Datagrams from anything else than the console are turned down before decryption
+        self.validator = PacketValidator(self.layout, console_address(ps_address[0]) if ps_address else None)
+        self.sequence = SequenceTracker(reorder_window)
+        self.interpolate = interpolate
+        self.forwarder = XSimForwarder(self.layout, motion)
+        self.upsampler = Upsampler(self.forwarder, upsample) if upsample > 1 and self.sinks else None
+        self.packet_logger = packet_logger
+        self.csv_logger = csv_logger
+        self.export_logger = export_logger
+        self.analytics = analytics
+        # gt_bus.TelemetryBus, written from the loop itself: a couple of copies into shared memory
+        self.bus = bus
+        self.on_frame = on_frame
+        self.frame_due = frame_due or (lambda: True)
+        self.on_error = on_error
+        self.last_error = None
+
+        self.lapcounter = LapCounter()
+        self.pktid = 0
+        self.prevlap = -1
+        self.lap_start = None
+        self.slip_angle = 0
+        self.previousts = None
+        self.previous_recv = None
+        self.previous_interval = None
+
+        # Counters are updated by the loop, the endpoint and the log only read them
+        self.metrics = metrics = Metrics()
+        self.received = metrics.counter('packets_received', 'Datagrams received')
+        self.forwarded = metrics.counter('packets_forwarded', 'Packets decoded and forwarded')
+        rejected = self.validator.rejected
+        for reason in rejected:
+            metrics.gauge('packets_rejected', 'Datagrams turned down before decoding (sender, length, magic)',
+                          partial(rejected.get, reason), reason=reason)
+        self.interpolated = metrics.counter('packets_interpolated', 'XSim frames interpolated for missing packets')
+        upsampler = self.upsampler
+        if upsampler:
+            metrics.gauge('upsampled_frames', 'XSim frames sent by --upsample', lambda: upsampler.frames)
+        sequence = self.sequence
+        metrics.gauge('packets_late', 'Packets older than the latest one sent, ignored', lambda: sequence.late)
+        metrics.gauge('packets_duplicate', 'Packets received twice, ignored', lambda: sequence.duplicates)
+        metrics.gauge('packets_reordered', 'Packets put back in order by --reorder_window',
+                      lambda: sequence.reordered)
+        metrics.gauge('packets_lost', 'Packet ids skipped by the stream', lambda: sequence.lost)
+        metrics.gauge('sequence_gaps', 'Gaps in the packet ids', lambda: sequence.gaps)
+        metrics.gauge('sequence_longest_gap', 'Most packets missing in a row', lambda: sequence.longest_gap)
+        metrics.gauge('sequence_resets', 'Packet ids restarted by the game', lambda: sequence.resets)
+        self.errors = metrics.counter('errors', 'Packets that raised while being processed')
+        self.xsim_errors = metrics.counter('xsim_send_errors', 'Failed sends to XSim')
+        self.stages = {stage: metrics.histogram('stage_seconds', 'Time spent per stage of the receive loop',
+                                                stage=stage)
+                       for stage in ('decrypt', 'decode', 'forward', 'total')}
+        self.interval = metrics.histogram('packet_interval_seconds', 'Time between two received packets',
+                                          INTERVAL_BUCKETS)
+        self.skipped = metrics.counter('packets_skipped', 'Older packets of a batch drained at once, logged only')
+        self.socket_wait = metrics.histogram('socket_wait_seconds', 'Time from the receive timestamp to the loop '
+                                             'picking the packet up')
+        self.jitter = metrics.histogram('packet_jitter_seconds', 'Difference between two consecutive packet intervals',
+                                        JITTER_BUCKETS)
+        heartbeat = self.heartbeat
+        metrics.gauge('heartbeats', 'Heartbeats sent', lambda: heartbeat.heartbeats)
+        metrics.gauge('stream_gaps', 'Gaps in the stream that triggered a resubscription', lambda: heartbeat.gaps)
+        metrics.gauge('resubscriptions', 'Resubscriptions after a gap', lambda: heartbeat.resubscriptions)
+        metrics.gauge('stream_longest_gap_seconds', 'Longest gap in the stream', lambda: heartbeat.longest_gap)
+
+        self.consumers = []
+        for consumer in (packet_logger, csv_logger, export_logger, analytics):
+            if consumer is not None:
+                self.add_consumer(consumer)
+
+    def add_consumer(self, consumer):
+        # Started, stopped and measured with the others, fed by whoever holds it (the dashboard)
+        self.consumers.append(consumer)
+        self.metrics.gauge('consumer_dropped', 'Items dropped because an output was behind',
+                           lambda: consumer.dropped, consumer=consumer.name)
+        self.metrics.gauge('consumer_queued', 'Items waiting for an output', consumer.queue.qsize,
+                           consumer=consumer.name)
+        self.metrics.register('consumer_seconds', 'Time an output spends per item (disk, terminal)',
+                              consumer.handle_time, consumer=consumer.name)
+
+    def start(self):
+        # Short socket timeout so that gaps in the stream are noticed within a few tens of ms
+        timeout = self.sequence.wait(self.heartbeat.wait())
+        self.source.settimeout(self.upsampler.wait(timeout) if self.upsampler else timeout)
+        for consumer in self.consumers:
+            consumer.start()
+
+    def run(self):
+        # Until the source is exhausted, KeyboardInterrupt goes through
+        while True:
+            try:
+                if not self.step():
+                    return
+            except Exception as e:
+                self.errors.value += 1
+                self.error('packet', e)
+
+    def step(self):
+        # One packet received, or a timeout, and whatever it released. False once the source is exhausted.
+        if self.heartbeat.poll() and self.ps_address:
+            self.source.sendto(self.layout.heartbeat, self.ps_address)
+        finished = False
+        try:
+            if self.drain:
+                batch = self.drain()
+            else:
+                data, address = self.source.recvfrom(4096)
+        except socket.timeout:
+            # Packets held by the reorder window go out once they waited long enough
+            released = self.sequence.expire(time.perf_counter())
+        except ReplayFinished:
+            # What the reorder window still holds goes out before the end
+            released = self.sequence.flush()
+            finished = True
+        else:
+            released = self.receive_batch(batch) if self.drain else self.receive(data, address)
+        # In order, without duplicates, usually the packet just received
+        for pkt_id, item, missing in released:
+            self.process(pkt_id, item, missing)
+        if self.upsampler:
+            self.send(self.upsampler.due(time.perf_counter()))
+        return not finished
+
+    def receive_batch(self, batch):
+        # (view, address, timestamp) queued since the last wakeup, oldest first. Only the newest packet goes on
+        # to XSim, the host was busy and the older ones are stale: they are logged and counted as skipped.
+        t_recv = time.perf_counter()
+        valid = []
+        for view, address, timestamp in batch:
+            self.received.value += 1
+            if self.validator.check(view, address):
+                valid.append((view, timestamp))
+        if not valid:
+            return []
+        skipped = len(valid) - 1
+        self.skipped.value += skipped
+        for view, timestamp in valid[:-1]:
+            ts, delta, ns = self.arrival(timestamp)
+            if self.packet_logger:
+                # Not decrypted, stored in the capture but left out of its index
+                self.packet_logger.offer((ts, delta, bytes(view), ns, None, None))
+        view, timestamp = valid[-1]
+        return self.accept(view, timestamp, t_recv, skipped)
+
+    def receive(self, data, address, timestamp=None):
+        t_recv = time.perf_counter()
+        self.received.value += 1
+        if not self.validator.check(data, address):
+            # Not from the console: no heartbeat gap reset, no log, no decryption
+            return []
+        return self.accept(data, timestamp, t_recv)
+
+    def accept(self, data, timestamp, t_recv, skipped=0):
+        # Receives are allocation free up to here, not decryption: salsa20 only takes bytes, so a packet from the
+        # console is copied out of the ring once (~0.1us for 316 bytes, less than wrapping the view for the C
+        # function of the binding through ctypes). The copy is also what the packet log keeps.
+        data = bytes(data)
+        ts, delta, ns = self.arrival(timestamp)
+        ddata = salsa20_dec(data, self.layout.xor)
+        t_decrypt = time.perf_counter()
+        self.stages['decrypt'].observe(t_decrypt - t_recv)
+        if len(ddata) == 0:
+            self.validator.rejected['magic'] += 1
+            if self.packet_logger:
+                self.packet_logger.offer((ts, delta, data, ns, None, None))
+            return []
+        telemetry = GTForwardPacket(ddata)
+        if self.packet_logger:
+            # The capture index needs the id and lap, the logger does not decrypt again for them
+            self.packet_logger.offer((ts, delta, data, ns, telemetry.pkt_id, telemetry.current_lap))
+        return self.sequence.push(telemetry.pkt_id, (ddata, telemetry, ts, delta, t_recv, t_decrypt, skipped),
+                                  t_decrypt)
+
+    def arrival(self, timestamp):
+        # Timing and heartbeat of a datagram from the console, timestamp is a time.time_ns() reading of its
+        # arrival when the source took one (kernel timestamps), now otherwise. Returns the arrival time in ns since
+        # the epoch, the ns since the previous arrival and a time.monotonic_ns() reading of the arrival, for the
+        # packet log. Left as integers here, the loggers turn them into datetimes or microseconds if they need to.
+        now = time.time_ns()
+        age = now - timestamp if timestamp is not None and now > timestamp else 0
+        # Perf counter time of the arrival, minus the time spent in the socket queue
+        arrived = time.perf_counter() - age / 1e9
+        if timestamp is not None:
+            self.socket_wait.observe(age / 1e9)
+        if self.previous_recv is not None:
+            self.interval.observe(arrived - self.previous_recv)
+            if self.previous_interval is not None:
+                self.jitter.observe(abs(arrived - self.previous_recv - self.previous_interval))
+            self.previous_interval = arrived - self.previous_recv
+        self.previous_recv = arrived
+        self.heartbeat.packet_received()
+        ts = now - age
+        # Time reference taken on the first packet
+        delta = ts - (self.previousts or ts)
+        self.previousts = ts
+        return ts, delta, time.monotonic_ns() - age
+
+    def process(self, pkt_id, item, missing):
+        ddata, telemetry, ts, delta, t_recv, t_decrypt, skipped = item
+        if pkt_id < self.pktid:
+            # The game restarted its packet ids, so does lap timing
+            self.lapcounter = LapCounter()
+            self.prevlap = -1
+        self.pktid = pkt_id
+        curlap = telemetry.current_lap
+        # second bit in flags is paused
+        paused = telemetry.flags & FLAG_PAUSED != 0
+        self.lapcounter.update(curlap, paused, pkt_id, telemetry.last_lap_time)
+        cgear = telemetry.suggestedgear_gear & 0b00001111
+        sgear = telemetry.suggestedgear_gear >> 4
+        if curlap > 0:
+            dt_now = dt.now()
+            if curlap != self.prevlap:
+                self.prevlap = curlap
+                self.lap_start = dt_now
+            curLapTime = dt_now - self.lap_start
+        else:
+            curLapTime = 0
+
+        # Local velocity, roll/pitch/yaw and slip angle based on quaternion
+        lvx, lvy, lvz, roll, pitch, yaw, self.slip_angle = orientation(
+            telemetry.rotation_x, telemetry.rotation_y, telemetry.rotation_z, telemetry.northorientation,
+            telemetry.world_velocity_x, telemetry.world_velocity_y, telemetry.world_velocity_z, self.slip_angle)
+        slip_angle = self.slip_angle
+        Local_Velocity = (lvx, lvy, lvz)
+        t_decode = time.perf_counter()
+        self.stages['decode'].observe(t_decode - t_decrypt)
+        previous_frame = self.forwarder.values
+        xsim_packet = self.forwarder.packet(ddata, telemetry, cgear, roll, pitch, yaw, slip_angle)
+        if self.upsampler:
+            # Sent by step(), spread until the next packet
+            self.upsampler.segment(t_decode)
+        elif self.sinks:
+            # Packets skipped by a drain were not lost, and catching up is no time for extra frames
+            if self.interpolate and 0 < missing <= INTERPOLATE_MAX and not skipped and previous_frame:
+                # The latest frame is written back once the interpolated ones are out
+                self.send(chain(self.forwarder.interpolate(previous_frame, missing), (xsim_packet,)))
+                self.interpolated.value += missing
+            else:
+                self.send((xsim_packet,))
+        t_forward = time.perf_counter()
+        self.stages['forward'].observe(t_forward - t_decode)
+        self.forwarded.value += 1
+
+        if self.bus:
+            self.bus.publish(ddata, ts, (lvx, lvy, lvz, roll, pitch, yaw, slip_angle))
+        if self.csv_logger:
+            self.csv_logger.offer((ddata, delta, pitch, yaw, roll, Local_Velocity, slip_angle))
+        if self.export_logger:
+            self.export_logger.offer((ddata, delta, (lvx, lvy, lvz, roll, pitch, yaw, slip_angle)))
+        if self.analytics:
+            self.analytics.offer(ddata)
+        if self.on_frame and self.frame_due():
+            self.on_frame(ddata, self.lapcounter.laptime(), curLapTime, cgear, sgear, roll, pitch, yaw, slip_angle,
+                          Local_Velocity)
+        self.stages['total'].observe(time.perf_counter() - t_recv)
+
+    def send(self, frames):
+        # Each frame to every sink before the next one overwrites it
+        try:
+            for frame in frames:
+                for sink in self.sinks:
+                    sink.send(frame)
+        except Exception as e:
+            self.xsim_errors.value += 1
+            self.error('send', e)
+
+    def error(self, kind, exception):
+        self.last_error = exception
+        if self.on_error:
+            self.on_error(kind, exception)
+
+    def close(self):
+        # Let the outputs catch up with what was received
+        for consumer in self.consumers:
+            consumer.stop()
+        self.source.close()
+        for sink in self.sinks:
+            sink.close()
+        if self.bus:
+            self.bus.close()
@@ -0,0 +1,157 @@
+'''
+Columnar export of decoded telemetry to Arrow IPC or Parquet files, one column per GT7 field plus the
+derived local velocity, roll/pitch/yaw and slip angle. Requires pyarrow.
+'''
+import datetime
+import sys
+
+import numpy as np
+
+from gt_batch import decrypt_batch, packet_dtype
+from gt_packet_definition import packet_layouts
+from gt_processing import orientation_batch
+
+EXPORT_FORMATS = ('parquet', 'arrow')
+# 10s of telemetry per record batch / parquet row group
+BATCH_ROWS = 600
+
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Computed by the proxy, appended after the packet fields
+DERIVED_COLUMNS = ('local_velo_lateral', 'local_velo_up', 'local_velo_forward', 'roll', 'pitch', 'yaw', 'slip')
+
+
+def import_pyarrow():
+    # pyarrow is only needed by this module, the proxy runs without it
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('exporting to Arrow or Parquet requires pyarrow: pip install pyarrow')
+    return pyarrow
+
+
+def microseconds(delta):
+    # datetime.timedelta as an integer number of microseconds, the delta column unit
+    return None if delta is None else delta // MICROSECOND
+
+
+def export_format(filename):
+    return 'arrow' if filename.endswith(('.arrow', '.feather', '.ipc')) else 'parquet'
+
+
+class TelemetryExporter:
+    # Decrypted packets are buffered as they came, they are turned into columns in one go per batch
+    def __init__(self, filename, packet_version='B', format=None, batch_rows=BATCH_ROWS):
+        self.pa = import_pyarrow()
+        self.layout = packet_layouts[packet_version]
+        self.dtype = packet_dtype(self.layout)
+        self.format = format or export_format(filename)
+        self.batch_rows = batch_rows
+        fields = [(name, self.pa.from_numpy_dtype(self.dtype[name])) for name in self.layout.fields]
+        fields.append(('delta', self.pa.int64()))
+        fields += [(name, self.pa.float64()) for name in DERIVED_COLUMNS]
+        self.schema = self.pa.schema(fields)
+        if self.format == 'parquet':
+            self.writer = self.pa.parquet.ParquetWriter(filename, self.schema)
+        else:
+            self.writer = self.pa.ipc.new_file(filename, self.schema)
+        self.packets = bytearray()
+        self.deltas = []
+        self.derived = []
+        self.rows = 0
+
+    def write(self, ddata, delta, derived):
+        # delta in microseconds (None if unknown), derived holds the DERIVED_COLUMNS values
+        self.packets += ddata[:self.layout.size]
+        self.deltas.append(delta)
+        self.derived.append(derived)
+        if len(self.deltas) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.deltas:
+            return
+        packets = np.frombuffer(bytes(self.packets), dtype=self.dtype)
+        derived = np.array(self.derived, dtype=np.float64).reshape(-1, len(DERIVED_COLUMNS))
+        self.write_batch(packets, self.deltas, derived.T)
+        self.packets = bytearray()
+        self.deltas = []
+        self.derived = []
+
+    def write_batch(self, packets, deltas, derived):
+        # packets is a structured array of packet_dtype, deltas a sequence of microseconds or None,
+        # derived one array per DERIVED_COLUMNS entry
+        pa = self.pa
+        columns = [pa.array(packets[name]) for name in self.layout.fields]
+        columns.append(pa.array(deltas, type=pa.int64()))
+        columns += [pa.array(column) for column in derived]
+        self.writer.write_batch(pa.record_batch(columns, schema=self.schema))
+        self.rows += len(packets)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_capture(source, destination, packet_version='B', format=None, batch_rows=BATCH_ROWS * 100):
+    # Whole capture decrypted and decoded with NumPy (see gt_batch), derived columns included
+    from gt_replay import open_capture
+    from gt_capture import CaptureReader
+    if source.endswith('.gt7'):
+        with CaptureReader(source) as reader:
+            packet_version = reader.packet_version
+    layout = packet_layouts[packet_version]
+    records = [(delta, data) for timestamp, delta, data in open_capture(source, layout.size)
+               if len(data) == layout.size]
+    pktid = 0
+    slip_angle = 0.0
+    with TelemetryExporter(destination, packet_version, format) as exporter:
+        # Decrypted by slices to bound memory, pktid and slip_angle carry over like in the proxy loop
+        for start in range(0, len(records), batch_rows):
+            chunk = records[start:start + batch_rows]
+            ddata, valid = decrypt_batch([data for delta, data in chunk], packet_version)
+            deltas = np.array([microseconds(delta) for delta, data in chunk], dtype=object)[valid]
+            packets = np.ascontiguousarray(ddata[valid]).view(exporter.dtype)[:, 0]
+            # The proxy ignores packets that do not come after the latest one
+            ids = packets['pkt_id']
+            newer = ids > np.maximum.accumulate(np.concatenate(([pktid], ids[:-1])))
+            if len(ids):
+                pktid = max(pktid, int(ids.max()))
+            packets = packets[newer]
+            lvx, lvy, lvz, roll, pitch, yaw, slip = orientation_batch(
+                packets['rotation_x'], packets['rotation_y'], packets['rotation_z'], packets['northorientation'],
+                packets['world_velocity_x'], packets['world_velocity_y'], packets['world_velocity_z'], slip_angle)
+            if len(slip):
+                slip_angle = slip[-1]
+            exporter.write_batch(packets, list(deltas[newer]), (lvx, lvy, lvz, roll, pitch, yaw, slip))
+    return exporter.rows
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert a capture to a Parquet or Arrow file')
+    parser.add_argument("capture",
+                        type=str,
+                        help="GT7packets.gt7, GT7packets.cap or GT7packets.raw.cap")
+    parser.add_argument("output",
+                        type=str,
+                        help="File to write, .arrow/.feather/.ipc for Arrow IPC, anything else for Parquet")
+    parser.add_argument("--packet_version",
+                        type=str,
+                        default='B',
+                        choices=list(packet_layouts),
+                        help="Packet layout of a .cap capture, .gt7 captures know theirs. Default is B")
+    args = parser.parse_args()
+    try:
+        print('{} packets exported to {}'.format(export_capture(args.capture, args.output, args.packet_version),
+                                                 args.output))
+    except (ImportError, ValueError) as e:
+        sys.exit(e)
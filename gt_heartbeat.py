@@ -0,0 +1,75 @@
+'''
+Heartbeat scheduling from a monotonic clock, with packet gap detection and fast resubscription.
+'''
+import time
+
+HEARTBEAT_INTERVAL = 1.0
+# GT7 sends 60 packets per second, nothing for this long means the stream stopped
+GAP_TIMEOUT = 0.05
+BACKOFF_MAX = 1.0
+
+
+class HeartbeatScheduler:
+    # poll() tells when to send a heartbeat: every interval while packets flow, and as soon as
+    # a gap is detected, then again with an exponential backoff until packets come back.
+    def __init__(self, interval=HEARTBEAT_INTERVAL, gap_timeout=GAP_TIMEOUT, backoff_max=BACKOFF_MAX):
+        self.interval = interval
+        self.gap_timeout = gap_timeout
+        self.backoff_max = backoff_max
+        self.backoff = gap_timeout
+        self.last_packet = None
+        self.next_heartbeat = 0.0
+        self.in_gap = True  # not subscribed yet
+        self.gap_start = None
+        # statistics
+        self.heartbeats = 0
+        self.resubscriptions = 0
+        self.gaps = 0
+        self.recoveries = 0
+        self.last_gap = 0.0
+        self.longest_gap = 0.0
+
+    def packet_received(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if self.in_gap:
+            self.in_gap = False
+            self.backoff = self.gap_timeout
+            if self.gap_start is not None:
+                self.recoveries += 1
+                self.last_gap = now - self.gap_start
+                if self.last_gap > self.longest_gap:
+                    self.longest_gap = self.last_gap
+            self.next_heartbeat = now + self.interval
+        self.last_packet = now
+
+    def poll(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if not self.in_gap and now - self.last_packet > self.gap_timeout:
+            # stream stopped: resubscribe right away
+            self.in_gap = True
+            self.gap_start = self.last_packet
+            self.gaps += 1
+            self.backoff = self.gap_timeout
+            self.next_heartbeat = now
+        if now < self.next_heartbeat:
+            return False
+        if self.in_gap:
+            if self.gap_start is not None:
+                self.resubscriptions += 1
+            self.next_heartbeat = now + self.backoff
+            self.backoff = min(self.backoff * 2, self.backoff_max)
+        else:
+            self.next_heartbeat = now + self.interval
+        self.heartbeats += 1
+        return True
+
+    def wait(self):
+        # longest sleep that still detects a gap in time
+        return self.gap_timeout / 2
+
+    def current_gap(self, now=None):
+        if not self.in_gap or self.gap_start is None:
+            return 0.0
+        return (time.monotonic() if now is None else now) - self.gap_start
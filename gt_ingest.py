@@ -0,0 +1,110 @@
+'''
+UDP ingest for the GT7 socket: a larger kernel receive buffer, datagrams received into a ring of preallocated
+buffers, everything queued drained at each wakeup, and receive timestamps taken by the kernel where the platform
+has them (Linux), right after the receive otherwise.
+'''
+import select
+import socket
+import sys
+import time
+from struct import Struct
+
+# Linux value, Python does not export it. The kernel then attaches a struct timespec to every datagram.
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+TIMESPEC = Struct('@ll')
+
+RECEIVE_PORT = 33740
+# Larger than any GT7 packet
+DATAGRAM_SIZE = 4096
+# Datagrams taken per wakeup at most, a view is overwritten RING_SIZE receives later
+RING_SIZE = 64
+
+
+class UdpIngest:
+    # A source for ProxyEngine. drain() waits up to the socket timeout for a datagram, then with drain also takes
+    # whatever else is queued, and returns (view, address, timestamp) with the newest last. Timestamps are
+    # time.time_ns() readings of the arrival. Views point into the ring: copy what is kept.
+    # recvfrom() and sendto() make it usable as a plain socket too.
+    def __init__(self, port=RECEIVE_PORT, rcvbuf=0, drain=False, timestamps=True, ring_size=RING_SIZE):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if rcvbuf:
+            # Linux doubles it for its bookkeeping and caps it at net.core.rmem_max
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.rcvbuf = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self.socket.bind(('0.0.0.0', port))
+        # Waiting is done with select(), receives never block
+        self.socket.setblocking(False)
+        self.timeout = None
+        self.drain_all = drain
+        self.views = [memoryview(bytearray(DATAGRAM_SIZE)) for _ in range(ring_size)]
+        self.next = 0
+        self.kernel_timestamps = False
+        if timestamps and sys.platform.startswith('linux'):
+            try:
+                self.socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                self.kernel_timestamps = True
+            except OSError:
+                pass
+        self.ancillary = socket.CMSG_SPACE(TIMESPEC.size) if self.kernel_timestamps else 0
+        self.packets = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    def receive(self):
+        # One datagram if there is one, BlockingIOError otherwise
+        view = self.views[self.next]
+        if self.kernel_timestamps:
+            size, ancdata, flags, address = self.socket.recvmsg_into((view,), self.ancillary)
+            timestamp = None
+            for level, kind, data in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                    seconds, nanoseconds = TIMESPEC.unpack_from(data)
+                    timestamp = seconds * 1000000000 + nanoseconds
+            if timestamp is None:
+                timestamp = time.time_ns()
+        else:
+            size, address = self.socket.recvfrom_into(view)
+            timestamp = time.time_ns()
+        self.next = self.next + 1 if self.next + 1 < len(self.views) else 0
+        self.packets += 1
+        return view[:size], address, timestamp
+
+    def wait(self):
+        if not select.select((self.socket,), (), (), self.timeout)[0]:
+            raise socket.timeout('timed out')
+
+    def first(self):
+        self.wait()
+        try:
+            return self.receive()
+        except BlockingIOError:
+            # Readable but dropped on the way (bad checksum)
+            raise socket.timeout('timed out')
+
+    def drain(self):
+        batch = [self.first()]
+        if self.drain_all:
+            try:
+                while len(batch) < len(self.views):
+                    batch.append(self.receive())
+            except BlockingIOError:
+                pass
+            self.batches += 1
+            if len(batch) > self.largest_batch:
+                self.largest_batch = len(batch)
+        return batch
+
+    def recvfrom(self, bufsize):
+        view, address, timestamp = self.first()
+        return bytes(view[:bufsize]), address
+
+    def sendto(self, data, address):
+        return self.socket.sendto(data, address)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,192 @@
+'''
+Runtime metrics: counters, gauges and latency histograms, served as Prometheus text and JSON over HTTP
+and optionally logged as JSON lines.
+'''
+import json
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds. Stages take microseconds, XSim sends and dashboard frames up to milliseconds.
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 1.0)
+# Around the 16.7ms between two GT7 packets
+INTERVAL_BUCKETS = (0.005, 0.01, 0.015, 0.016, 0.017, 0.018, 0.02, 0.025, 0.033, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+JITTER_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.004, 0.008, 0.016, 0.033, 0.1, 1.0)
+
+
+class Counter:
+    # Only incremented by the thread that owns it, value is read as is by the others
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    # Read from a callable when scraped, for values owned by something else (consumer drops...)
+    kind = 'gauge'
+
+    def __init__(self, read):
+        self.read = read
+
+    def snapshot(self):
+        return self.read()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # Interpolated inside the bucket holding the quantile like Prometheus does, capped by max
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else 0.0,
+                'max': self.max, 'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))}
+
+
+class Metrics:
+    # Registry of named metrics, each name can hold several label sets
+    def __init__(self, prefix='gt7_'):
+        self.prefix = prefix
+        self.metrics = {}  # name -> (help, {labels: metric})
+        self.started = time.time()
+
+    def register(self, name, help, metric, **labels):
+        self.metrics.setdefault(name, (help, {}))[1][tuple(sorted(labels.items()))] = metric
+        return metric
+
+    def counter(self, name, help, **labels):
+        return self.register(name, help, Counter(), **labels)
+
+    def gauge(self, name, help, read, **labels):
+        return self.register(name, help, Gauge(read), **labels)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        return self.register(name, help, Histogram(buckets), **labels)
+
+    def to_json(self):
+        result = {'time': time.time(), 'uptime': time.time() - self.started}
+        for name, (help, series) in self.metrics.items():
+            for labels, metric in series.items():
+                key = name + ''.join('.{}'.format(value) for label, value in labels)
+                result[key] = metric.snapshot()
+        return result
+
+    def to_prometheus(self):
+        lines = []
+        for name, (help, series) in self.metrics.items():
+            full = self.prefix + name
+            kind = next(iter(series.values())).kind
+            lines.append('# HELP {} {}'.format(full, help))
+            lines.append('# TYPE {} {}'.format(full, kind))
+            for labels, metric in series.items():
+                if kind != 'histogram':
+                    lines.append('{}{} {}'.format(full, format_labels(labels), metric.snapshot()))
+                    continue
+                cumulated = 0
+                for bound, count in zip(list(metric.buckets) + ['+Inf'], list(metric.counts)):
+                    cumulated += count
+                    lines.append('{}_bucket{} {}'.format(full, format_labels(labels + (('le', bound),)), cumulated))
+                lines.append('{}_sum{} {}'.format(full, format_labels(labels), metric.sum))
+                lines.append('{}_count{} {}'.format(full, format_labels(labels), metric.count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(label, value) for label, value in labels) + '}'
+
+
+class MetricsServer(threading.Thread):
+    # /metrics is Prometheus text, /metrics.json the same values as JSON
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        # http.server takes longer to import than the rest of the proxy, only --metrics_port needs it
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        threading.Thread.__init__(self, name='metrics server', daemon=True)
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path == '/metrics':
+                    body = metrics.to_prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif handler.path == '/metrics.json':
+                    body = json.dumps(metrics.to_json()).encode()
+                    content_type = 'application/json'
+                else:
+                    handler.send_error(404)
+                    return
+                handler.send_response(200)
+                handler.send_header('Content-Type', content_type)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                # the terminal belongs to the dashboard
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsLogger(threading.Thread):
+    # One JSON line every interval seconds, and a last one on stop()
+    def __init__(self, metrics, filename, interval=10):
+        threading.Thread.__init__(self, name='metrics log', daemon=True)
+        self.metrics = metrics
+        self.interval = interval
+        self.f = open(filename, 'a')
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        self.f.write(json.dumps(self.metrics.to_json()) + '\n')
+        self.f.flush()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.write()
+        self.f.close()
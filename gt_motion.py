@@ -0,0 +1,160 @@
+'''
+Motion cueing done in the proxy: per axis chains of low-pass, washout (high-pass) and rate-limit filters
+applied to the XSim frame, and upsampling of the frames above the 60Hz of the console.
+Each filter keeps a couple of floats of state and costs a few operations per packet.
+'''
+import json
+import math
+
+# Console packet rate, the filters run once per packet
+PACKET_PERIOD = 1 / 60
+
+# Axis names used in the configuration -> TelemetryPacket field
+MOTION_AXES = {'surge': 'ax', 'heave': 'ay', 'sway': 'az', 'roll': 'rx', 'yaw': 'ry', 'pitch': 'rz',
+               'traction_loss': 'traction_loss'}
+# In degrees from -180 to 180, filtered unwrapped so that crossing 180 is not a 360 degrees step
+ANGLE_AXES = ('roll', 'yaw', 'pitch')
+
+
+def wrap_degrees(angle):
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+class LowPass:
+    # First order, cutoff in Hz. Smooths the noise of the physics engine.
+    def __init__(self, cutoff, period=PACKET_PERIOD):
+        rc = 1 / (2 * math.pi * cutoff)
+        self.alpha = period / (rc + period)
+        self.y = None
+
+    def step(self, x):
+        if self.y is None:
+            self.y = x
+        else:
+            self.y += self.alpha * (x - self.y)
+        return self.y
+
+
+class Washout:
+    # First order high-pass, cutoff in Hz. Sustained values fade out so that the rig goes back to center
+    # and keeps travel for the next onset.
+    def __init__(self, cutoff, period=PACKET_PERIOD):
+        rc = 1 / (2 * math.pi * cutoff)
+        self.alpha = rc / (rc + period)
+        self.x = None
+        self.y = 0.0
+
+    def step(self, x):
+        if self.x is not None:
+            self.y = self.alpha * (self.y + x - self.x)
+        self.x = x
+        return self.y
+
+
+class RateLimit:
+    # At most rate units per second, for actuators that cannot follow steps
+    def __init__(self, rate, period=PACKET_PERIOD):
+        self.limit = rate * period
+        self.y = None
+
+    def step(self, x):
+        if self.y is None:
+            self.y = x
+        else:
+            self.y += min(max(x - self.y, -self.limit), self.limit)
+        return self.y
+
+
+MOTION_FILTERS = {'lowpass': (LowPass, 'cutoff'), 'washout': (Washout, 'cutoff'), 'ratelimit': (RateLimit, 'rate')}
+
+
+class AxisFilter:
+    def __init__(self, filters, angle=False):
+        self.filters = filters
+        self.angle = angle
+        self.raw = None
+        self.unwrapped = 0.0
+
+    def step(self, x):
+        if self.angle:
+            if self.raw is None:
+                self.unwrapped = x
+            else:
+                self.unwrapped += wrap_degrees(x - self.raw)
+            self.raw = x
+            x = self.unwrapped
+        for f in self.filters:
+            x = f.step(x)
+        return wrap_degrees(x) if self.angle else x
+
+
+def load_motion_config(filename, period=PACKET_PERIOD):
+    # {
+    #   "surge": [{"filter": "lowpass", "cutoff": 8}, {"filter": "washout", "cutoff": 0.3}],
+    #   "yaw": [{"filter": "washout", "cutoff": 0.2}, {"filter": "ratelimit", "rate": 90}]
+    # }
+    # Axes are surge, heave, sway, roll, yaw, pitch and traction_loss, filters are applied in the order
+    # given. Axes not listed are sent as computed.
+    with open(filename) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError('expected a JSON object of axes, not {}'.format(type(config).__name__))
+    axes = {}
+    for axis, chain in config.items():
+        if axis not in MOTION_AXES:
+            raise ValueError('unknown motion axis {}, expected one of {}'.format(axis, ', '.join(MOTION_AXES)))
+        if not isinstance(chain, list):
+            raise ValueError('{}: expected a list of filters'.format(axis))
+        filters = []
+        for entry in chain:
+            if not isinstance(entry, dict):
+                raise ValueError('{}: expected a filter object, not {}'.format(axis, json.dumps(entry)))
+            if entry.get('filter') not in MOTION_FILTERS:
+                raise ValueError('{}: unknown filter {}, expected one of {}'.format(
+                    axis, entry.get('filter'), ', '.join(MOTION_FILTERS)))
+            cls, parameter = MOTION_FILTERS[entry['filter']]
+            value = entry.get(parameter)
+            # bool is an int to Python, "8" is not a number to the filters
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value < math.inf:
+                raise ValueError('{}: {} needs a positive number as {}, got {}'.format(
+                    axis, entry['filter'], parameter, json.dumps(value)))
+            filters.append(cls(value, period))
+        axes[axis] = AxisFilter(filters, axis in ANGLE_AXES)
+    return axes
+
+
+class Upsampler:
+    # Sends factor frames per console packet, evenly spread over the packet period and blended from the
+    # last frame sent to the latest one. The latest frame is reached (factor - 1) / factor of a period
+    # later than without upsampling, that is the price of interpolating rather than guessing ahead.
+    def __init__(self, forwarder, factor, period=PACKET_PERIOD):
+        self.forwarder = forwarder
+        self.factor = factor
+        self.interval = period / factor
+        self.previous = None
+        self.current = None
+        self.sent = None
+        self.start = 0.0
+        self.step = 0
+        self.frames = 0
+
+    def segment(self, now):
+        # A packet was just built by the forwarder, restart from wherever the previous segment got to
+        self.current = self.forwarder.values
+        self.previous = self.sent or self.current
+        self.start = now
+        self.step = 0
+
+    def due(self, now):
+        # Frames whose time has come, each view is overwritten by the next one
+        forwarder = self.forwarder
+        while self.current is not None and self.step < self.factor and \
+                now >= self.start + self.step * self.interval:
+            self.step += 1
+            self.sent = forwarder.blend(self.previous, self.current, self.step / self.factor)
+            self.frames += 1
+            yield forwarder.pack(self.sent)
+
+    def wait(self, timeout):
+        # Socket timeout so that frames go out on time between packets
+        return min(timeout, self.interval)
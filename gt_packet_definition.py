@@ -1,103 +1,245 @@
-from struct import unpack
-
-class GTDataPacket:
-    def __init__(self, data):
-        ## Format string that allows unpack to process the data bytestream:
-         gt_format = '<ifffffffffffffffccccfffffffffffihhiiihhhhhhBBBcffffffffffffffffffffffffffffffffffffifffff'
-         (self.magic,              #int32
-         self.position_x,         #single
-         self.position_y,         #single
-         self.position_z,         #single
-         self.world_velocity_x,         #single
-         self.world_velocity_y,         #single
-         self.world_velocity_z,         #single
-         self.rotation_x,         #single
-         self.rotation_y,         #single
-         self.rotation_z,         #single
-         self.northorientation,   #single
-         self.angularvelocity_x,     #single
-         self.angularvelocity_y,     #single
-         self.angularvelocity_z,     #single
-         self.body_height,        #single
-         self.rpm,                #single
-         self.iv1,                #char
-         self.iv2,                #char
-         self.iv3,                #char
-         self.iv4,                #char
-         self.fuel_level,         #single
-         self.fuel_capacity,      #single
-         self.speed,              #single
-         self.boost,              #single
-         self.oil_pressure_bar,   #single
-         self.water_temperature,  #single
-         self.oil_temperature,    #single
-         self.tire_temp_FL,       #single
-         self.tire_temp_FR,       #single
-         self.tire_temp_RL,       #single
-         self.tire_temp_RR,       #single
-         self.pkt_id,             #int32
-         self.current_lap,        #int16
-         self.total_laps,         #int16
-         self.best_lap_time,      #int32
-         self.last_lap_time,      #int32
-         self.day_progression_ms, #int32
-         self.pre_race_start_position,  #int16
-         self.pre_race_num_cars,  #int16
-         self.min_alert_rpm,  #int16
-         self.max_alert_rpm,  #int16
-         self.calculated_max_speed,  #int16
-         self.flags, #int16
-         self.suggestedgear_gear, #byte
-         self.throttle,  #byte
-         self.brake,  #byte
-         self.padding_byte1,  #byte
-         self.road_plane_x,    #single
-         self.road_plane_y,    #single
-         self.road_plane_z,    #single
-         self.road_plane_dist,    #single
-         self.tire_rps_FL,       #single
-         self.tire_rps_FR,       #single
-         self.tire_rps_RL,       #single
-         self.tire_rps_RR,       #single
-         self.tire_radius_FL,       #single
-         self.tire_radius_FR,       #single
-         self.tire_radius_RL,       #single
-         self.tire_radius_RR,       #single
-         self.susp_height_FL,    #single
-         self.susp_height_FR,    #single
-         self.susp_height_RL,    #single
-         self.susp_height_RR,    #single
-         self.unknown_single1, #byte
-         self.unknown_single2, #byte
-         self.unknown_single3, #byte
-         self.unknown_single4, #byte
-         self.unknown_single5, #byte
-         self.unknown_single6, #byte
-         self.unknown_single7, #byte
-         self.unknown_single8, #byte
-         self.clutch_pedal, #single
-         self.clutch_engagement, #single
-         self.rpm_clutch_gearbox,  #single
-         self.transmission_top_speed,  #single
-         self.gear_ratio1,        #single
-         self.gear_ratio2,        #single
-         self.gear_ratio3,        #single
-         self.gear_ratio4,        #single
-         self.gear_ratio5,        #single
-         self.gear_ratio6,        #single
-         self.gear_ratio7,        #single
-         self.gear_ratio8,        #single
-         self.car_code,             #int32
-         self.WheelRotationRadians, #single
-         self.FillerFloatFB,        #single
-         self.Sway,                 #single
-         self.Heave,                #single
-         self.Surge,                #single
-         ) = unpack(gt_format, data)
-    def __iter__(self):
-        #return iter([self.position_x, self.position_y, self.position_z])
-        #return iter(vars(self))
-        #attrs = vars(self)
-        #print(', '.join("%s: %s" % item for item in attrs.items()))
-        return iter(self.__dict__.values())
-        
\ No newline at end of file
+'''
+Gran Turismo 7 telemetry packet definition.
+'''
+from collections import namedtuple
+from struct import Struct, calcsize
+
+## Format string that allows unpack to process the data bytestream of a packet answered to heartbeat 'B':
+gt_format = '<ifffffffffffffffccccfffffffffffihhiiihhhhhhBBBcffffffffffffffffffffffffffffffffffffifffff'
+gt_fields = (
+    'magic',                   #int32
+    'position_x',              #single
+    'position_y',              #single
+    'position_z',              #single
+    'world_velocity_x',        #single
+    'world_velocity_y',        #single
+    'world_velocity_z',        #single
+    'rotation_x',              #single
+    'rotation_y',              #single
+    'rotation_z',              #single
+    'northorientation',        #single
+    'angularvelocity_x',       #single
+    'angularvelocity_y',       #single
+    'angularvelocity_z',       #single
+    'body_height',             #single
+    'rpm',                     #single
+    'iv1',                     #char
+    'iv2',                     #char
+    'iv3',                     #char
+    'iv4',                     #char
+    'fuel_level',              #single
+    'fuel_capacity',           #single
+    'speed',                   #single
+    'boost',                   #single
+    'oil_pressure_bar',        #single
+    'water_temperature',       #single
+    'oil_temperature',         #single
+    'tire_temp_FL',            #single
+    'tire_temp_FR',            #single
+    'tire_temp_RL',            #single
+    'tire_temp_RR',            #single
+    'pkt_id',                  #int32
+    'current_lap',             #int16
+    'total_laps',              #int16
+    'best_lap_time',           #int32
+    'last_lap_time',           #int32
+    'day_progression_ms',      #int32
+    'pre_race_start_position', #int16
+    'pre_race_num_cars',       #int16
+    'min_alert_rpm',           #int16
+    'max_alert_rpm',           #int16
+    'calculated_max_speed',    #int16
+    'flags',                   #int16
+    'suggestedgear_gear',      #byte
+    'throttle',                #byte
+    'brake',                   #byte
+    'padding_byte1',           #byte
+    'road_plane_x',            #single
+    'road_plane_y',            #single
+    'road_plane_z',            #single
+    'road_plane_dist',         #single
+    'tire_rps_FL',             #single
+    'tire_rps_FR',             #single
+    'tire_rps_RL',             #single
+    'tire_rps_RR',             #single
+    'tire_radius_FL',          #single
+    'tire_radius_FR',          #single
+    'tire_radius_RL',          #single
+    'tire_radius_RR',          #single
+    'susp_height_FL',          #single
+    'susp_height_FR',          #single
+    'susp_height_RL',          #single
+    'susp_height_RR',          #single
+    'unknown_single1',         #single
+    'unknown_single2',         #single
+    'unknown_single3',         #single
+    'unknown_single4',         #single
+    'unknown_single5',         #single
+    'unknown_single6',         #single
+    'unknown_single7',         #single
+    'unknown_single8',         #single
+    'clutch_pedal',            #single
+    'clutch_engagement',       #single
+    'rpm_clutch_gearbox',      #single
+    'transmission_top_speed',  #single
+    'gear_ratio1',             #single
+    'gear_ratio2',             #single
+    'gear_ratio3',             #single
+    'gear_ratio4',             #single
+    'gear_ratio5',             #single
+    'gear_ratio6',             #single
+    'gear_ratio7',             #single
+    'gear_ratio8',             #single
+    'car_code',                #int32
+    'WheelRotationRadians',    #single
+    'FillerFloatFB',           #single
+    'Sway',                    #single
+    'Heave',                   #single
+    'Surge',                   #single
+    )
+
+# Heartbeat 'A' packets stop after car_code
+gt_format_a = gt_format[:-5]
+gt_fields_a = gt_fields[:-5]
+
+# Heartbeat '~' packets carry extra wheel and energy recovery data after Surge
+gt_format_tilde = gt_format + 'BBBBffffff'
+gt_fields_tilde = gt_fields + (
+    'throttle_filtered',       #byte
+    'brake_filtered',          #byte
+    'unknown_byte1',           #byte
+    'unknown_byte2',           #byte
+    'wheel_torque_FL',         #single
+    'wheel_torque_FR',         #single
+    'wheel_torque_RL',         #single
+    'wheel_torque_RR',         #single
+    'energy_recovery',         #single
+    'unknown_single9',         #single
+    )
+
+# Compiled once, unpack_from then works straight on the decrypted buffer
+gt_struct = Struct(gt_format)
+gt_struct_a = Struct(gt_format_a)
+gt_struct_tilde = Struct(gt_format_tilde)
+gt_size = gt_struct.size
+
+
+def field_offsets(fmt, fields):
+    # byte offset and struct code of every field of a little-endian, unpadded format
+    offsets = {}
+    for i, name in enumerate(fields):
+        offsets[name] = (calcsize(fmt[:i + 1]), fmt[i + 1])
+    return offsets
+
+
+# Fields common to several layouts share the same offset
+gt_offsets = field_offsets(gt_format_tilde, gt_fields_tilde)
+
+
+class GTDataPacket(namedtuple('GTDataPacket', gt_fields)):
+    # Immutable record: one tuple per packet, fields are read by index, no per-instance __dict__
+    __slots__ = ()
+
+    def __new__(cls, data, offset=0):
+        return tuple.__new__(cls, gt_struct.unpack_from(data, offset))
+
+
+class GTDataPacketA(namedtuple('GTDataPacketA', gt_fields_a)):
+    __slots__ = ()
+    # not sent with heartbeat 'A', read as class attributes so consumers of 'B' packets keep working
+    WheelRotationRadians = FillerFloatFB = Sway = Heave = Surge = 0.0
+
+    def __new__(cls, data, offset=0):
+        return tuple.__new__(cls, gt_struct_a.unpack_from(data, offset))
+
+
+class GTDataPacketTilde(namedtuple('GTDataPacketTilde', gt_fields_tilde)):
+    __slots__ = ()
+
+    def __new__(cls, data, offset=0):
+        return tuple.__new__(cls, gt_struct_tilde.unpack_from(data, offset))
+
+
+# Bits of the flags field, see https://github.com/Nenkai/PDTools/blob/master/PDTools.SimulatorInterface/SimulatorPacket.cs
+FLAG_ON_TRACK = 1 << 0
+FLAG_PAUSED = 1 << 1
+FLAG_LOADING = 1 << 2  # loading or processing
+
+# Fields the forwarding loop reads itself: lap counter, gear and orientation. The rest of the XSim
+# packet is copied straight from the decrypted bytes (see gt_processing.XSimForwarder), everything
+# else is only decoded for the dashboard and the csv output.
+gt_forward_fields = ('world_velocity_x', 'world_velocity_y', 'world_velocity_z', 'rotation_x', 'rotation_y',
+                     'rotation_z', 'northorientation', 'speed', 'pkt_id', 'current_lap', 'last_lap_time',
+                     'max_alert_rpm', 'flags', 'suggestedgear_gear', 'car_code')
+
+
+def gather_format(fields):
+    # Single format reading fields at their packet offset and skipping the bytes in between.
+    # Fields have to be given in packet order.
+    fmt = '<'
+    position = 0
+    for name in fields:
+        offset, code = gt_offsets[name]
+        if offset > position:
+            fmt += '{}x'.format(offset - position)
+        fmt += code
+        position = offset + calcsize('<' + code)
+    return fmt
+
+
+gt_forward_struct = Struct(gather_format(gt_forward_fields))
+
+
+class GTForwardPacket(namedtuple('GTForwardPacket', gt_forward_fields)):
+    # Subset of GTDataPacket read with one unpack_from, same field names and offsets in every layout
+    __slots__ = ()
+
+    def __new__(cls, data, offset=0):
+        return tuple.__new__(cls, gt_forward_struct.unpack_from(data, offset))
+
+
+# Everything that depends on the heartbeat sent to the Playstation
+PacketLayout = namedtuple('PacketLayout', ['heartbeat', 'size', 'xor', 'format', 'fields', 'record'])
+
+packet_layouts = {
+    'A': PacketLayout(b'A', gt_struct_a.size, 0xDEADBEAF, gt_format_a, gt_fields_a, GTDataPacketA),
+    'B': PacketLayout(b'B', gt_struct.size, 0xDEADBEEF, gt_format, gt_fields, GTDataPacket),
+    '~': PacketLayout(b'~', gt_struct_tilde.size, 0x55FABB4F, gt_format_tilde, gt_fields_tilde, GTDataPacketTilde),
+}
+
+
+class LazyField:
+    __slots__ = ('unpack_from', 'offset')
+
+    def __init__(self, code, offset):
+        self.unpack_from = Struct('<' + code).unpack_from
+        self.offset = offset
+
+    def __get__(self, view, owner):
+        if view is None:
+            return self
+        return self.unpack_from(view.buffer, view.offset + self.offset)[0]
+
+
+class GTDataView:
+    # Zero-copy view on a decrypted packet: fields are only unpacked when read.
+    # A single view can follow a stream by rebinding it to every new buffer.
+    # Fields of every layout are exposed, reading one the packet does not carry raises struct.error.
+    __slots__ = ('buffer', 'offset')
+    _fields = gt_fields_tilde
+
+    def __init__(self, data, offset=0):
+        self.buffer = data
+        self.offset = offset
+
+    def rebind(self, data, offset=0):
+        self.buffer = data
+        self.offset = offset
+        return self
+
+    def packet(self, record=GTDataPacket):
+        return record(self.buffer, self.offset)
+
+
+for _name, (_offset, _code) in gt_offsets.items():
+    setattr(GTDataView, _name, LazyField(_code, _offset))
@@ -0,0 +1,181 @@
+'''
+Outputs fed by the receive/forward loop through bounded queues, each on its own thread.
+'''
+import datetime
+import queue
+import threading
+import time
+
+from gt_dashboard import screen
+from gt_metrics import Histogram
+from gt_packet_definition import GTDataPacket
+
+# What offer() does when a consumer is behind and its queue is full
+DROP_NEWEST = 'newest'  # keep the backlog, drop the incoming item (logs: no hole in the middle of a burst)
+DROP_OLDEST = 'oldest'  # drop the stalest queued item (dashboard: only the latest value matters)
+BLOCK = 'block'  # wait for room, for replays where nothing is real time
+
+XSIM_CSV_HEADER = "delta,speed,world_x,world_y,world_z,pitch,yaw,roll,northorientation,world_velocity_x,world_velocity_y,world_velocity_z,local_velo_lateral,local_velo_up,local_velo_forward,sway,heave,surge,slip\n"
+
+
+class Consumer(threading.Thread):
+    # offer() is called from the hot path and never blocks unless told to, items are handled on this thread
+    def __init__(self, name, maxsize, drop=DROP_NEWEST):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.queue = queue.Queue(maxsize)
+        self.drop = drop
+        self.dropped = 0
+        self.handled = 0
+        self.errors = 0
+        self.last_error = None
+        # time spent in handle(), exposed by the metrics endpoint
+        self.handle_time = Histogram()
+
+    def offer(self, item):
+        if self.drop == BLOCK:
+            self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            if self.drop == DROP_OLDEST:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put_nowait(item)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                start = time.perf_counter()
+                self.handle(item)
+                self.handle_time.observe(time.perf_counter() - start)
+                self.handled += 1
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+        self.close()
+
+    def stop(self):
+        # Whatever is still queued gets handled before the thread ends
+        self.queue.put(None)
+        self.join()
+
+    def handle(self, item):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PacketLogger(Consumer):
+    # --logpackets with --capture_format pickle, for UDPSend_timed.py: items are
+    # (ts, delta, data, ns, pkt_id, lap): the arrival in ns since the epoch, the ns since the previous one, the
+    # datagram, a monotonic ns reading of the arrival, pkt_id and lap being None for packets that were not decrypted
+    def __init__(self, maxsize, drop=DROP_NEWEST, filename="GT7packets.cap", rawfilename="GT7packets.raw.cap"):
+        # pickle is only loaded by this format
+        import pickle
+        Consumer.__init__(self, 'packet logger', maxsize, drop)
+        self.dump = pickle.dump
+        self.f1 = open(filename, 'wb')
+        self.f2 = open(rawfilename, 'wb')
+
+    def handle(self, item):
+        ts, delta, data, ns, pkt_id, lap = item
+        # The records keep the datetime and timedelta they always had, UDPSend_timed.py and --replay read them
+        ts = datetime.datetime.fromtimestamp(ts / 1e9)
+        self.dump(['{:%H:%M:%S:%f}'.format(ts), datetime.timedelta(microseconds=delta // 1000), data], self.f1)
+        self.f2.write(data)
+
+    def close(self):
+        self.f1.close()
+        self.f2.close()
+
+
+class CaptureLogger(Consumer):
+    # --logpackets: same items as PacketLogger, written to an indexed .gt7 capture
+    def __init__(self, maxsize, drop=DROP_NEWEST, filename="GT7packets.gt7", packet_version='B', compress=False):
+        from gt_capture import CaptureWriter
+        Consumer.__init__(self, 'packet logger', maxsize, drop)
+        self.writer = CaptureWriter(filename, packet_version, compress)
+
+    def handle(self, item):
+        ts, delta, data, ns, pkt_id, lap = item
+        self.writer.write(data, ns, pkt_id, lap)
+
+    def close(self):
+        self.writer.close()
+
+
+class CsvLogger(Consumer):
+    # --csvoutput: items are (ddata, delta in ns, pitch, yaw, roll, Local_Velocity, slip_angle),
+    # packets are decoded with record on this thread
+    def __init__(self, maxsize, drop=DROP_NEWEST, filename="GT7data.csv", xsimfilename="GT7dataXsim.csv",
+                 record=GTDataPacket):
+        import csv
+        Consumer.__init__(self, 'csv logger', maxsize, drop)
+        self.record = record
+        self.csvfile = open(filename, 'w', newline='')
+        self.csvwriter = csv.writer(self.csvfile)
+        self.csvheader = True
+        self.csvfilexsim = open(xsimfilename, 'w')
+        self.csvfilexsim.write(XSIM_CSV_HEADER)
+
+    def handle(self, item):
+        ddata, delta, pitch, yaw, roll, Local_Velocity, slip_angle = item
+        telemetry = self.record(ddata)
+        # The microseconds part of the delta, as timedelta.microseconds gave it
+        self.csvfilexsim.write(
+            f"{delta // 1000 % 1000000},{telemetry.speed},{telemetry.position_x},{telemetry.position_y},{telemetry.position_z},{pitch},{yaw},{roll},{telemetry.northorientation},{telemetry.world_velocity_x},{telemetry.world_velocity_y},{-telemetry.world_velocity_z},{Local_Velocity[0]},{Local_Velocity[1]},{Local_Velocity[2]},{telemetry.Sway},{telemetry.Heave},{telemetry.Surge},{slip_angle}\n")
+        if self.csvheader:
+            self.csvwriter.writerow(telemetry._fields)
+            self.csvheader = False
+        self.csvwriter.writerow(telemetry)
+
+    def close(self):
+        self.csvfile.close()
+        self.csvfilexsim.close()
+
+
+class ExportLogger(Consumer):
+    # --export: items are (ddata, delta in ns, (lvx, lvy, lvz, roll, pitch, yaw, slip_angle)),
+    # packets are only decoded into columns when a batch is flushed
+    def __init__(self, maxsize, drop=DROP_NEWEST, filename="GT7data.parquet", packet_version='B'):
+        # gt_export needs NumPy and pyarrow, ImportError is raised here when they are missing
+        from gt_export import TelemetryExporter
+        Consumer.__init__(self, 'export', maxsize, drop)
+        self.exporter = TelemetryExporter(filename, packet_version)
+
+    def handle(self, item):
+        ddata, delta, derived = item
+        self.exporter.write(ddata, delta // 1000, derived)
+
+    def close(self):
+        self.exporter.close()
+
+
+class AnalyticsConsumer(Consumer):
+    # --analytics: items are decrypted packets, LapAnalytics is read by the dashboard
+    def __init__(self, maxsize, drop=DROP_NEWEST, trackmaps=None):
+        from gt_analytics import LapAnalytics
+        Consumer.__init__(self, 'analytics', maxsize, drop)
+        self.analytics = LapAnalytics(trackmaps=trackmaps)
+
+    def handle(self, ddata):
+        self.analytics.update(ddata)
+
+
+class DashboardConsumer(Consumer):
+    # Owns the terminal: items are callables drawing on the screen model (draw_telemetry, printAt...),
+    # the resulting frame is written once they have run.
+    def __init__(self, maxsize=4):
+        Consumer.__init__(self, 'dashboard', maxsize, DROP_OLDEST)
+
+    def handle(self, draw):
+        draw()
+        screen.render()
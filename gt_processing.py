@@ -0,0 +1,386 @@
+'''
+Decryption and derived values computed for every GT7 packet.
+'''
+import math
+from ctypes import c_bool, c_float, c_short
+from operator import itemgetter
+from struct import Struct
+
+from salsa20 import Salsa20_keystream, Salsa20_xor
+
+from gt_motion import MOTION_AXES, wrap_degrees
+from gt_packet_definition import gt_offsets, gather_format
+from xsim_packet_definition import TelemetryPacket, XSimFrame, PACKET_HEADER, API_VERSION
+
+# data stream decoding
+
+KEY = b'Simulator Interface Packet GT7 ver 0.0'[0:32]
+MAGIC = 0x47375330
+SEED = Struct('<I')
+NONCE = Struct('<II')
+
+# Why PacketValidator turned a datagram down
+REJECT_REASONS = ('address', 'length', 'magic')
+
+
+def salsa20_dec(dat, xor=0xDEADBEEF):
+    # Seed IV is always located here
+    oiv = dat[0x40:0x44]
+    iv1 = int.from_bytes(oiv, byteorder='little')
+    # The second half of the IV depends on the heartbeat, see packet_layouts
+    # Notice DEADBEAF ('A'), not DEADBEEF ('B')
+    iv2 = iv1 ^ xor
+    IV = bytearray()
+    IV.extend(iv2.to_bytes(4, 'little'))
+    IV.extend(iv1.to_bytes(4, 'little'))
+    ddata = Salsa20_xor(dat, bytes(IV), KEY)
+    magic = int.from_bytes(ddata[0:4], byteorder='little')
+    if magic != MAGIC:
+        return bytearray(b'')
+    return ddata
+
+
+class PacketValidator:
+    # Cheapest checks first so that stray datagrams (broadcasts on a shared LAN, other games) are turned
+    # down before decryption: sender address, datagram length, then the magic decrypted from the first
+    # keystream block only. Rejections are counted per reason in rejected.
+    # The magic is only checked here when the sender is not: packets from the console itself are
+    # decrypted anyway and salsa20_dec checks the magic for free, a first block would cost them ~3us more.
+    def __init__(self, layout, source=None):
+        self.size = layout.size
+        self.xor = layout.xor
+        self.source = source  # IP of the console, None accepts any sender
+        self.rejected = dict.fromkeys(REJECT_REASONS, 0)
+
+    def check(self, data, address):
+        if self.source is not None and address[0] != self.source:
+            self.rejected['address'] += 1
+            return False
+        if len(data) != self.size:
+            self.rejected['length'] += 1
+            return False
+        if self.source is None:
+            iv1 = SEED.unpack_from(data, 0x40)[0]
+            keystream = Salsa20_keystream(4, NONCE.pack(iv1 ^ self.xor, iv1), KEY)
+            if SEED.unpack_from(data)[0] ^ SEED.unpack(keystream)[0] != MAGIC:
+                self.rejected['magic'] += 1
+                return False
+        return True
+
+
+def secondsToLaptime(seconds):
+    minutes = seconds // 60
+    remaining = seconds % 60
+    return '{:01.0f}:{:06.3f}'.format(minutes, remaining)
+
+
+class LapCounter:
+    def __init__(self):
+        self.lap = -1
+        self.paused = -1
+        self.tick = 0
+        self.pstart_tick = 0
+        self.lstart_tick = 0
+        self.lstart_ms = 0
+        self.paused_ticks = 0
+        self.last_lap_ms = 0
+        self.special_packet_time = 0
+
+    def update(self, lap, paused, tick, last_lap_ms):
+        if lap == 0:  # we have not started a lap or have reset
+            self.special_packet_time = 0
+        if lap != self.lap:  # we have entered a new lap
+            if self.lap != 0:
+                normal_laptime = self.lapticks() * 1000.0 / 60.0
+                self.special_packet_time += last_lap_ms - self.lapticks() * 1000.0 / 60.0
+            self.lstart_tick = self.tick
+            self.paused_ticks = 0
+        if paused != self.paused:  # paused has changed
+            if paused:  # we have switched to paused
+                self.pstart_tick = self.tick
+            else:  # we have switched to not paused
+                self.paused_ticks += tick - self.pstart_tick
+        self.paused = paused
+        self.lap = lap
+        self.tick = tick
+        self.last_lap_ms = last_lap_ms
+
+    def pausedticks(self):
+        if not self.paused:
+            return self.paused_ticks
+        else:
+            return self.paused_ticks + (self.tick - self.pstart_tick)
+
+    def lapticks(self):
+        if self.lap == 0:
+            return 0
+        else:
+            return self.tick - self.lstart_tick - self.pausedticks()
+
+    def laptime(self):
+        laptime = (self.lapticks() * 1. / 60.) - \
+            (self.special_packet_time / 1000.)
+        return round(laptime, 3)
+
+
+# Orientation helpers, based on the rotation quaternion sent by GT7 (rotation_x/y/z, northorientation)
+
+
+def orientation(rx, ry, rz, w, vx, vy, vz, slip_angle=0.0):
+    # Local velocity (lateral, up, forward), roll/pitch/yaw in degrees and slip angle in degrees,
+    # computed in one pass from the quaternion and the world velocity with plain floats.
+    # slip_angle is returned untouched when it cannot be computed (car standing still or going straight).
+    n = rx * rx + ry * ry + rz * rz + w * w
+    if n == 0:
+        return 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, slip_angle
+    s = 2.0 / n
+    xx = rx * rx * s
+    yy = ry * ry * s
+    zz = rz * rz * s
+    xy = rx * ry * s
+    xz = rx * rz * s
+    yz = ry * rz * s
+    wx = w * rx * s
+    wy = w * ry * s
+    wz = w * rz * s
+
+    # rotate the world velocity by the conjugate quaternion
+    lvx = (1.0 - yy - zz) * vx + (xy + wz) * vy + (xz - wy) * vz
+    lvy = (xy - wz) * vx + (1.0 - xx - zz) * vy + (yz + wx) * vz
+    lvz = (xz + wy) * vx + (yz - wx) * vy + (1.0 - xx - yy) * vz
+    if lvz != 0 and lvx != 0:
+        slip_angle = math.degrees(math.atan(lvx / abs(lvz)))
+
+    # GT7 axes: the quaternion is read as (w, z, x, y) for roll/pitch/yaw
+    roll = math.atan2(wz + xy, 1.0 - zz - xx)
+    sinp = wx - yz
+    pitch = math.asin(1.0 if sinp > 1.0 else -1.0 if sinp < -1.0 else sinp)
+    yaw = math.atan2(wy + xz, 1.0 - xx - yy)
+    return lvx, lvy, lvz, -math.degrees(roll), -math.degrees(pitch), -math.degrees(yaw), slip_angle
+
+
+def orientation_batch(rx, ry, rz, w, vx, vy, vz, slip_angle=0.0):
+    # Same as orientation() over arrays (for instance columns returned by gt_batch.decode_batch).
+    # Returns a tuple of arrays, the slip angle carries the last computable value forward,
+    # starting from slip_angle.
+    # NumPy is only imported here: the proxy forwards packets without it
+    import numpy as np
+    rx, ry, rz, w, vx, vy, vz = (np.asarray(a, dtype=np.float64) for a in (rx, ry, rz, w, vx, vy, vz))
+    n = rx * rx + ry * ry + rz * rz + w * w
+    s = np.divide(2.0, n, out=np.zeros_like(n), where=n != 0)
+    xx = rx * rx * s
+    yy = ry * ry * s
+    zz = rz * rz * s
+    xy = rx * ry * s
+    xz = rx * rz * s
+    yz = ry * rz * s
+    wx = w * rx * s
+    wy = w * ry * s
+    wz = w * rz * s
+
+    lvx = (1.0 - yy - zz) * vx + (xy + wz) * vy + (xz - wy) * vz
+    lvy = (xy - wz) * vx + (1.0 - xx - zz) * vy + (yz + wx) * vz
+    lvz = (xz + wy) * vx + (yz - wx) * vy + (1.0 - xx - yy) * vz
+
+    computable = (lvz != 0) & (lvx != 0)
+    slip = np.zeros_like(lvx)
+    slip[computable] = np.degrees(np.arctan(lvx[computable] / np.abs(lvz[computable])))
+    last = np.maximum.accumulate(np.where(computable, np.arange(len(slip)), -1))
+    slip = np.where(last >= 0, slip[np.maximum(last, 0)], slip_angle)
+
+    roll = -np.degrees(np.arctan2(wz + xy, 1.0 - zz - xx))
+    pitch = -np.degrees(np.arcsin(np.clip(wx - yz, -1.0, 1.0)))
+    yaw = -np.degrees(np.arctan2(wy + xz, 1.0 - xx - yy))
+    return lvx, lvy, lvz, roll, pitch, yaw, slip
+
+
+def get_bit(value, n):
+    return (value >> n & 1) != 0
+
+
+def make_xsim_packet(telemetry, cgear, roll, pitch, yaw, slip_angle):
+    return TelemetryPacket(PACKET_HEADER,
+                           API_VERSION,
+                           str.encode("PS_GT7"),
+                           str.encode("{}".format(
+                               telemetry.car_code)),
+                           str.encode('NA'),
+                           1,
+                           telemetry.speed * 3.6,  # in km/h
+                           telemetry.rpm,
+                           telemetry.max_alert_rpm,
+                           cgear,
+                           roll,  # roll in °
+                           yaw,  # yaw in °
+                           pitch,  # pitch in °
+                           #accel_z,  # surge in G
+                           #accel_y,  # heave in G
+                           #accel_x,  # sway in G
+                           telemetry.Surge,
+                           telemetry.Heave,
+                           telemetry.Sway,
+                           slip_angle,  # Traction Loss in °
+                           telemetry.oil_temperature,
+                           telemetry.oil_pressure_bar,
+                           telemetry.water_temperature,
+                           # game paused ?
+                           get_bit(telemetry.flags, 1),
+                           # on track ?
+                           get_bit(telemetry.flags, 0),
+                           # rev limit active ?
+                           get_bit(telemetry.flags, 5),
+                           # Handbrake active ?
+                           get_bit(telemetry.flags, 6),
+                           # ASM active ?
+                           get_bit(telemetry.flags, 10),
+                           # TCS active ?
+                           get_bit(telemetry.flags, 11),
+                           telemetry.throttle,
+                           telemetry.brake,
+                           telemetry.position_x,
+                           telemetry.position_y,
+                           telemetry.position_z,
+                           telemetry.world_velocity_x,
+                           telemetry.world_velocity_y,
+                           telemetry.world_velocity_z,
+                           telemetry.angularvelocity_x,
+                           telemetry.angularvelocity_y,
+                           telemetry.angularvelocity_z,
+                           telemetry.road_plane_x,
+                           telemetry.road_plane_y,
+                           telemetry.road_plane_z,
+                           telemetry.unknown_single1,
+                           telemetry.unknown_single4,
+                           telemetry.fuel_level,
+                           telemetry.fuel_capacity,
+                           telemetry.current_lap,
+                           telemetry.total_laps,
+                           telemetry.best_lap_time,
+                           telemetry.last_lap_time,
+                           telemetry.pre_race_start_position,
+                           telemetry.pre_race_num_cars,
+                           telemetry.boost,
+                           telemetry.susp_height_FL,
+                           telemetry.susp_height_FR,
+                           telemetry.susp_height_RL,
+                           telemetry.susp_height_RR,
+                           # Lights on
+                           get_bit(telemetry.flags, 8),
+                           # lowbeam on
+                           get_bit(telemetry.flags, 9),
+                           # highbeam on
+                           get_bit(telemetry.flags, 10),
+                           # load or process on
+                           get_bit(telemetry.flags, 2),
+                           )
+
+
+# XSim fields that are a GT7 field as is, same size and bytes (ctypes would only reinterpret the sign
+# of throttle, brake, laps and lap times)
+XSIM_DIRECT = {
+    'rpm': 'rpm', 'ax': 'Surge', 'ay': 'Heave', 'az': 'Sway',
+    'oil_temp': 'oil_temperature', 'oil_pressure': 'oil_pressure_bar', 'water_temp': 'water_temperature',
+    'throttle': 'throttle', 'brake': 'brake',
+    'px': 'position_x', 'py': 'position_y', 'pz': 'position_z',
+    'vx': 'world_velocity_x', 'vy': 'world_velocity_y', 'vz': 'world_velocity_z',
+    'arx': 'angularvelocity_x', 'ary': 'angularvelocity_y', 'arz': 'angularvelocity_z',
+    'planex': 'road_plane_x', 'planey': 'road_plane_y', 'planez': 'road_plane_z',
+    'single01': 'unknown_single1', 'single02': 'unknown_single4',
+    'fuel_level': 'fuel_level', 'fuel_capacity': 'fuel_capacity',
+    'lap': 'current_lap', 'lap_total': 'total_laps', 'lap_best': 'best_lap_time', 'lap_last': 'last_lap_time',
+    'position_pre': 'pre_race_start_position', 'participants_num': 'pre_race_num_cars', 'boost': 'boost',
+    'suspvelocityFL': 'susp_height_FL', 'suspvelocityFR': 'susp_height_FR',
+    'suspvelocityRL': 'susp_height_RL', 'suspvelocityRR': 'susp_height_RR',
+}
+# Computed for every packet, in the order XSimForwarder.packet() passes them
+XSIM_DERIVED = ('speed', 'max_rpm', 'gear', 'rx', 'ry', 'rz', 'traction_loss', 'pause', 'ontrack', 'revlimitactive',
+                'handbrake', 'asmactive', 'tcsactive', 'lights', 'lowbeam', 'highbeam', 'load_process')
+# struct codes keeping the GT7 bytes of the direct fields, ctypes ones for the derived fields
+CTYPES_CODES = {c_float: 'f', c_short: 'h', c_bool: '?'}
+
+
+class XSimForwarder:
+    # Builds the same bytes as make_xsim_packet() without decoding the whole GT7 packet:
+    # - the direct fields are read with one precompiled unpack_from, straight from the decrypted packet
+    # - they are put in frame order along with the derived values by an itemgetter
+    # - one precompiled pack_into writes everything after the constant header, in place in an XSimFrame
+    # telemetry only needs the fields of GTForwardPacket.
+    # motion is an optional {axis: AxisFilter} (see gt_motion) applied to the frame before it is packed.
+    def __init__(self, layout, motion=None):
+        self.xsim = XSimFrame()
+        self.car_code = None
+        direct = sorted((gt_offsets[source], name) for name, source in XSIM_DIRECT.items()
+                        if source in layout.fields)
+        self.gather = Struct(gather_format([XSIM_DIRECT[name] for offset, name in direct]))
+        # gathered values, then the derived ones, then 0 for the fields the layout does not have (sway...)
+        positions = {name: i for i, (offset, name) in enumerate(direct)}
+        positions.update((name, len(direct) + i) for i, name in enumerate(XSIM_DERIVED))
+        zero = len(direct) + len(XSIM_DERIVED)
+        self.offset = TelemetryPacket.speed.offset
+        fmt = '<'
+        position = self.offset
+        order = []
+        # frame values that are blended by interpolate(), rx/ry/rz along the shortest arc
+        self.floats = []
+        self.angles = []
+        index = {}
+        for name, ctype in TelemetryPacket._fields_:
+            field = getattr(TelemetryPacket, name)
+            if field.offset < self.offset:
+                continue
+            if field.offset > position:
+                fmt += '{}x'.format(field.offset - position)
+            code = gt_offsets[XSIM_DIRECT[name]][1] if name in XSIM_DIRECT else CTYPES_CODES[ctype]
+            if code == 'f':
+                (self.angles if name in ('rx', 'ry', 'rz') else self.floats).append(len(order))
+            fmt += code
+            position = field.offset + field.size
+            index[name] = len(order)
+            order.append(positions.get(name, zero))
+        self.body = Struct(fmt)
+        self.order = itemgetter(*order)
+        self.values = None
+        self.motion = [(index[MOTION_AXES[axis]], axis_filter) for axis, axis_filter in (motion or {}).items()]
+
+    def packet(self, ddata, telemetry, cgear, roll, pitch, yaw, slip_angle):
+        # Returns a view of the frame: it is overwritten by the next call, send it before
+        if telemetry.car_code != self.car_code:
+            self.car_code = telemetry.car_code
+            self.xsim.set_vehicle(str.encode("{}".format(self.car_code)))
+        flags = telemetry.flags
+        self.values = self.order(self.gather.unpack_from(ddata) + (
+            telemetry.speed * 3.6, telemetry.max_alert_rpm, cgear, roll, yaw, pitch, slip_angle,
+            # paused, on track, rev limiter, handbrake, ASM, TCS
+            flags >> 1 & 1, flags & 1, flags >> 5 & 1, flags >> 6 & 1, flags >> 10 & 1, flags >> 11 & 1,
+            # lights, low beam, high beam, load or process
+            flags >> 8 & 1, flags >> 9 & 1, flags >> 10 & 1, flags >> 2 & 1, 0))
+        if self.motion:
+            values = list(self.values)
+            for i, axis_filter in self.motion:
+                values[i] = axis_filter.step(values[i])
+            self.values = tuple(values)
+        return self.pack(self.values)
+
+    def pack(self, values):
+        # The whole body is written every time rather than only the fields that changed: most of them are floats
+        # that change with every packet, and comparing the 53 values with the previous frame already costs
+        # several times this single pack_into (~7us against ~2us)
+        self.body.pack_into(self.xsim.buffer, self.offset, *values)
+        return self.xsim.view
+
+    def blend(self, previous, current, fraction):
+        # Frame values between two others: floats are blended linearly, rx/ry/rz along the shortest arc,
+        # everything else is taken from current
+        values = list(current)
+        for i in self.floats:
+            values[i] = previous[i] + (current[i] - previous[i]) * fraction
+        for i in self.angles:
+            values[i] = wrap_degrees(previous[i] + wrap_degrees(current[i] - previous[i]) * fraction)
+        return values
+
+    def interpolate(self, previous, missing):
+        # Frames for the missing packets between previous (an earlier self.values) and the frame of the
+        # latest packet(). Each view is overwritten by the next one, the latest frame is written back at the end.
+        for step in range(1, missing + 1):
+            yield self.pack(self.blend(previous, self.values, step / (missing + 1)))
+        self.pack(self.values)
@@ -0,0 +1,102 @@
+'''
+Replay of packets captured with --logpackets.
+'''
+import socket
+import time
+
+# size of an encrypted packet answered to the 'B' heartbeat
+RAW_PACKET_SIZE = 316
+# nominal GT7 send rate, used to pace captures that carry no timing
+DEFAULT_INTERVAL = 1 / 60
+
+
+class ReplayFinished(Exception):
+    pass
+
+
+def read_capture(filename):
+    # GT7packets.cap is a sequence of pickled [timestamp, delta, data] records
+    # Only replay captures you made yourself: unpickling runs arbitrary code
+    import pickle
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def read_raw_capture(filename, packet_size=RAW_PACKET_SIZE):
+    # GT7packets.raw.cap has no framing nor timing, packets are cut by size
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(packet_size)
+            if len(data) < packet_size:
+                return
+            yield [None, None, data]
+
+
+def open_capture(filename, packet_size=RAW_PACKET_SIZE, start_lap=None):
+    # Only .gt7 captures are indexed, the others cannot start at a given lap
+    if filename.endswith('.gt7'):
+        from gt_capture import read_gt7_capture
+        return read_gt7_capture(filename, start_lap)
+    if start_lap is not None:
+        raise ValueError('{} has no lap index, convert it with gt_capture.py first'.format(filename))
+    if filename.endswith('.raw.cap'):
+        return read_raw_capture(filename, packet_size)
+    return read_capture(filename)
+
+
+class ReplaySocket:
+    # Drop-in replacement for the GT7 socket: recvfrom() hands out captured packets,
+    # heartbeats are swallowed. With realtime the recorded deltas are honoured,
+    # otherwise packets are delivered as fast as the proxy can take them.
+    def __init__(self, filename, realtime=False, packet_size=RAW_PACKET_SIZE, start_lap=None):
+        self.filename = filename
+        self.realtime = realtime
+        self.address = (filename, 0)
+        self.records = open_capture(filename, packet_size, start_lap)
+        self.packets = 0
+        self.start = None
+        self.schedule = 0.0
+        self.timeout = None
+        self.pending = None  # next record and when it is due
+
+    def recvfrom(self, bufsize):
+        if self.pending is None:
+            try:
+                timestamp, delta, data = next(self.records)
+            except StopIteration:
+                raise ReplayFinished('{} packets replayed from {}'.format(self.packets, self.filename))
+            self.pending = data, self.due(delta) if self.realtime else 0.0
+        data, due = self.pending
+        if self.realtime:
+            wait = due - time.perf_counter()
+            # Like a socket, time out when the next packet is further away than the timeout
+            if self.timeout is not None and wait > self.timeout:
+                time.sleep(self.timeout)
+                raise socket.timeout('timed out')
+            if wait > 0:
+                time.sleep(wait)
+        self.pending = None
+        self.packets += 1
+        return data[:bufsize], self.address
+
+    def due(self, delta):
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+            return now
+        # Against the cumulated schedule so that rounding errors do not drift
+        self.schedule += DEFAULT_INTERVAL if delta is None else delta.total_seconds()
+        return self.start + self.schedule
+
+    def sendto(self, data, address):
+        return len(data)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def close(self):
+        self.records.close()
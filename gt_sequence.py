@@ -0,0 +1,129 @@
+'''
+Packet sequencing: GT7 numbers its packets (pkt_id, one per 1/60s). SequenceTracker puts them back in
+order within a short reorder window, drops duplicates and late packets, counts the gaps and notices when
+the game restarts its numbering, either far below the latest id or with a run of consecutive ids
+that all look late.
+'''
+
+# pkt_id is an int32, compared with serial number arithmetic so that a wraparound is not a reset
+SEQUENCE_MODULO = 1 << 32
+# Going back by more than this many packets (1s) is a new session, not reordering
+RESET_BACKWARDS = 60
+# So is a run of this many late packets that follow each other: a session restarted close to the old ids.
+# Reordering only ever makes a few isolated packets late.
+RESET_RUN = 5
+# Gaps up to this many packets (100ms) may be interpolated, longer ones are pauses or menus
+INTERPOLATE_MAX = 6
+
+
+def sequence_delta(pkt_id, reference):
+    # Signed distance from reference to pkt_id, modulo 2**32
+    return (pkt_id - reference + SEQUENCE_MODULO // 2) % SEQUENCE_MODULO - SEQUENCE_MODULO // 2
+
+
+class SequenceTracker:
+    # push() and expire() return the packets that can go out, in order, as (pkt_id, item, missing) where
+    # missing is the number of packets skipped just before this one.
+    # With a window of 0 a packet is released as soon as it arrives, like before, and a packet older than
+    # the latest released one is dropped. With a window, a packet that comes after a gap is held until the
+    # missing ones arrive or until it has waited window seconds, in order packets are never held.
+    def __init__(self, window=0.0, reset_backwards=RESET_BACKWARDS, reset_run=RESET_RUN):
+        self.window = window
+        self.reset_backwards = reset_backwards
+        self.reset_run = reset_run
+        self.held = {}  # pkt_id -> (arrival, item)
+        self.late_run = []  # consecutive late packets, (pkt_id, arrival, item)
+        self.last = None  # latest released pkt_id
+        self.received = 0
+        self.released = 0
+        self.duplicates = 0
+        self.late = 0
+        self.reordered = 0
+        self.gaps = 0
+        self.lost = 0
+        self.longest_gap = 0
+        self.resets = 0
+
+    def push(self, pkt_id, item, now):
+        self.received += 1
+        if self.last is None:
+            self.last = pkt_id - 1
+        distance = sequence_delta(pkt_id, self.last)
+        if distance < -self.reset_backwards:
+            return self.reset([(pkt_id, now, item)], now)
+        if distance == 0 or pkt_id in self.held:
+            self.duplicates += 1
+            return []
+        if distance < 0:
+            self.late += 1
+            run = self.late_run
+            if run and sequence_delta(pkt_id, run[-1][0]) != 1:
+                run.clear()
+            run.append((pkt_id, now, item))
+            if len(run) < self.reset_run:
+                return []
+            # Not late after all, the first packets of a new session
+            self.late -= len(run)
+            self.late_run = []
+            return self.reset(run, now)
+        self.late_run = []
+        if distance > 1 and self.window:
+            self.held[pkt_id] = (now, item)
+            return self.release(now)
+        if not self.held:
+            # Fast path, nothing waiting
+            return [self.out(pkt_id, item, distance - 1)]
+        if distance == 1:
+            # Fills the gap in front of the held packets
+            self.reordered += 1
+        self.held[pkt_id] = (now, item)
+        return self.release(now)
+
+    def reset(self, packets, now):
+        # The game restarted its numbering: what is held belongs to the old session, let it out first, then
+        # the packets of the new one, (pkt_id, arrival, item) in order
+        released = self.flush()
+        self.resets += 1
+        self.last = packets[0][0] - 1
+        for pkt_id, arrival, item in packets:
+            self.held[pkt_id] = (arrival, item)
+        return released + self.release(now)
+
+    def expire(self, now):
+        # To be called when nothing was received for a while, releases what waited long enough
+        return self.release(now) if self.held else []
+
+    def flush(self):
+        # Everything held, in order, regardless of the window
+        return self.release(None)
+
+    def release(self, now):
+        released = []
+        held = self.held
+        while held:
+            following = (self.last + 1 + SEQUENCE_MODULO // 2) % SEQUENCE_MODULO - SEQUENCE_MODULO // 2
+            if following in held:
+                arrival, item = held.pop(following)
+                released.append(self.out(following, item, 0))
+                continue
+            pkt_id = min(held, key=lambda pkt_id: sequence_delta(pkt_id, self.last))
+            arrival, item = held[pkt_id]
+            if now is not None and now - arrival < self.window:
+                break
+            del held[pkt_id]
+            released.append(self.out(pkt_id, item, sequence_delta(pkt_id, self.last) - 1))
+        return released
+
+    def out(self, pkt_id, item, missing):
+        if missing:
+            self.gaps += 1
+            self.lost += missing
+            if missing > self.longest_gap:
+                self.longest_gap = missing
+        self.last = pkt_id
+        self.released += 1
+        return pkt_id, item, missing
+
+    def wait(self, timeout):
+        # Socket timeout so that held packets are released on time
+        return min(timeout, self.window) if self.window else timeout
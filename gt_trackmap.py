@@ -0,0 +1,268 @@
+'''
+Track maps: a reference lap as points every few metres with the time at which it passed them, a grid
+index to find the point nearest to a position, and cursors that follow a car along the map from one
+packet to the next in a couple of steps. Maps are saved as .json, one per track: the fastest lap driven on it.
+'''
+import glob
+import json
+import math
+import os
+import sys
+from array import array
+
+from gt_packet_definition import FLAG_PAUSED
+
+# Metres between two points of a map
+TRACE_STEP = 5.0
+# Metres per side of a grid cell
+GRID_CELL = 25.0
+# A car further than this from the map is not on that track (or in the pits)
+MAX_OFFSET = 30.0
+# Bounds are rounded to this in the file name of a map
+KEY_ROUNDING = 10.0
+# Points of a map checked against another one to tell whether they are the same track (every 50 m)
+SAME_TRACK_STEP = 10
+# Road planes of the same track differ by less than this
+ROAD_PLANE_TOLERANCE = 1.0
+
+
+class TrackMap:
+    # x, z and time (seconds into the lap) of each point of a closed lap, lap_time closes the loop
+    def __init__(self, x, z, time, lap_time=None, road_plane=0.0, cell=GRID_CELL):
+        # Plain arrays: indexing them from Python is several times faster than indexing NumPy arrays
+        self.x = array('d', x)
+        self.z = array('d', z)
+        self.time = array('d', time)
+        self.n = len(self.x)
+        if self.n < 3:
+            raise ValueError('a track map needs at least 3 points')
+        self.lap_time = self.time[-1] if lap_time is None else lap_time
+        self.road_plane = road_plane
+        self.cell = cell
+        distance = [0.0]
+        for i in range(1, self.n):
+            distance.append(distance[-1] + math.hypot(self.x[i] - self.x[i - 1], self.z[i] - self.z[i - 1]))
+        self.distance = array('d', distance)
+        self.length = distance[-1] + math.hypot(self.x[0] - self.x[-1], self.z[0] - self.z[-1])
+        self.bounds = (min(self.x), min(self.z), max(self.x), max(self.z))
+        self.grid = {}
+        for i in range(self.n):
+            self.grid.setdefault((math.floor(self.x[i] / cell), math.floor(self.z[i] / cell)), []).append(i)
+
+    @classmethod
+    def from_samples(cls, x, z, time, lap_time=None, road_plane=0.0, step=TRACE_STEP):
+        # Keeps one sample every step metres out of a lap recorded at 60Hz
+        keep = [0]
+        travelled = 0.0
+        for i in range(1, len(x)):
+            travelled += math.hypot(x[i] - x[i - 1], z[i] - z[i - 1])
+            if travelled >= step:
+                keep.append(i)
+                travelled = 0.0
+        return cls([x[i] for i in keep], [z[i] for i in keep], [time[i] for i in keep], lap_time, road_plane)
+
+    def key(self):
+        # File name of the first map of a track: the bounds rounded to KEY_ROUNDING and the average road plane
+        # of the lap. Bounds vary a little from lap to lap, the file of a track is found with same_track().
+        return 'track_' + '_'.join(str(int(round(value / KEY_ROUNDING) * KEY_ROUNDING))
+                                   for value in self.bounds) + '_{}'.format(int(round(self.road_plane)))
+
+    def contains(self, x, z):
+        # Whether the position is on the map
+        minx, minz, maxx, maxz = self.bounds
+        return minx - MAX_OFFSET <= x <= maxx + MAX_OFFSET and minz - MAX_OFFSET <= z <= maxz + MAX_OFFSET and \
+            self.nearest(x, z) is not None
+
+    def same_track(self, other):
+        # Both laps were driven on the same track: each one stays on the other all along. A shorter layout of the
+        # same circuit stays on the longer one, but not the other way round.
+        return abs(self.road_plane - other.road_plane) < ROAD_PLANE_TOLERANCE and \
+            all(self.contains(other.x[i], other.z[i]) for i in range(0, other.n, SAME_TRACK_STEP)) and \
+            all(other.contains(self.x[i], self.z[i]) for i in range(0, self.n, SAME_TRACK_STEP))
+
+    def distance2(self, i, x, z):
+        return (self.x[i] - x) ** 2 + (self.z[i] - z) ** 2
+
+    def nearest(self, x, z):
+        # Grid lookup, rings of cells around the position until no closer point can be found
+        cx = math.floor(x / self.cell)
+        cz = math.floor(z / self.cell)
+        best = None
+        best_distance = MAX_OFFSET ** 2
+        reach = int(MAX_OFFSET / self.cell) + 1
+        for ring in range(reach + 1):
+            if best is not None and ((ring - 1) * self.cell) ** 2 > best_distance:
+                break
+            for gx in range(cx - ring, cx + ring + 1):
+                for gz in range(cz - ring, cz + ring + 1):
+                    if max(abs(gx - cx), abs(gz - cz)) != ring:
+                        continue
+                    for i in self.grid.get((gx, gz), ()):
+                        d = self.distance2(i, x, z)
+                        if d < best_distance:
+                            best, best_distance = i, d
+        return best
+
+    def project(self, i, x, z):
+        # Position on the map as a fractional point index, on the closest of the two segments around i
+        best_position = i
+        best_distance = self.distance2(i, x, z)
+        for a in (i - 1 if i else self.n - 1, i):
+            b = a + 1 if a + 1 < self.n else 0
+            dx = self.x[b] - self.x[a]
+            dz = self.z[b] - self.z[a]
+            length2 = dx * dx + dz * dz
+            if not length2:
+                continue
+            t = min(max(((x - self.x[a]) * dx + (z - self.z[a]) * dz) / length2, 0.0), 1.0)
+            d = (self.x[a] + t * dx - x) ** 2 + (self.z[a] + t * dz - z) ** 2
+            if d < best_distance:
+                best_position, best_distance = a + t, d
+        return best_position
+
+    def at(self, position, values, closing):
+        i = int(position)
+        following = values[i + 1] if i + 1 < self.n else closing
+        return values[i] + (following - values[i]) * (position - i)
+
+    def distance_at(self, position):
+        return self.at(position, self.distance, self.length)
+
+    def time_at(self, position):
+        return self.at(position, self.time, self.lap_time)
+
+    def cursor(self):
+        return TrackCursor(self)
+
+    def save(self, filename):
+        # JSON rather than .npz so that analytics do not need NumPy, a map is a few thousand numbers
+        with open(filename, 'w') as f:
+            json.dump({'x': self.x.tolist(), 'z': self.z.tolist(), 'time': self.time.tolist(),
+                       'lap_time': self.lap_time, 'road_plane': self.road_plane, 'cell': self.cell}, f)
+        return filename
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            data = json.load(f)
+        return cls(data['x'], data['z'], data['time'], data['lap_time'], data['road_plane'], data['cell'])
+
+
+class TrackCursor:
+    # Where one car is on a map. follow() walks from the previous match to the closest point, usually a
+    # step or two at 60Hz, and only goes back to the grid when the car is lost (start, teleport).
+    # Maps are read only, several cursors (rigs) can share one.
+    def __init__(self, trackmap):
+        self.map = trackmap
+        self.index = None
+
+    def follow(self, x, z):
+        # Fractional point index, None when the car is not on the map
+        trackmap = self.map
+        n = trackmap.n
+        i = self.index
+        if i is not None:
+            d = trackmap.distance2(i, x, z)
+            while True:
+                j = i + 1 if i + 1 < n else 0
+                dj = trackmap.distance2(j, x, z)
+                if dj >= d:
+                    j = i - 1 if i else n - 1
+                    dj = trackmap.distance2(j, x, z)
+                    if dj >= d:
+                        break
+                i, d = j, dj
+            if d > MAX_OFFSET ** 2:
+                i = None
+        if i is None:
+            i = trackmap.nearest(x, z)
+            if i is None:
+                self.index = None
+                return None
+        self.index = i
+        return trackmap.project(i, x, z)
+
+    def reset(self, index=None):
+        self.index = index
+
+
+class TrackMaps:
+    # The maps saved in a directory, read once: find() and save() only look at the maps in memory, and save()
+    # keeps them up to date. Directories filled before maps were compared can hold several maps of a track,
+    # the fastest one is used and replaced.
+    def __init__(self, directory):
+        self.directory = directory
+        self.maps = {}  # filename -> TrackMap
+        for filename in sorted(glob.glob(os.path.join(directory, 'track_*.json'))):
+            self.maps[filename] = TrackMap.load(filename)
+
+    def find(self, x, z):
+        # Fastest saved lap of the track the position is on, None if there is none
+        best = None
+        for trackmap in self.maps.values():
+            if (best is None or trackmap.lap_time < best.lap_time) and trackmap.contains(x, z):
+                best = trackmap
+        return best
+
+    def saved(self, trackmap):
+        # File of the fastest saved lap of the same track, None if there is none
+        best = None
+        for filename, saved in self.maps.items():
+            if (best is None or saved.lap_time < self.maps[best].lap_time) and saved.same_track(trackmap):
+                best = filename
+        return best
+
+    def save(self, trackmap, faster=True):
+        # Written over the map of the same track, if there is one and unless it is faster (with faster).
+        # Returns the file written, None when the saved lap was kept.
+        filename = self.saved(trackmap)
+        if filename is None:
+            filename = os.path.join(self.directory, trackmap.key() + '.json')
+        elif faster and self.maps[filename].lap_time <= trackmap.lap_time:
+            return None
+        trackmap.save(filename)
+        self.maps[filename] = trackmap
+        return filename
+
+
+def map_from_capture(filename, lap, packet_version='B'):
+    # Map of one lap of a capture, times from the packet ids, lap time from the game
+    from gt_batch import decode_capture
+    decoded = decode_capture(filename, packet_version, start_lap=lap if filename.endswith('.gt7') else None)
+    packets = decoded[(decoded['current_lap'] == lap) & ((decoded['flags'] & FLAG_PAUSED) == 0)]
+    if not len(packets):
+        raise ValueError('lap {} is not in {}'.format(lap, filename))
+    following = decoded[decoded['current_lap'] == lap + 1]
+    lap_time = following['last_lap_time'][0] / 1000 if len(following) and following['last_lap_time'][0] > 0 \
+        else None
+    ticks = packets['pkt_id'] - packets['pkt_id'][0]
+    return TrackMap.from_samples(packets['position_x'].tolist(), packets['position_z'].tolist(),
+                                 (ticks / 60).tolist(), lap_time, float(packets['road_plane_dist'].mean()))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Save the map of a lap of a capture, for --trackmaps')
+    parser.add_argument("capture",
+                        type=str,
+                        help="GT7packets.gt7, GT7packets.cap or GT7packets.raw.cap")
+    parser.add_argument("lap",
+                        type=int,
+                        help="Lap to use as reference, it has to be complete")
+    parser.add_argument("--directory",
+                        type=str,
+                        default='tracks',
+                        help="Where maps are saved. Default is tracks")
+    parser.add_argument("--packet_version",
+                        type=str,
+                        default='B',
+                        help="Packet layout of a .cap capture, .gt7 captures know theirs. Default is B")
+    args = parser.parse_args()
+    try:
+        trackmap = map_from_capture(args.capture, args.lap, args.packet_version)
+    except (OSError, ValueError) as e:
+        sys.exit(e)
+    os.makedirs(args.directory, exist_ok=True)
+    # Asked for, so saved even if a faster lap of the track was
+    print('{} points, {:.0f} m, {:.3f}s saved to {}'.format(trackmap.n, trackmap.length, trackmap.lap_time,
+                                                           TrackMaps(args.directory).save(trackmap, False)))
@@ -0,0 +1,250 @@
+'''
+Decoding spread over worker processes for GT7MultiProxy: the receive socket stays on the event loop, each console
+is assigned to one worker which decrypts, decodes and builds its frames, and the frames come back through shared
+memory rings to a sender thread. A console always goes to the same worker, so its packets stay in order.
+'''
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from multiprocessing import shared_memory
+from struct import Struct
+
+from gt_async import ConsoleStream, TARGET_FORMATS
+
+# Slots per ring, about a second of packets of a few consoles
+RING_SLOTS = 256
+# stream index, datagram length, then the encrypted datagram
+IN_HEADER = Struct('<HH')
+IN_SLOT = 512
+# stream index, pkt_id, forwarded, invalid, lost, number of outputs, then the outputs
+OUT_HEADER = Struct('<HiIIIB')
+# target format index, length, then the frame (XSim packet or decrypted packet)
+OUTPUT = Struct('<BH')
+OUT_SLOT = 1024
+# stream index telling the other side to stop
+STOP = 0xffff
+# seconds a worker waits for a packet before checking that the proxy is still there
+POLL = 1.0
+
+
+class SharedRing:
+    # Single producer, single consumer ring of fixed size slots in shared memory. The semaphores count the
+    # filled and the free slots and each side keeps its own index, so a slot is only ever touched by the side
+    # that holds it: reserve() and commit() on the producer, get() and release() on the consumer.
+    # Slots are memoryviews of the shared block, written and read in place.
+    def __init__(self, slots=RING_SLOTS, slot_size=OUT_SLOT):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        # pid of the process that unlinks the block, a forked worker inherits the ring as it is
+        self.owner = os.getpid()
+        self.filled = multiprocessing.Semaphore(0)
+        self.free = multiprocessing.Semaphore(slots)
+        self.attach()
+
+    def attach(self):
+        self.index = 0
+        self.views = [self.memory.buf[i * self.slot_size:(i + 1) * self.slot_size] for i in range(self.slots)]
+
+    def __getstate__(self):
+        # What a spawned worker needs to map the same block
+        return self.memory.name, self.slots, self.slot_size, self.filled, self.free
+
+    def __setstate__(self, state):
+        name, self.slots, self.slot_size, self.filled, self.free = state
+        self.memory = shared_memory.SharedMemory(name=name)
+        self.owner = None
+        self.attach()
+
+    def reserve(self, block=True, timeout=None):
+        # Next free slot, None when the ring stays full
+        if not self.free.acquire(block, timeout):
+            return None
+        return self.views[self.index]
+
+    def commit(self):
+        self.index = self.index + 1 if self.index + 1 < self.slots else 0
+        self.filled.release()
+
+    def get(self, timeout=None):
+        # Oldest filled slot, None on timeout
+        if not self.filled.acquire(True, timeout):
+            return None
+        return self.views[self.index]
+
+    def release(self):
+        self.index = self.index + 1 if self.index + 1 < self.slots else 0
+        self.free.release()
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.memory.close()
+        if self.owner == os.getpid():
+            self.memory.unlink()
+
+
+class ShardStream(ConsoleStream):
+    # Worker side copy of a console: decode() as usual, the outputs are written to the slot of the packet
+    def __init__(self, index, name, ps_ip, packet_version, targets):
+        super().__init__(name, ps_ip, packet_version, [])
+        self.index = index
+        self.targets = targets
+        self.slot = None
+        self.offset = 0
+        self.outputs = 0
+
+    def begin(self, slot):
+        self.slot = slot
+        self.offset = OUT_HEADER.size
+        self.outputs = 0
+
+    def output(self, fmt, data):
+        size = len(data)
+        OUTPUT.pack_into(self.slot, self.offset, TARGET_FORMATS.index(fmt), size)
+        self.offset += OUTPUT.size
+        self.slot[self.offset:self.offset + size] = data
+        self.offset += size
+        self.outputs += 1
+
+    def end(self):
+        OUT_HEADER.pack_into(self.slot, 0, self.index, self.pktid, self.forwarded, self.invalid, self.sequence.lost,
+                             self.outputs)
+        self.slot = None
+
+
+def shard_worker(consoles, inbound, outbound):
+    # Worker process: consoles is a list of (index, name, ps_ip, packet_version, targets)
+    # Ctrl+C reaches the whole process group, the proxy stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    streams = {console[0]: ShardStream(*console) for console in consoles}
+    parent = multiprocessing.parent_process()
+    try:
+        while True:
+            slot = inbound.get(POLL)
+            if slot is None:
+                if parent is not None and not parent.is_alive():
+                    break
+                continue
+            index, size = IN_HEADER.unpack_from(slot)
+            # salsa20 takes bytes, the copy also gives the slot back right away
+            data = bytes(slot[IN_HEADER.size:IN_HEADER.size + size])
+            inbound.release()
+            out = outbound.reserve()
+            if index == STOP:
+                OUT_HEADER.pack_into(out, 0, STOP, 0, 0, 0, 0, 0)
+                outbound.commit()
+                break
+            stream = streams[index]
+            stream.begin(out)
+            try:
+                stream.decode(data)
+            except Exception:
+                stream.invalid += 1
+            stream.end()
+            outbound.commit()
+    finally:
+        inbound.close()
+        outbound.close()
+
+
+class Shard:
+    def __init__(self, slots):
+        self.inbound = SharedRing(slots, IN_SLOT)
+        self.outbound = SharedRing(slots, OUT_SLOT)
+        self.process = None
+        self.thread = None
+        self.indexes = []  # streams decoded by this worker
+
+
+class ShardPool:
+    # Console i is decoded by worker i % workers. submit() is called from the event loop and never blocks: a
+    # datagram that finds the ring of its worker full is dropped and counted in stream.dropped. One thread per
+    # worker sends the frames that come back and copies the worker counters to the streams, for report(). The
+    # counters the event loop also updates have worker_ twins written by that thread only.
+    def __init__(self, streams, workers, slots=RING_SLOTS):
+        self.streams = streams
+        self.shards = [Shard(slots) for _ in range(min(workers, len(streams)))]
+        self.routes = {}  # stream name -> (index, shard)
+        for index, stream in enumerate(streams):
+            shard = self.shards[index % len(self.shards)]
+            self.routes[stream.name] = (index, shard)
+            shard.indexes.append(index)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def start(self):
+        # Every worker is started before the first collecting thread: forking a process that runs threads can
+        # leave the child with a lock held by a thread that does not exist there
+        for shard in self.shards:
+            consoles = [(index, stream.name, stream.ps_ip, stream.packet_version, stream.targets)
+                        for index, stream in enumerate(self.streams) if index in shard.indexes]
+            shard.process = multiprocessing.Process(target=shard_worker, args=(consoles, shard.inbound,
+                                                                               shard.outbound), daemon=True)
+            shard.process.start()
+        for shard in self.shards:
+            shard.thread = threading.Thread(target=self.collect, args=(shard,), daemon=True)
+            shard.thread.start()
+
+    def submit(self, stream, data):
+        index, shard = self.routes[stream.name]
+        slot = shard.inbound.reserve(False)
+        if slot is None:
+            stream.dropped += 1
+            return
+        size = len(data)
+        IN_HEADER.pack_into(slot, 0, index, size)
+        slot[IN_HEADER.size:IN_HEADER.size + size] = data
+        shard.inbound.commit()
+
+    def collect(self, shard):
+        ring = shard.outbound
+        while True:
+            slot = ring.get(POLL)
+            if slot is None:
+                if not shard.process.is_alive():
+                    return
+                continue
+            index, pkt_id, forwarded, invalid, lost, outputs = OUT_HEADER.unpack_from(slot)
+            if index == STOP:
+                ring.release()
+                return
+            stream = self.streams[index]
+            stream.pktid = pkt_id
+            stream.forwarded = forwarded
+            stream.sequence.lost = lost
+            # Decode failures counted by the worker so far
+            stream.worker_invalid = invalid
+            offset = OUT_HEADER.size
+            for _ in range(outputs):
+                fmt, size = OUTPUT.unpack_from(slot, offset)
+                offset += OUTPUT.size
+                frame = slot[offset:offset + size]
+                offset += size
+                for address in stream.targets[TARGET_FORMATS[fmt]]:
+                    try:
+                        self.socket.sendto(frame, address)
+                    except OSError:
+                        stream.worker_send_errors += 1
+                frame.release()
+            ring.release()
+
+    def close(self, timeout=2.0):
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            slot = shard.inbound.reserve(True, timeout)
+            if slot is not None:
+                IN_HEADER.pack_into(slot, 0, STOP, 0)
+                shard.inbound.commit()
+        for shard in self.shards:
+            if shard.process is not None:
+                shard.process.join(timeout)
+                if shard.process.is_alive():
+                    shard.process.terminate()
+                shard.thread.join(timeout)
+            shard.inbound.close()
+            shard.outbound.close()
+        self.socket.close()
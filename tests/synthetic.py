@@ -0,0 +1,24 @@
+'''
+Encrypted GT7 packets with chosen field values, for the tests.
+'''
+import random
+import struct
+
+from GT7Bench import synthetic_packet, salsa20_enc
+from gt_packet_definition import packet_layouts, gt_offsets
+from gt_processing import salsa20_dec
+
+
+def make_packet(pkt_id, packet_version='B', seed=None, **fields):
+    # A synthetic_packet() with fields (pkt_id excluded) overwritten in the decrypted packet
+    layout = packet_layouts[packet_version]
+    rnd = random.Random(pkt_id if seed is None else seed)
+    ddata = bytearray(salsa20_dec(synthetic_packet(pkt_id, rnd, layout), layout.xor))
+    for name, value in fields.items():
+        offset, code = gt_offsets[name]
+        struct.pack_into('<' + code, ddata, offset, value)
+    return salsa20_enc(ddata, rnd.getrandbits(32), layout.xor)
+
+
+def make_packets(first, count, packet_version='B', **fields):
+    return [make_packet(pkt_id, packet_version, **fields) for pkt_id in range(first, first + count)]
@@ -0,0 +1,130 @@
+import math
+import os
+
+from gt_analytics import LapAnalytics
+from gt_packet_definition import FLAG_PAUSED
+
+RADIUS = 100.0
+
+
+class Driver:
+    # Laps of a circle of RADIUS metres fed to LapAnalytics.step(), one packet per 1/60s
+    def __init__(self, analytics, pkt_id=0):
+        self.analytics = analytics
+        self.pkt_id = pkt_id
+        self.fuel = 50.0
+
+    def packet(self, x, z, lap, speed, last_lap_time=-1, flags=0):
+        self.pkt_id += 1
+        self.fuel -= 0.001
+        self.analytics.step(x, 0.0, z, self.fuel, speed, 80.0, 81.0, 82.0, 83.0, self.pkt_id, lap, last_lap_time,
+                            flags, 1.5)
+
+    def lap(self, lap, speed, last_lap_time=-1, slow_half=1.0):
+        # One lap at speed m/s, the second half at slow_half times that. Returns the lap time in ms.
+        angle = 0.0
+        packets = 0
+        while angle < 2 * math.pi:
+            self.packet(RADIUS * math.cos(angle), RADIUS * math.sin(angle), lap, speed, last_lap_time)
+            angle += speed * (slow_half if angle >= math.pi else 1.0) / 60 / RADIUS
+            packets += 1
+        return round(packets * 1000 / 60)
+
+    def session(self, laps, speed=30.0):
+        # A few packets on the grid, the laps, then the first packet of the next lap. Returns the lap times.
+        for _ in range(10):
+            self.packet(RADIUS, 0.0, 0, 0.0)
+        times = []
+        last_lap_time = -1
+        for lap in range(1, laps + 1):
+            last_lap_time = self.lap(lap, speed, last_lap_time)
+            times.append(last_lap_time)
+        self.packet(RADIUS, 0.0, laps + 1, speed, last_lap_time)
+        return times
+
+
+def test_lap_summary():
+    analytics = LapAnalytics()
+    driver = Driver(analytics)
+    times = driver.session(2)
+    assert [summary.lap for summary in analytics.laps] == [1, 2]
+    summary = analytics.laps[0]
+    assert summary.time == times[0] / 1000
+    assert abs(summary.distance - 2 * math.pi * RADIUS) < 2
+    assert abs(summary.max_speed - 30 * 3.6) < 1e-3
+    assert summary.tyre_temps == (80.0, 81.0, 82.0, 83.0)
+    # Sectors are split on the reference, the first lap has none
+    assert summary.sectors == (None, None, None)
+    sectors = analytics.laps[1].sectors
+    assert all(abs(sector - times[1] / 3000) < 0.1 for sector in sectors)
+    assert abs(sum(sectors) - times[1] / 1000) < 1e-6
+
+
+def test_joined_lap_is_not_timed():
+    analytics = LapAnalytics()
+    driver = Driver(analytics)
+    # Joining during lap 3: it is not complete, lap 4 is
+    last_lap_time = driver.lap(3, 30.0)
+    driver.lap(4, 30.0, last_lap_time)
+    driver.packet(RADIUS, 0.0, 5, 30.0, 21000)
+    assert [summary.lap for summary in analytics.laps] == [4]
+
+
+def test_delta_to_the_best_lap():
+    analytics = LapAnalytics()
+    driver = Driver(analytics)
+    last_lap_time = driver.session(1)[0]
+    # Same first half, then slower: behind by the end of the lap
+    driver.lap(2, 30.0, last_lap_time, slow_half=0.5)
+    assert analytics.delta > 5.0
+    assert analytics.best.lap == 1
+
+
+def test_paused_time_is_not_lap_time():
+    analytics = LapAnalytics()
+    driver = Driver(analytics)
+    driver.session(1)
+    ticks = analytics.ticks
+    for _ in range(120):
+        driver.packet(RADIUS, 0.0, 2, 0.0, flags=FLAG_PAUSED)
+    driver.packet(RADIUS, 0.0, 2, 0.0)
+    assert analytics.ticks == ticks + 1
+
+
+def test_saved_reference_from_the_first_lap(tmp_path):
+    directory = str(tmp_path)
+    first = LapAnalytics(trackmaps=directory)
+    Driver(first).session(1)
+    assert len(os.listdir(directory)) == 1
+    # A later session compares with the saved lap as soon as lap 1 is under way
+    analytics = LapAnalytics(trackmaps=directory)
+    driver = Driver(analytics)
+    for _ in range(10):
+        driver.packet(RADIUS, 0.0, 0, 0.0)
+    driver.lap(1, 30.0, slow_half=0.5)
+    assert analytics.reference is not None
+    assert analytics.delta > 5.0
+
+
+def test_saved_maps_are_read_once(tmp_path):
+    directory = str(tmp_path)
+    Driver(LapAnalytics(trackmaps=directory)).session(1)
+    analytics = LapAnalytics(trackmaps=directory)
+    for filename in os.listdir(directory):
+        os.remove(os.path.join(directory, filename))
+    driver = Driver(analytics)
+    driver.packet(RADIUS, 0.0, 1, 30.0)
+    assert analytics.reference is not None
+
+
+def test_saved_map_found_after_the_pits(tmp_path):
+    directory = str(tmp_path)
+    Driver(LapAnalytics(trackmaps=directory)).session(1)
+    analytics = LapAnalytics(trackmaps=directory)
+    driver = Driver(analytics)
+    # Out of the pits 300 m away from the track, then onto it
+    for i in range(800):
+        driver.packet(400 + i * 0.5, 0.0, 1, 30.0)
+    assert analytics.reference is None
+    driver.lap(1, 30.0)
+    assert analytics.reference is not None
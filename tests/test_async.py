@@ -0,0 +1,107 @@
+import json
+import sys
+
+import pytest
+
+import GT7MultiProxy
+from gt_async import ConsoleStream, GT7Protocol, load_config
+from synthetic import make_packets
+
+PS_IP = '192.168.1.10'
+
+
+def write_config(tmp_path, config):
+    filename = str(tmp_path / 'proxy.json')
+    with open(filename, 'w') as f:
+        f.write(config if isinstance(config, str) else json.dumps(config))
+    return filename
+
+
+class FakeTransport:
+    def __init__(self, fail=False):
+        self.sent = []
+        self.fail = fail
+        self.protocol = None
+
+    def sendto(self, data, address):
+        if self.fail:
+            # As asyncio does for a send that fails right away
+            self.protocol.error_received(OSError('unreachable'))
+            return
+        self.sent.append((data, address))
+
+
+def make_protocol(targets, fail=False):
+    stream = ConsoleStream('rig1', PS_IP, 'B', targets)
+    protocol = GT7Protocol({PS_IP: stream})
+    transport = FakeTransport(fail)
+    transport.protocol = protocol
+    protocol.connection_made(transport)
+    stream.protocol = protocol
+    return stream, protocol, transport
+
+
+def test_load_config_defaults(tmp_path):
+    config = load_config(write_config(tmp_path, {'consoles': [
+        {'ps_ip': PS_IP, 'targets': ['127.0.0.1:33800', {'address': '127.0.0.1:20777', 'format': 'raw'}]}]}))
+    console = config['consoles'][0]
+    assert console['name'] == PS_IP
+    assert console['packet_version'] == 'B'
+    assert [target['format'] for target in console['targets']] == ['xsim', 'raw']
+
+
+@pytest.mark.parametrize('config', [
+    {'consoles': []},
+    {'consoles': [{'name': 'rig1'}]},
+    {'consoles': [{'ps_ip': PS_IP, 'packet_version': 'Z'}]},
+    {'consoles': [{'ps_ip': PS_IP, 'targets': [{'address': '127.0.0.1:1', 'format': 'csv'}]}]},
+    {'consoles': [{'name': 'rig1', 'ps_ip': PS_IP}, {'name': 'rig1', 'ps_ip': '192.168.1.11'}]},
+    [PS_IP],
+    '{"consoles": [',
+])
+def test_load_config_errors(tmp_path, config):
+    with pytest.raises(ValueError):
+        load_config(write_config(tmp_path, config))
+
+
+@pytest.mark.parametrize('config', [None, '{"consoles": [', {'consoles': []}])
+def test_main_reports_config_errors(tmp_path, monkeypatch, capsys, config):
+    filename = str(tmp_path / 'missing.json') if config is None else write_config(tmp_path, config)
+    monkeypatch.setattr(sys, 'argv', ['GT7MultiProxy.py', '--config', filename])
+    with pytest.raises(SystemExit) as e:
+        GT7MultiProxy.main()
+    assert e.value.code == 2
+    assert '--config {}'.format(filename) in capsys.readouterr().err
+
+
+def test_stream_forwards_to_every_target():
+    stream, protocol, transport = make_protocol([{'address': '127.0.0.1:33800', 'format': 'xsim'},
+                                                 {'address': '127.0.0.1:33801', 'format': 'raw'}])
+    packets = make_packets(1, 5)
+    for data in packets:
+        protocol.datagram_received(data, (PS_IP, 33740))
+    assert stream.received == stream.forwarded == 5
+    assert stream.pktid == 5
+    assert [data for data, address in transport.sent if address[1] == 33801] == packets
+    assert len([address for data, address in transport.sent if address[1] == 33800]) == 5
+
+
+def test_stream_drops_older_and_invalid_packets():
+    stream, protocol, transport = make_protocol([{'address': '127.0.0.1:33800', 'format': 'xsim'}])
+    for data in make_packets(10, 1) + make_packets(9, 1) + [b'\0' * 100]:
+        protocol.datagram_received(data, (PS_IP, 33740))
+    protocol.datagram_received(make_packets(11, 1)[0], ('192.168.1.99', 33740))
+    assert stream.received == 3
+    assert stream.forwarded == 1
+    assert stream.invalid == 1
+    assert protocol.unknown == 1
+
+
+def test_send_errors_go_to_the_stream_sending():
+    stream, protocol, transport = make_protocol([{'address': '127.0.0.1:33800', 'format': 'xsim'}], fail=True)
+    protocol.datagram_received(make_packets(1, 1)[0], (PS_IP, 33740))
+    assert stream.send_errors == 1
+    # Reported later by the loop, not tied to a console
+    protocol.error_received(OSError('unreachable'))
+    assert stream.send_errors == 1
+    assert protocol.errors == 1
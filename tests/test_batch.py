@@ -0,0 +1,50 @@
+import random
+
+import numpy as np
+import pytest
+
+from GT7Bench import synthetic_packet
+from gt_batch import decrypt_batch, decode_batch
+from gt_packet_definition import packet_layouts
+from gt_processing import salsa20_dec
+
+
+@pytest.mark.parametrize('packet_version', sorted(packet_layouts))
+def test_decrypt_batch_matches_salsa20_dec(packet_version):
+    layout = packet_layouts[packet_version]
+    rnd = random.Random(1)
+    packets = [synthetic_packet(pkt_id, rnd, layout) for pkt_id in range(1, 65)]
+    ddata, valid = decrypt_batch(packets, packet_version)
+    assert valid.all()
+    for row, data in zip(ddata, packets):
+        assert row.tobytes() == salsa20_dec(data, layout.xor)
+
+
+def test_decrypt_batch_flags_packets_without_magic():
+    layout = packet_layouts['B']
+    rnd = random.Random(2)
+    packets = [synthetic_packet(1, rnd, layout), bytes(layout.size), synthetic_packet(2, rnd, layout)]
+    ddata, valid = decrypt_batch(packets)
+    assert valid.tolist() == [True, False, True]
+    assert ddata[2].tobytes() == salsa20_dec(packets[2], layout.xor)
+
+
+def test_decrypt_batch_drops_other_sizes():
+    layout = packet_layouts['B']
+    rnd = random.Random(3)
+    packets = [synthetic_packet(1, rnd, layout), synthetic_packet(2, rnd, packet_layouts['A']),
+               synthetic_packet(3, rnd, layout)]
+    ddata, valid = decrypt_batch(packets)
+    assert len(ddata) == 2
+    assert ddata[1].tobytes() == salsa20_dec(packets[2], layout.xor)
+
+
+def test_decode_batch_matches_record():
+    layout = packet_layouts['B']
+    rnd = random.Random(4)
+    packets = [synthetic_packet(pkt_id, rnd, layout) for pkt_id in range(1, 9)]
+    decoded = decode_batch(packets)
+    for row, data in zip(decoded, packets):
+        telemetry = layout.record(salsa20_dec(data, layout.xor))
+        assert row['pkt_id'] == telemetry.pkt_id
+        assert np.float32(row['speed']) == np.float32(telemetry.speed)
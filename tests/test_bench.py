@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from GT7Bench import percentile, print_results, run, summarize, synthetic_packet
+from gt_packet_definition import packet_layouts
+from gt_processing import salsa20_dec
+
+
+def test_percentile_is_nearest_rank():
+    ordered = list(range(1, 101))
+    assert percentile(ordered, 50) == 50
+    assert percentile(ordered, 99) == 99
+    assert percentile(ordered, 99.9) == 100
+    assert percentile([7], 99.9) == 7
+
+
+def test_summarize():
+    result = summarize([3000, 1000, 2000, 4000])
+    assert result['mean_us'] == 2.5
+    assert result['p50_us'] == 2.0
+    assert result['max_us'] == 4.0
+    assert result['packets_per_s'] == pytest.approx(4 / 10e-6)
+
+
+@pytest.mark.parametrize('packet_version', list(packet_layouts))
+def test_synthetic_packets_decrypt(packet_version):
+    layout = packet_layouts[packet_version]
+    rnd = random.Random(1)
+    data = synthetic_packet(42, rnd, layout)
+    assert len(data) == layout.size
+    packet = layout.record(salsa20_dec(data, layout.xor))
+    assert packet.pkt_id == 42
+    assert packet.current_lap == 1
+
+
+def test_run_times_every_stage(capsys):
+    results = run(200, 20, False, 7)
+    assert results['packets'] == 200
+    for stage in ('decrypt', 'decode', 'orientation', 'xsim_packet', 'dashboard'):
+        stats = results['stages'][stage]
+        assert 0 < stats['p50_us'] <= stats['p99_us'] <= stats['max_us']
+    # The dashboard draws into a buffer, not on the terminal
+    assert capsys.readouterr().out == ''
+    print_results(results, results)
+    assert 'p50 x1.00' in capsys.readouterr().out
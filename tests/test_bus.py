@@ -0,0 +1,133 @@
+import os
+
+import pytest
+
+import gt_bus
+from gt_bus import HEADER, HEADER_AREA, SEQUENCE, SLOT_SIZE, TelemetryBus, TelemetryBusReader, attach
+from gt_engine import ProxyEngine
+from gt_processing import salsa20_dec
+from gt_packet_definition import packet_layouts
+from synthetic import make_packet
+
+LAYOUT = packet_layouts['B']
+DERIVED = (1.0, 2.0, 3.0, 0.25, 0.5, 0.75, 0.125)
+
+
+@pytest.fixture
+def name(request):
+    # One region per test, left behind by none of them
+    return 'gt7test_{}_{}'.format(os.getpid(), request.node.name.replace('[', '_').rstrip(']'))
+
+
+@pytest.fixture
+def bus(name):
+    bus = TelemetryBus(name, slots=4)
+    yield bus
+    bus.close()
+
+
+def decrypted(pkt_id):
+    return salsa20_dec(make_packet(pkt_id), LAYOUT.xor)
+
+
+def test_nothing_published_yet(bus, name):
+    reader = TelemetryBusReader(name)
+    assert reader.live
+    assert reader.latest() is None
+    assert reader.read() == []
+    reader.close()
+
+
+def test_publish_and_read(bus, name):
+    reader = TelemetryBusReader(name)
+    for pkt_id in range(1, 4):
+        bus.publish(decrypted(pkt_id), 1000 + pkt_id, DERIVED)
+    n, packet, derived = reader.latest()
+    assert n == 3
+    assert packet.pkt_id == 3
+    assert derived.time_ns == 1003
+    assert derived[1:] == DERIVED
+    assert [packet.pkt_id for n, packet, derived in reader.read(1)] == [2, 3]
+    reader.close()
+
+
+def test_read_only_what_is_still_in_the_ring(bus, name):
+    reader = TelemetryBusReader(name)
+    for pkt_id in range(1, 11):
+        bus.publish(decrypted(pkt_id), pkt_id, DERIVED)
+    assert [n for n, packet, derived in reader.read()] == [7, 8, 9, 10]
+    reader.close()
+
+
+def test_frame_being_written_is_not_returned(bus, name):
+    reader = TelemetryBusReader(name)
+    bus.publish(decrypted(1), 1, DERIVED)
+    # As publish() leaves it halfway through the next frame, in the same slot with 4 slots
+    SEQUENCE.pack_into(bus.buffer, HEADER_AREA, 2 * 5 - 1)
+    assert reader.frame(1) is None
+    assert reader.frame(5) is None
+    reader.close()
+
+
+def test_reader_sees_the_proxy_go(name):
+    bus = TelemetryBus(name)
+    reader = TelemetryBusReader(name)
+    bus.close()
+    assert not reader.live
+    reader.close()
+    with pytest.raises(FileNotFoundError):
+        TelemetryBusReader(name)
+
+
+def test_reader_leaves_the_region_to_the_proxy(bus, name):
+    reader = TelemetryBusReader(name)
+    reader.close()
+    # Still there for the next reader
+    TelemetryBusReader(name).close()
+
+
+def test_not_a_bus(name, monkeypatch):
+    from multiprocessing import shared_memory
+    memory = shared_memory.SharedMemory(name=name, create=True, size=HEADER_AREA + SLOT_SIZE)
+    # Created by this process, its registration stays for the unlink below
+    monkeypatch.setattr(gt_bus, 'published', {name})
+    try:
+        with pytest.raises(ValueError):
+            TelemetryBusReader(name)
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def test_stale_region_is_taken_over(name):
+    bus = TelemetryBus(name)
+    # A proxy that was killed leaves its pid behind, one that is surely not running
+    memory = attach(name)
+    header = list(HEADER.unpack_from(memory.buf))
+    header[6] = 0x7ffffffe
+    HEADER.pack_into(memory.buf, 0, *header)
+    memory.close()
+    bus.buffer = None
+    bus.memory.close()
+    taken = TelemetryBus(name)
+    reader = TelemetryBusReader(name)
+    assert reader.live
+    reader.close()
+    taken.close()
+
+
+def test_bus_in_use_is_refused(bus, name):
+    with pytest.raises(FileExistsError):
+        TelemetryBus(name)
+
+
+def test_engine_publishes_the_arrival_time(bus, name):
+    engine = ProxyEngine(None, bus=bus)
+    arrived = 1700000000123456789
+    for pkt_id, item, missing in engine.receive(make_packet(1), ('memory', 0), arrived):
+        engine.process(pkt_id, item, missing)
+    reader = TelemetryBusReader(name)
+    n, packet, derived = reader.latest()
+    reader.close()
+    assert packet.pkt_id == 1
+    assert derived.time_ns == arrived
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from GT7Bench import synthetic_packet
+from gt_capture import CaptureWriter, CaptureReader, CaptureError, capture_packet_version, packet_index, HEADER, \
+    TRAILER
+from gt_packet_definition import packet_layouts
+
+# pkt_id 1 to 14000: laps 1 and 2 then 3, synthetic_packet() starts a lap every 6000 packets
+PACKETS = 14000
+
+
+def write_capture(filename, packet_version='B', compress=False, chunk_packets=500, garbage=()):
+    # Written as the proxy does: a ns reading per packet, pkt_id and lap of the packets that decrypted
+    layout = packet_layouts[packet_version]
+    rnd = random.Random(8)
+    records = []
+    with CaptureWriter(filename, packet_version, compress, chunk_packets) as writer:
+        for n in range(1, PACKETS + 1):
+            data = bytes(layout.size) if n in garbage else synthetic_packet(n, rnd, layout)
+            ns = 1000000000 + n * 16666667
+            writer.write(data, ns, *packet_index(data, layout))
+            records.append((ns - 1000000000 - 16666667, data))
+    return records
+
+
+@pytest.mark.parametrize('packet_version', sorted(packet_layouts))
+@pytest.mark.parametrize('compress', (False, True))
+def test_round_trip(tmp_path, packet_version, compress):
+    filename = str(tmp_path / 'test.gt7')
+    records = write_capture(filename, packet_version, compress)
+    assert capture_packet_version(filename) == packet_version
+    with CaptureReader(filename) as reader:
+        assert reader.packet_version == packet_version
+        assert len(reader) == PACKETS
+        assert [(ns, bytes(data)) for ns, data in reader.records()] == records
+        assert [(lap, packet) for lap, packet, pkt_id in reader.laps] == [(1, 0), (2, 5999), (3, 11999)]
+        assert [bytes(data) for ns, data in reader.records(reader.lap_start(2))] == \
+            [data for ns, data in records[5999:]]
+        with pytest.raises(CaptureError):
+            reader.lap_start(4)
+
+
+def test_index_skips_packets_that_do_not_decrypt(tmp_path):
+    filename = str(tmp_path / 'test.gt7')
+    write_capture(filename, garbage=(1, 6000))
+    with CaptureReader(filename) as reader:
+        assert len(reader) == PACKETS
+        # Laps start at the first packet that decrypted, the one of pkt_id 6000 did not
+        assert reader.laps == [(1, 1, 2), (2, 6000, 6001), (3, 11999, 12000)]
+        assert reader.chunks[0][4:] == (2, 500)
+
+
+def test_index_rebuilt_without_trailer(tmp_path):
+    filename = str(tmp_path / 'test.gt7')
+    write_capture(filename, compress=True)
+    with CaptureReader(filename) as reader:
+        chunks, laps = reader.chunks, reader.laps
+    # As left by a writer that was killed after its last chunk: no index, no trailer
+    with open(filename, 'r+b') as f:
+        f.seek(-TRAILER.size, 2)
+        f.truncate(TRAILER.unpack(f.read())[0])
+    with CaptureReader(filename) as reader:
+        assert reader.chunks == chunks
+        assert reader.laps == laps
+
+
+def test_not_a_capture(tmp_path):
+    filename = str(tmp_path / 'test.gt7')
+    with open(filename, 'wb') as f:
+        f.write(b'x' * HEADER.size)
+    with pytest.raises(CaptureError):
+        capture_packet_version(filename)
+    with pytest.raises(CaptureError):
+        CaptureReader(filename)
@@ -0,0 +1,72 @@
+import io
+
+from gt_dashboard import Screen, pref
+
+STYLE = '{}0m'.format(pref)
+BOLD = '{}0m{}1m'.format(pref, pref)
+
+
+def make_screen(refresh_rate=15):
+    out = io.StringIO()
+    return Screen(refresh_rate, out), out
+
+
+def rendered(screen, out):
+    out.seek(0)
+    out.truncate()
+    screen.render()
+    return out.getvalue()
+
+
+def test_first_frame_writes_every_region():
+    screen, out = make_screen()
+    screen.put('Speed', 1, 1, STYLE)
+    screen.put('  42', 1, 10, STYLE)
+    assert rendered(screen, out) == '{}1;1H{}Speed{}1;10H{}  42'.format(pref, STYLE, pref, STYLE)
+    assert screen.frames == 1
+
+
+def test_unchanged_regions_are_not_written():
+    screen, out = make_screen()
+    screen.put('Speed', 1, 1, STYLE)
+    rendered(screen, out)
+    screen.put('Speed', 1, 1, STYLE)
+    assert rendered(screen, out) == ''
+    assert screen.frames == 1
+
+
+def test_only_the_changed_characters_are_written():
+    screen, out = make_screen()
+    screen.put(' 123.4', 2, 5, STYLE)
+    rendered(screen, out)
+    screen.put(' 128.4', 2, 5, STYLE)
+    assert rendered(screen, out) == '{}2;8H{}8'.format(pref, STYLE)
+
+
+def test_new_style_or_length_rewrites_the_region():
+    screen, out = make_screen()
+    screen.put('abc', 3, 1, STYLE)
+    rendered(screen, out)
+    screen.put('abc', 3, 1, BOLD)
+    assert rendered(screen, out) == '{}3;1H{}abc'.format(pref, BOLD)
+    screen.put('abcd', 3, 1, BOLD)
+    assert rendered(screen, out) == '{}3;1H{}abcd'.format(pref, BOLD)
+
+
+def test_changed_back_before_render_writes_nothing():
+    screen, out = make_screen()
+    screen.put('1', 1, 1, STYLE)
+    rendered(screen, out)
+    screen.put('2', 1, 1, STYLE)
+    screen.put('1', 1, 1, STYLE)
+    assert rendered(screen, out) == ''
+
+
+def test_refresh_rate_caps_the_frames():
+    screen, out = make_screen(refresh_rate=1)
+    assert screen.due()
+    assert not screen.due()
+    screen.set_refresh_rate(0)
+    screen.next_frame = 0.0
+    assert screen.due()
+    assert screen.due()
@@ -0,0 +1,112 @@
+import pytest
+
+import GT7Proxy
+from gt_engine import ProxyEngine, QueueSource, QueueSink
+from gt_packet_definition import FLAG_PAUSED, FLAG_LOADING, GTDataPacket
+from gt_pipeline import Consumer
+
+from synthetic import make_packet, make_packets
+
+
+class ListConsumer(Consumer):
+    def __init__(self):
+        Consumer.__init__(self, 'list', 0)
+        self.items = []
+
+    def handle(self, item):
+        self.items.append(item)
+
+
+def run_engine(packets, **options):
+    sink = QueueSink()
+    engine = ProxyEngine(QueueSource(packets), [sink], **options)
+    engine.start()
+    engine.run()
+    engine.close()
+    return engine, sink.frames()
+
+
+def test_lap_timer_stops_while_paused():
+    # Ticks 1 to 240 with the clock stopped from 60 to 181
+    packets = [make_packet(pkt_id, current_lap=1, flags=FLAG_PAUSED if 60 < pkt_id <= 180 else 0)
+               for pkt_id in range(1, 241)]
+    engine, frames = run_engine(packets)
+    assert engine.lapcounter.lapticks() == 239 - 121
+
+
+def test_lap_timer_runs_while_loading():
+    packets = [make_packet(pkt_id, current_lap=1, flags=FLAG_LOADING if 60 < pkt_id <= 180 else 0)
+               for pkt_id in range(1, 241)]
+    engine, frames = run_engine(packets)
+    assert engine.lapcounter.lapticks() == 239
+
+
+def test_every_packet_is_forwarded():
+    engine, frames = run_engine(make_packets(1, 50))
+    assert len(frames) == 50
+    assert engine.received.value == engine.forwarded.value == 50
+    assert engine.pktid == 50
+
+
+def test_late_packets_are_dropped_without_a_window():
+    packets = make_packets(1, 4)
+    engine, frames = run_engine([packets[0], packets[2], packets[1], packets[3]])
+    assert len(frames) == 3
+    assert engine.sequence.late == 1
+
+
+def test_reorder_window_puts_packets_back_in_order():
+    packets = make_packets(1, 4)
+    forwarded = []
+    engine, frames = run_engine([packets[0], packets[2], packets[1], packets[3]], reorder_window=1.0,
+                                on_frame=lambda ddata, *values: forwarded.append(GTDataPacket(ddata).pkt_id))
+    assert forwarded == [1, 2, 3, 4]
+    assert engine.sequence.reordered == 1
+
+
+def test_missing_packets_are_interpolated():
+    packets = make_packets(1, 5)
+    engine, frames = run_engine(packets[:2] + packets[4:], interpolate=True)
+    assert len(frames) == 5
+    assert engine.interpolated.value == 2
+    engine, frames = run_engine(packets[:2] + packets[4:])
+    assert len(frames) == 3
+
+
+def test_on_frame_when_due():
+    calls = []
+    due = iter([True, False] * 5)
+    run_engine(make_packets(1, 10), on_frame=lambda *values: calls.append(values), frame_due=lambda: next(due))
+    assert len(calls) == 5
+
+
+def test_added_consumer_runs_with_the_engine():
+    sink = QueueSink()
+    engine = ProxyEngine(QueueSource(make_packets(1, 3)), [sink])
+    consumer = ListConsumer()
+    engine.add_consumer(consumer)
+    engine.start()
+    consumer.offer('item')
+    engine.run()
+    engine.close()
+    assert consumer.items == ['item']
+    assert 'consumer_queued{consumer="list"}' in engine.metrics.to_prometheus()
+
+
+def test_send_errors_are_counted():
+    class FailingSink(QueueSink):
+        def send(self, frame):
+            raise OSError('unreachable')
+    errors = []
+    engine = ProxyEngine(QueueSource(make_packets(1, 3)), [FailingSink()], on_error=lambda *error: errors.append(error))
+    engine.start()
+    engine.run()
+    engine.close()
+    assert engine.xsim_errors.value == 3
+    assert [kind for kind, e in errors] == ['send'] * 3
+
+
+def test_upsampling_is_not_combined_with_interpolation(capsys):
+    with pytest.raises(SystemExit):
+        GT7Proxy.main(['--replay', 'GT7packets.cap', '--upsample', '4', '--interpolate', '1'])
+    assert '--interpolate cannot be used with --upsample' in capsys.readouterr().err
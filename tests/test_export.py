@@ -0,0 +1,52 @@
+import datetime
+import pickle
+
+import pytest
+
+from gt_export import DERIVED_COLUMNS, TelemetryExporter, export_capture, export_format
+from gt_packet_definition import packet_layouts
+from gt_processing import salsa20_dec
+from synthetic import make_packet
+
+# Optional like in the proxy
+ipc = pytest.importorskip('pyarrow.ipc')
+parquet = pytest.importorskip('pyarrow.parquet')
+
+LAYOUT = packet_layouts['B']
+DERIVED = (1.0, 2.0, 3.0, 0.25, 0.5, 0.75, 0.125)
+
+
+def read_table(filename):
+    if export_format(filename) == 'parquet':
+        return parquet.read_table(filename)
+    with ipc.open_file(filename) as reader:
+        return reader.read_all()
+
+
+@pytest.mark.parametrize('name', ['GT7data.parquet', 'GT7data.arrow'])
+def test_exporter_writes_every_packet(tmp_path, name):
+    filename = str(tmp_path / name)
+    # Two full batches and a partial one written on close
+    with TelemetryExporter(filename, batch_rows=4) as exporter:
+        for pkt_id in range(1, 11):
+            exporter.write(salsa20_dec(make_packet(pkt_id), LAYOUT.xor), None if pkt_id == 1 else 16667, DERIVED)
+    table = read_table(filename)
+    assert exporter.rows == table.num_rows == 10
+    assert table.column_names == list(LAYOUT.fields) + ['delta'] + list(DERIVED_COLUMNS)
+    assert table.column('pkt_id').to_pylist() == list(range(1, 11))
+    assert table.column('delta').to_pylist() == [None] + [16667] * 9
+    assert table.column('slip').to_pylist() == [0.125] * 10
+
+
+def test_export_capture_keeps_what_the_proxy_forwards(tmp_path):
+    capture = str(tmp_path / 'GT7packets.cap')
+    # 3 comes twice and 2 after it, as the proxy would ignore them
+    ids = [1, 3, 2, 3, 4]
+    with open(capture, 'wb') as f:
+        for n, pkt_id in enumerate(ids):
+            pickle.dump(['12:00:00:{:06}'.format(n), datetime.timedelta(milliseconds=n), make_packet(pkt_id)], f)
+    filename = str(tmp_path / 'GT7data.parquet')
+    assert export_capture(capture, filename) == 3
+    table = read_table(filename)
+    assert table.column('pkt_id').to_pylist() == [1, 3, 4]
+    assert table.column('delta').to_pylist() == [0, 1000, 4000]
@@ -0,0 +1,59 @@
+import random
+import struct
+from ctypes import sizeof
+
+import pytest
+
+from GT7Bench import synthetic_packet
+from gt_packet_definition import packet_layouts, gt_offsets, GTForwardPacket
+from gt_processing import salsa20_dec, make_xsim_packet, XSimForwarder
+from xsim_packet_definition import TelemetryPacket
+
+FLAGS = struct.Struct('<H')
+
+
+def decrypted_packets(layout, count, seed):
+    # Decrypted synthetic packets with random flags, so that every bit XSim reads gets set at some point
+    rnd = random.Random(seed)
+    packets = []
+    for pkt_id in range(1, count + 1):
+        ddata = bytearray(salsa20_dec(synthetic_packet(pkt_id, rnd, layout), layout.xor))
+        FLAGS.pack_into(ddata, gt_offsets['flags'][0], rnd.getrandbits(16))
+        packets.append(bytes(ddata))
+    return packets
+
+
+@pytest.mark.parametrize('packet_version', sorted(packet_layouts))
+def test_forwarder_matches_make_xsim_packet(packet_version):
+    layout = packet_layouts[packet_version]
+    forwarder = XSimForwarder(layout)
+    rnd = random.Random(5)
+    for ddata in decrypted_packets(layout, 200, 6):
+        telemetry = layout.record(ddata)
+        cgear = telemetry.suggestedgear_gear & 0b00001111
+        roll, pitch, yaw, slip_angle = (rnd.uniform(-180, 180) for _ in range(4))
+        expected = bytes(make_xsim_packet(telemetry, cgear, roll, pitch, yaw, slip_angle))
+        frame = forwarder.packet(ddata, GTForwardPacket(ddata), cgear, roll, pitch, yaw, slip_angle)
+        assert len(frame) == sizeof(TelemetryPacket)
+        assert bytes(frame) == expected
+
+
+def test_one_frame_for_the_session():
+    layout = packet_layouts['B']
+    forwarder = XSimForwarder(layout)
+    frames = [forwarder.packet(ddata, GTForwardPacket(ddata), 3, 1.0, 2.0, 3.0, 4.0)
+              for ddata in decrypted_packets(layout, 3, 7)]
+    # The same buffer, overwritten by every packet
+    assert all(frame.obj is forwarder.xsim.buffer for frame in frames)
+
+
+def test_frame_follows_car_changes():
+    layout = packet_layouts['B']
+    forwarder = XSimForwarder(layout)
+    # A shorter car code leaves nothing of the longer one behind
+    for car_code, ddata in zip((56789, 12, 1234), decrypted_packets(layout, 3, 8)):
+        ddata = bytearray(ddata)
+        struct.pack_into('<i', ddata, gt_offsets['car_code'][0], car_code)
+        telemetry = layout.record(ddata)
+        expected = bytes(make_xsim_packet(telemetry, 3, 1.0, 2.0, 3.0, 4.0))
+        assert bytes(forwarder.packet(ddata, GTForwardPacket(ddata), 3, 1.0, 2.0, 3.0, 4.0)) == expected
@@ -0,0 +1,52 @@
+import pytest
+
+from gt_heartbeat import HeartbeatScheduler
+
+
+def test_subscribes_right_away():
+    scheduler = HeartbeatScheduler()
+    assert scheduler.poll(100.0)
+    assert scheduler.heartbeats == 1
+    # Not a resubscription, the stream never started
+    assert scheduler.resubscriptions == 0
+
+
+def test_every_interval_while_packets_flow():
+    scheduler = HeartbeatScheduler(interval=1.0)
+    sent = []
+    for i in range(300):
+        now = i / 100
+        scheduler.packet_received(now)
+        if scheduler.poll(now):
+            sent.append(now)
+    assert sent == [1.0, 2.0]
+    assert scheduler.gaps == 0
+
+
+def test_gap_resubscribes_with_backoff():
+    scheduler = HeartbeatScheduler(interval=1.0, gap_timeout=0.05, backoff_max=0.2)
+    scheduler.packet_received(0.0)
+    assert not scheduler.poll(0.04)
+    # Gap noticed after 50ms, then 50, 100 and 200ms apart, never more than backoff_max
+    assert [scheduler.poll(now) for now in (0.061, 0.1, 0.112, 0.2, 0.213, 0.4, 0.414, 0.6, 0.615)] == \
+        [True, False, True, False, True, False, True, False, True]
+    assert scheduler.gaps == 1
+    assert scheduler.resubscriptions == 5
+    assert scheduler.current_gap(0.8) == pytest.approx(0.8)
+
+
+def test_recovery_is_measured():
+    scheduler = HeartbeatScheduler(interval=1.0, gap_timeout=0.05)
+    scheduler.packet_received(0.0)
+    scheduler.poll(0.1)
+    scheduler.packet_received(0.5)
+    assert scheduler.recoveries == 1
+    assert scheduler.last_gap == scheduler.longest_gap == pytest.approx(0.5)
+    assert scheduler.current_gap(0.6) == 0.0
+    # Back to the regular interval
+    assert not scheduler.poll(0.52)
+    assert scheduler.poll(1.5)
+
+
+def test_wait_detects_gaps_in_time():
+    assert HeartbeatScheduler(gap_timeout=0.05).wait() == pytest.approx(0.025)
@@ -0,0 +1,83 @@
+import socket
+import time
+
+import pytest
+
+from gt_engine import ProxyEngine, QueueSink
+from gt_ingest import UdpIngest
+from synthetic import make_packets
+
+
+@pytest.fixture
+def sender():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield s
+    s.close()
+
+
+def make_ingest(**options):
+    ingest = UdpIngest(0, **options)
+    ingest.settimeout(1.0)
+    return ingest, ('127.0.0.1', ingest.socket.getsockname()[1])
+
+
+def test_recvfrom_like_a_socket(sender):
+    ingest, address = make_ingest()
+    sender.sendto(b'hello', address)
+    data, source = ingest.recvfrom(4096)
+    assert data == b'hello'
+    assert source == ('127.0.0.1', sender.getsockname()[1])
+    ingest.settimeout(0.01)
+    with pytest.raises(socket.timeout):
+        ingest.recvfrom(4096)
+    ingest.close()
+
+
+def test_arrival_timestamps(sender):
+    ingest, address = make_ingest()
+    before = time.time_ns()
+    sender.sendto(b'hello', address)
+    view, source, timestamp = ingest.drain()[0]
+    # Kernel and Python clocks agree to well within a second
+    assert before - 10 ** 9 < timestamp <= time.time_ns() + 10 ** 9
+    ingest.close()
+
+
+def test_drain_takes_everything_queued(sender):
+    ingest, address = make_ingest(drain=True, ring_size=4)
+    for n in range(6):
+        sender.sendto(bytes([n]), address)
+    time.sleep(0.05)
+    # At most a ring of views per wakeup
+    assert [bytes(view) for view, source, timestamp in ingest.drain()] == [b'\0', b'\1', b'\2', b'\3']
+    assert [bytes(view) for view, source, timestamp in ingest.drain()] == [b'\4', b'\5']
+    assert ingest.largest_batch == 4
+    ingest.close()
+
+
+def test_views_are_reused(sender):
+    ingest, address = make_ingest(ring_size=2)
+    views = []
+    for n in range(3):
+        sender.sendto(bytes([n]), address)
+        views.append(ingest.drain()[0][0])
+    # The third receive went into the buffer of the first
+    assert bytes(views[0]) == b'\2'
+    assert bytes(views[1]) == b'\1'
+    ingest.close()
+
+
+def test_engine_forwards_the_newest_of_a_batch(sender):
+    ingest, address = make_ingest(drain=True)
+    sink = QueueSink()
+    engine = ProxyEngine(ingest, [sink])
+    engine.start()
+    for data in make_packets(1, 5):
+        sender.sendto(data, address)
+    time.sleep(0.05)
+    engine.step()
+    engine.close()
+    assert len(sink.frames()) == 1
+    assert engine.pktid == 5
+    assert engine.skipped.value == 4
+    assert engine.socket_wait.count == 5
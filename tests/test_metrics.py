@@ -0,0 +1,78 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from gt_metrics import Histogram, Metrics, MetricsLogger, MetricsServer
+
+
+def make_metrics():
+    metrics = Metrics()
+    received = metrics.counter('packets_received', 'Datagrams received')
+    received.value = 3
+    metrics.gauge('consumer_dropped', 'Items dropped', lambda: 2, consumer='csv logger')
+    stage = metrics.histogram('stage_seconds', 'Time per stage', buckets=(0.001, 0.01), stage='decrypt')
+    for value in (0.0005, 0.002, 0.02):
+        stage.observe(value)
+    return metrics
+
+
+def test_histogram_quantiles():
+    histogram = Histogram((1.0, 2.0, 4.0))
+    assert histogram.quantile(0.5) == 0.0
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 0]
+    # Halfway through the (1, 2] bucket
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    # Capped by the largest value seen
+    assert histogram.quantile(1.0) == pytest.approx(3.0)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 4
+    assert snapshot['mean'] == pytest.approx(1.625)
+    assert snapshot['buckets'] == {'1.0': 1, '2.0': 2, '4.0': 1, '+Inf': 0}
+
+
+def test_prometheus_text():
+    text = make_metrics().to_prometheus()
+    assert '# TYPE gt7_packets_received counter\ngt7_packets_received 3\n' in text
+    assert 'gt7_consumer_dropped{consumer="csv logger"} 2\n' in text
+    # Cumulated buckets
+    assert 'gt7_stage_seconds_bucket{stage="decrypt",le="0.001"} 1\n' in text
+    assert 'gt7_stage_seconds_bucket{stage="decrypt",le="0.01"} 2\n' in text
+    assert 'gt7_stage_seconds_bucket{stage="decrypt",le="+Inf"} 3\n' in text
+    assert 'gt7_stage_seconds_count{stage="decrypt"} 3\n' in text
+
+
+def test_json():
+    values = make_metrics().to_json()
+    assert values['packets_received'] == 3
+    assert values['consumer_dropped.csv logger'] == 2
+    assert values['stage_seconds.decrypt']['count'] == 3
+
+
+def test_server():
+    server = MetricsServer(make_metrics(), 0)
+    server.start()
+    try:
+        url = 'http://127.0.0.1:{}'.format(server.server.server_address[1])
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert b'gt7_packets_received 3' in response.read()
+        with urllib.request.urlopen(url + '/metrics.json') as response:
+            assert json.load(response)['packets_received'] == 3
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other')
+    finally:
+        server.stop()
+
+
+def test_logger_writes_a_last_line_on_stop(tmp_path):
+    filename = str(tmp_path / 'metrics.jsonl')
+    logger = MetricsLogger(make_metrics(), filename, interval=60)
+    logger.start()
+    logger.stop()
+    with open(filename) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 1
+    assert lines[0]['packets_received'] == 3
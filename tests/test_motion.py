@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+
+from gt_motion import AxisFilter, LowPass, RateLimit, Upsampler, Washout, load_motion_config
+from gt_packet_definition import GTForwardPacket, packet_layouts
+from gt_processing import salsa20_dec, XSimForwarder
+from synthetic import make_packet
+
+LAYOUT = packet_layouts['B']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_config(tmp_path, config):
+    filename = str(tmp_path / 'motion.json')
+    with open(filename, 'w') as f:
+        json.dump(config, f)
+    return filename
+
+
+def run(f, values):
+    return [f.step(x) for x in values]
+
+
+def test_lowpass_smooths_a_step():
+    out = run(LowPass(8), [0.0] + [1.0] * 60)
+    assert out[0] == 0.0
+    assert 0 < out[1] < out[2] < 1
+    assert out[-1] == pytest.approx(1.0)
+
+
+def test_washout_fades_a_sustained_value():
+    out = run(Washout(0.5), [0.0] + [1.0] * 600)
+    assert out[1] == pytest.approx(1.0, abs=0.05)
+    assert abs(out[-1]) < 0.01
+
+
+def test_ratelimit_caps_the_rate():
+    out = run(RateLimit(60), [0.0, 10.0, 10.0])
+    assert out == pytest.approx([0.0, 1.0, 2.0])
+
+
+def test_angles_cross_180_without_a_jump():
+    f = AxisFilter([RateLimit(600)], angle=True)
+    out = run(f, [179.0, -179.0])
+    # 2 degrees the short way round, within the 10 degree limit
+    assert out == pytest.approx([179.0, -179.0])
+
+
+def test_load_motion_config(tmp_path):
+    axes = load_motion_config(write_config(tmp_path, {
+        'surge': [{'filter': 'lowpass', 'cutoff': 8}, {'filter': 'washout', 'cutoff': 0.3}],
+        'yaw': [{'filter': 'ratelimit', 'rate': 90}]}))
+    assert [type(f) for f in axes['surge'].filters] == [LowPass, Washout]
+    assert axes['yaw'].angle
+    assert not axes['surge'].angle
+
+
+def test_example_config_loads():
+    assert len(load_motion_config(os.path.join(ROOT, 'GT7Motion.example.json'))) == 7
+
+
+@pytest.mark.parametrize('config, message', [
+    ([{'filter': 'lowpass', 'cutoff': 8}], 'JSON object'),
+    ({'wobble': []}, 'wobble'),
+    ({'surge': {'filter': 'lowpass', 'cutoff': 8}}, 'surge'),
+    ({'surge': ['lowpass']}, 'surge'),
+    ({'surge': [{'filter': 'bandpass', 'cutoff': 8}]}, 'bandpass'),
+    ({'surge': [{'filter': 'lowpass'}]}, 'surge: lowpass'),
+    ({'surge': [{'filter': 'lowpass', 'cutoff': '8'}]}, 'surge: lowpass'),
+    ({'surge': [{'filter': 'lowpass', 'cutoff': True}]}, 'surge: lowpass'),
+    ({'heave': [{'filter': 'washout', 'cutoff': 0}]}, 'heave: washout'),
+    ({'yaw': [{'filter': 'ratelimit', 'rate': -90}]}, 'yaw: ratelimit'),
+])
+def test_load_motion_config_errors(tmp_path, config, message):
+    with pytest.raises(ValueError, match=message):
+        load_motion_config(write_config(tmp_path, config))
+
+
+def test_upsampler_spreads_frames_over_a_packet():
+    forwarder = XSimForwarder(LAYOUT)
+    upsampler = Upsampler(forwarder, 4)
+    for pkt_id in (1, 2):
+        ddata = salsa20_dec(make_packet(pkt_id), LAYOUT.xor)
+        forwarder.packet(ddata, GTForwardPacket(ddata), 1, 0.0, 0.0, 0.0, 0.0)
+        upsampler.segment(pkt_id)
+        # Only the first frame is due right away, the others follow every quarter of a packet
+        assert len(list(upsampler.due(pkt_id))) == 1
+        assert len(list(upsampler.due(pkt_id + upsampler.interval * 2))) == 2
+        assert len(list(upsampler.due(pkt_id + 1))) == 1
+    assert upsampler.frames == 8
+    assert upsampler.wait(1.0) == upsampler.interval
@@ -0,0 +1,107 @@
+import csv
+import datetime
+import pickle
+import threading
+
+from gt_packet_definition import GTDataPacket, packet_layouts
+from gt_pipeline import BLOCK, DROP_NEWEST, DROP_OLDEST, Consumer, CsvLogger, PacketLogger, XSIM_CSV_HEADER
+from gt_processing import salsa20_dec
+from synthetic import make_packet
+
+LAYOUT = packet_layouts['B']
+
+
+class ListConsumer(Consumer):
+    # Holds every item until released, so that the queue fills up
+    def __init__(self, maxsize, drop=DROP_NEWEST):
+        Consumer.__init__(self, 'list', maxsize, drop)
+        self.items = []
+        self.release = threading.Event()
+
+    def handle(self, item):
+        self.release.wait()
+        if item == 'boom':
+            raise ValueError(item)
+        self.items.append(item)
+
+
+def test_drop_newest_keeps_the_backlog():
+    consumer = ListConsumer(2)
+    for item in range(5):
+        consumer.offer(item)
+    assert consumer.dropped == 3
+    consumer.start()
+    consumer.release.set()
+    consumer.stop()
+    assert consumer.items == [0, 1]
+
+
+def test_drop_oldest_keeps_the_latest():
+    consumer = ListConsumer(2, DROP_OLDEST)
+    for item in range(5):
+        consumer.offer(item)
+    assert consumer.dropped == 3
+    consumer.start()
+    consumer.release.set()
+    consumer.stop()
+    assert consumer.items == [3, 4]
+
+
+def test_block_waits_for_room():
+    consumer = ListConsumer(1, BLOCK)
+    consumer.start()
+    offered = threading.Thread(target=lambda: [consumer.offer(item) for item in range(5)])
+    offered.start()
+    consumer.release.set()
+    offered.join()
+    consumer.stop()
+    assert consumer.items == list(range(5))
+    assert consumer.dropped == 0
+
+
+def test_errors_do_not_stop_the_thread():
+    consumer = ListConsumer(0)
+    consumer.release.set()
+    consumer.start()
+    for item in ('a', 'boom', 'b'):
+        consumer.offer(item)
+    consumer.stop()
+    assert consumer.items == ['a', 'b']
+    assert consumer.errors == 1
+    assert isinstance(consumer.last_error, ValueError)
+    assert consumer.handled == 2
+    assert consumer.handle_time.count == 2
+
+
+def test_packet_logger(tmp_path):
+    filename, rawfilename = str(tmp_path / 'GT7packets.cap'), str(tmp_path / 'GT7packets.raw.cap')
+    packets = [make_packet(pkt_id) for pkt_id in (1, 2)]
+    logger = PacketLogger(0, filename=filename, rawfilename=rawfilename)
+    logger.start()
+    logger.offer((1700000000000000000, 0, packets[0], 0, 1, 1))
+    logger.offer((1700000000016667000, 16667000, packets[1], 16667000, 2, 1))
+    logger.stop()
+    with open(filename, 'rb') as f:
+        records = [pickle.load(f), pickle.load(f)]
+    assert [data for ts, delta, data in records] == packets
+    assert records[1][1] == datetime.timedelta(microseconds=16667)
+    with open(rawfilename, 'rb') as f:
+        assert f.read() == b''.join(packets)
+
+
+def test_csv_logger(tmp_path):
+    filename, xsimfilename = str(tmp_path / 'GT7data.csv'), str(tmp_path / 'GT7dataXsim.csv')
+    logger = CsvLogger(0, filename=filename, xsimfilename=xsimfilename)
+    logger.start()
+    for pkt_id in (1, 2):
+        ddata = salsa20_dec(make_packet(pkt_id), LAYOUT.xor)
+        logger.offer((ddata, 16667000 * (pkt_id - 1), 0.1, 0.2, 0.3, (1.0, 2.0, 3.0), 0.4))
+    logger.stop()
+    with open(filename, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(GTDataPacket._fields)
+    assert [int(row[rows[0].index('pkt_id')]) for row in rows[1:]] == [1, 2]
+    with open(xsimfilename) as f:
+        lines = f.readlines()
+    assert lines[0] == XSIM_CSV_HEADER
+    assert [line.split(',')[0] for line in lines[1:]] == ['0', '16667']
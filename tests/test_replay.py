@@ -0,0 +1,129 @@
+import datetime
+import pickle
+import random
+import socket
+import time
+
+import pytest
+
+from GT7Bench import synthetic_packet
+from gt_capture import CaptureWriter, packet_index
+from gt_engine import ProxyEngine, QueueSink
+from gt_packet_definition import packet_layouts
+from gt_replay import ReplaySocket, ReplayFinished, open_capture
+
+LAYOUT = packet_layouts['B']
+
+
+def synthetic_packets(count, layout=LAYOUT, first=1):
+    rnd = random.Random(first)
+    return [synthetic_packet(pkt_id, rnd, layout) for pkt_id in range(first, first + count)]
+
+
+def write_pickle_capture(filename, packets, interval=datetime.timedelta(milliseconds=1)):
+    # As --logpackets --capture_format pickle writes it
+    with open(filename, 'wb') as f:
+        for n, data in enumerate(packets):
+            pickle.dump(['12:00:00:{:06}'.format(n), interval if n else datetime.timedelta(0), data], f)
+
+
+def write_gt7_capture(filename, packets, interval_ns=1000000):
+    with CaptureWriter(filename) as writer:
+        for n, data in enumerate(packets):
+            writer.write(data, n * interval_ns, *packet_index(data, LAYOUT))
+
+
+def replay_all(replay):
+    received = []
+    with pytest.raises(ReplayFinished):
+        while True:
+            data, address = replay.recvfrom(4096)
+            received.append(data)
+    return received
+
+
+def test_pickle_capture(tmp_path):
+    filename = str(tmp_path / 'GT7packets.cap')
+    packets = synthetic_packets(20)
+    write_pickle_capture(filename, packets)
+    replay = ReplaySocket(filename)
+    assert replay_all(replay) == packets
+    assert replay.packets == 20
+    # Still finished when asked again
+    with pytest.raises(ReplayFinished):
+        replay.recvfrom(4096)
+
+
+def test_raw_capture_cut_by_packet_size(tmp_path):
+    filename = str(tmp_path / 'GT7packets.raw.cap')
+    packets = synthetic_packets(10, packet_layouts['~'])
+    with open(filename, 'wb') as f:
+        # A packet cut short by a proxy that was killed is left out
+        f.write(b''.join(packets) + packets[0][:100])
+    replay = ReplaySocket(filename, packet_size=packet_layouts['~'].size)
+    assert replay_all(replay) == packets
+
+
+def test_gt7_capture(tmp_path):
+    filename = str(tmp_path / 'GT7packets.gt7')
+    packets = synthetic_packets(30)
+    write_gt7_capture(filename, packets)
+    assert replay_all(ReplaySocket(filename)) == packets
+
+
+def test_gt7_capture_from_lap(tmp_path):
+    filename = str(tmp_path / 'GT7packets.gt7')
+    # synthetic_packet() starts lap 2 at pkt_id 6000
+    packets = synthetic_packets(20, first=5990)
+    write_gt7_capture(filename, packets)
+    assert replay_all(ReplaySocket(filename, start_lap=2)) == packets[10:]
+
+
+def test_only_gt7_captures_start_at_a_lap(tmp_path):
+    filename = str(tmp_path / 'GT7packets.cap')
+    write_pickle_capture(filename, synthetic_packets(2))
+    with pytest.raises(ValueError):
+        open_capture(filename, start_lap=2)
+
+
+def test_heartbeats_are_swallowed(tmp_path):
+    filename = str(tmp_path / 'GT7packets.cap')
+    write_pickle_capture(filename, synthetic_packets(1))
+    replay = ReplaySocket(filename)
+    assert replay.sendto(b'B', ('192.168.1.2', 33739)) == 1
+    assert replay.recvfrom(4096)[1] == (filename, 0)
+
+
+def test_realtime_honours_the_recorded_deltas(tmp_path):
+    filename = str(tmp_path / 'GT7packets.cap')
+    write_pickle_capture(filename, synthetic_packets(6), datetime.timedelta(milliseconds=20))
+    replay = ReplaySocket(filename, realtime=True)
+    start = time.perf_counter()
+    replay_all(replay)
+    # The first packet goes out right away, then 5 deltas of 20ms
+    assert time.perf_counter() - start >= 0.1
+
+
+def test_realtime_times_out_like_a_socket(tmp_path):
+    filename = str(tmp_path / 'GT7packets.cap')
+    packets = synthetic_packets(2)
+    write_pickle_capture(filename, packets, datetime.timedelta(milliseconds=100))
+    replay = ReplaySocket(filename, realtime=True)
+    replay.settimeout(0.02)
+    assert replay.recvfrom(4096)[0] == packets[0]
+    with pytest.raises(socket.timeout):
+        replay.recvfrom(4096)
+    replay.settimeout(None)
+    assert replay.recvfrom(4096)[0] == packets[1]
+
+
+def test_replay_drives_the_proxy(tmp_path):
+    filename = str(tmp_path / 'GT7packets.gt7')
+    write_gt7_capture(filename, synthetic_packets(100))
+    sink = QueueSink()
+    engine = ProxyEngine(ReplaySocket(filename), [sink])
+    engine.start()
+    engine.run()
+    engine.close()
+    assert len(sink.frames()) == 100
+    assert engine.forwarded.value == 100
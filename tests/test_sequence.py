@@ -0,0 +1,129 @@
+from gt_sequence import SequenceTracker, sequence_delta
+
+INT32_MAX = (1 << 31) - 1
+INT32_MIN = -(1 << 31)
+
+
+def released_ids(released):
+    return [pkt_id for pkt_id, item, missing in released]
+
+
+def test_in_order_and_gaps():
+    tracker = SequenceTracker()
+    assert tracker.push(10, 'a', 0.0) == [(10, 'a', 0)]
+    assert tracker.push(11, 'b', 0.0) == [(11, 'b', 0)]
+    assert tracker.push(14, 'c', 0.0) == [(14, 'c', 2)]
+    assert (tracker.gaps, tracker.lost, tracker.longest_gap) == (1, 2, 2)
+
+
+def test_late_and_duplicates_without_window():
+    tracker = SequenceTracker()
+    tracker.push(1, None, 0.0)
+    tracker.push(3, None, 0.0)
+    assert tracker.push(2, None, 0.0) == []
+    assert tracker.push(3, None, 0.0) == []
+    assert (tracker.late, tracker.duplicates, tracker.lost) == (1, 1, 1)
+
+
+def test_reorder_window():
+    tracker = SequenceTracker(window=0.05)
+    assert released_ids(tracker.push(1, None, 0.0)) == [1]
+    # 3 and 4 wait for 2, which arrives in time
+    assert tracker.push(3, None, 0.01) == []
+    assert tracker.push(4, None, 0.02) == []
+    assert tracker.push(3, None, 0.02) == []
+    assert tracker.push(2, None, 0.03) == [(2, None, 0), (3, None, 0), (4, None, 0)]
+    assert (tracker.reordered, tracker.duplicates, tracker.lost) == (1, 1, 0)
+
+
+def test_reorder_window_expires():
+    tracker = SequenceTracker(window=0.05)
+    tracker.push(1, None, 0.0)
+    assert tracker.push(4, None, 0.01) == []
+    assert tracker.push(5, None, 0.02) == []
+    assert tracker.expire(0.03) == []
+    # 2 and 3 never came
+    assert tracker.expire(0.07) == [(4, None, 2), (5, None, 0)]
+    assert released_ids(tracker.push(3, None, 0.08)) == []
+    assert (tracker.late, tracker.lost) == (1, 2)
+    assert tracker.wait(1.0) == 0.05
+
+
+def test_flush_releases_everything_held():
+    tracker = SequenceTracker(window=10.0)
+    tracker.push(1, None, 0.0)
+    tracker.push(3, None, 0.0)
+    tracker.push(6, None, 0.0)
+    assert tracker.flush() == [(3, None, 1), (6, None, 2)]
+
+
+def test_wraparound():
+    assert sequence_delta(INT32_MIN, INT32_MAX) == 1
+    assert sequence_delta(INT32_MAX, INT32_MIN) == -1
+    tracker = SequenceTracker(window=0.05)
+    tracker.push(INT32_MAX - 1, None, 0.0)
+    # The int32 pkt_id goes on from the lowest value, not a reset
+    assert tracker.push(INT32_MIN + 1, None, 0.01) == []
+    assert released_ids(tracker.push(INT32_MAX, None, 0.02)) == [INT32_MAX]
+    assert released_ids(tracker.push(INT32_MIN, None, 0.03)) == [INT32_MIN, INT32_MIN + 1]
+    assert (tracker.resets, tracker.late, tracker.lost) == (0, 0, 0)
+
+
+def test_wraparound_gap():
+    tracker = SequenceTracker()
+    tracker.push(INT32_MAX, None, 0.0)
+    assert tracker.push(INT32_MIN + 2, None, 0.0) == [(INT32_MIN + 2, None, 2)]
+    assert tracker.resets == 0
+
+
+def test_reset():
+    tracker = SequenceTracker(window=0.05)
+    tracker.push(5000, 'old', 0.0)
+    tracker.push(5002, 'held', 0.01)
+    # The game restarted its numbering: what was held goes out first, then the new session
+    assert tracker.push(1, 'new', 0.02) == [(5002, 'held', 1), (1, 'new', 0)]
+    assert released_ids(tracker.push(2, None, 0.03)) == [2]
+    assert (tracker.resets, tracker.late) == (1, 0)
+
+
+def test_small_step_back_is_late_not_reset():
+    tracker = SequenceTracker()
+    tracker.push(5000, None, 0.0)
+    assert tracker.push(5000 - 60, None, 0.0) == []
+    assert tracker.push(5000 - 61, None, 0.0) == [(5000 - 61, None, 0)]
+    assert (tracker.late, tracker.resets) == (1, 1)
+
+
+def test_restart_close_to_the_old_ids():
+    tracker = SequenceTracker()
+    for pkt_id in range(1, 51):
+        tracker.push(pkt_id, None, 0.0)
+    # New session from 1: within RESET_BACKWARDS of 50, each packet alone looks late
+    released = []
+    for pkt_id in range(1, 21):
+        released += tracker.push(pkt_id, pkt_id, 0.0)
+    assert released == [(pkt_id, pkt_id, 0) for pkt_id in range(1, 21)]
+    assert (tracker.resets, tracker.late, tracker.lost) == (1, 0, 0)
+
+
+def test_scattered_late_packets_are_no_restart():
+    tracker = SequenceTracker()
+    for pkt_id in range(1, 51):
+        tracker.push(pkt_id, None, 0.0)
+        if pkt_id > 10 and pkt_id % 5 == 0:
+            # Late but not following each other
+            assert tracker.push(pkt_id - 8, None, 0.0) == []
+    assert (tracker.resets, tracker.late) == (0, 8)
+
+
+def test_restart_close_to_the_old_ids_with_window():
+    tracker = SequenceTracker(window=0.05)
+    for pkt_id in range(100, 131):
+        tracker.push(pkt_id, None, 0.0)
+    tracker.push(133, None, 0.01)
+    released = []
+    for pkt_id in range(90, 95):
+        released += tracker.push(pkt_id, None, 0.02)
+    # What the old session left held goes out first
+    assert released_ids(released) == [133, 90, 91, 92, 93, 94]
+    assert tracker.resets == 1
@@ -0,0 +1,16 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only imported by the option that needs them
+OPTIONAL = ('csv', 'pickle', 'gt_capture', 'gt_export', 'gt_analytics', 'gt_trackmap', 'gt_bus', 'gt_workers',
+            'numpy', 'pyarrow', 'http.server')
+
+
+def test_plain_forwarding_imports():
+    # In a fresh interpreter, pytest itself has loaded some of these
+    loaded = subprocess.run([sys.executable, '-c', 'import json, sys, GT7Proxy; print(json.dumps(list(sys.modules)))'],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert sorted(set(OPTIONAL) & set(json.loads(loaded))) == []
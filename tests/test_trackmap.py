@@ -0,0 +1,110 @@
+import math
+import os
+import random
+
+from gt_trackmap import TrackMap, TrackMaps, MAX_OFFSET
+
+
+def oval(lap_time, shift=0.0, straight=400.0, radius=100.0, step=5.0):
+    # A closed lap, two straights and two half circles, with a point every step metres
+    x, z = [], []
+    for i in range(int(straight / step)):
+        x.append(i * step + shift)
+        z.append(-radius)
+    for i in range(int(math.pi * radius / step)):
+        angle = -math.pi / 2 + i * step / radius
+        x.append(straight + radius * math.cos(angle) + shift)
+        z.append(radius * math.sin(angle))
+    for i in range(int(straight / step)):
+        x.append(straight - i * step + shift)
+        z.append(radius)
+    for i in range(int(math.pi * radius / step)):
+        angle = math.pi / 2 + i * step / radius
+        x.append(radius * math.cos(angle) + shift)
+        z.append(radius * math.sin(angle))
+    time = [lap_time * i / len(x) for i in range(len(x))]
+    return TrackMap(x, z, time, lap_time, 1.5)
+
+
+def test_nearest_matches_brute_force():
+    trackmap = oval(60.0)
+    rnd = random.Random(9)
+    for _ in range(500):
+        x, z = rnd.uniform(-150, 550), rnd.uniform(-150, 150)
+        distances = [trackmap.distance2(i, x, z) for i in range(trackmap.n)]
+        closest = min(distances)
+        nearest = trackmap.nearest(x, z)
+        if closest > MAX_OFFSET ** 2:
+            assert nearest is None
+        else:
+            assert distances[nearest] == closest
+
+
+def test_cursor_follows_the_car():
+    trackmap = oval(60.0)
+    cursor = trackmap.cursor()
+    previous = None
+    for i in range(trackmap.n * 2):
+        # Halfway between two points, 2 m off the line
+        a, b = i % trackmap.n, (i + 1) % trackmap.n
+        position = cursor.follow((trackmap.x[a] + trackmap.x[b]) / 2, (trackmap.z[a] + trackmap.z[b]) / 2 + 2)
+        assert abs(position - (a + 0.5)) < 0.5
+        if previous is not None and a:
+            assert position > previous
+        previous = position
+    assert cursor.follow(1000.0, 1000.0) is None
+
+
+def test_time_and_distance_along_the_map():
+    trackmap = oval(60.0)
+    assert trackmap.time_at(trackmap.n / 2) == 30.0
+    assert abs(trackmap.length - (800 + 2 * math.pi * 100)) < 5
+    assert trackmap.distance_at(0.5) == 2.5
+
+
+def test_save_and_load(tmp_path):
+    trackmap = oval(61.5)
+    filename = str(tmp_path / (trackmap.key() + '.json'))
+    trackmap.save(filename)
+    loaded = TrackMap.load(filename)
+    assert (loaded.x, loaded.z, loaded.time, loaded.lap_time) == (trackmap.x, trackmap.z, trackmap.time, 61.5)
+
+
+def test_same_track_despite_other_bounds():
+    # Another line through the same corners moves the bounds across a rounding step
+    first, second = oval(60.0), oval(59.0, shift=6.0)
+    assert first.key() != second.key()
+    assert first.same_track(second) and second.same_track(first)
+    # A shorter layout stays on the long one, the long one does not stay on it
+    assert not first.same_track(oval(40.0, straight=200.0))
+
+
+def test_one_map_per_track_the_fastest(tmp_path):
+    directory = str(tmp_path)
+    trackmaps = TrackMaps(directory)
+    filename = trackmaps.save(oval(60.0))
+    # Slower lap with other bounds: the saved one is kept
+    assert trackmaps.save(oval(61.0, shift=6.0)) is None
+    # Faster lap with other bounds: written over the saved one
+    assert trackmaps.save(oval(59.0, shift=6.0)) == filename
+    assert os.listdir(directory) == [os.path.basename(filename)]
+    assert TrackMaps(directory).find(0.0, -100.0).lap_time == 59.0
+    # Saved whatever its time when asked to
+    assert trackmaps.save(oval(65.0), faster=False) == filename
+    assert TrackMaps(directory).find(0.0, -100.0).lap_time == 65.0
+
+
+def test_fastest_of_several_saved_maps(tmp_path):
+    # As left by sessions that saved a file per lap with different bounds
+    directory = str(tmp_path)
+    for lap_time, shift in ((60.0, 0.0), (58.0, 6.0), (59.0, 16.0)):
+        trackmap = oval(lap_time, shift)
+        trackmap.save(os.path.join(directory, trackmap.key() + '.json'))
+    assert len(os.listdir(directory)) == 3
+    trackmaps = TrackMaps(directory)
+    assert trackmaps.find(0.0, -100.0).lap_time == 58.0
+    assert trackmaps.find(1000.0, 1000.0) is None
+    # The fastest file is the one a faster lap replaces
+    filename = trackmaps.save(oval(57.0))
+    assert TrackMap.load(filename).lap_time == 57.0
+    assert trackmaps.find(0.0, -100.0).lap_time == 57.0
@@ -0,0 +1,54 @@
+import pytest
+
+from gt_engine import ProxyEngine, QueueSink, QueueSource, console_address
+from gt_packet_definition import packet_layouts
+from gt_processing import PacketValidator
+from synthetic import make_packet
+
+LAYOUT = packet_layouts['B']
+PS_IP = '192.168.1.10'
+
+
+def test_packets_from_the_console_pass():
+    validator = PacketValidator(LAYOUT, PS_IP)
+    assert validator.check(make_packet(1), (PS_IP, 33740))
+    assert validator.rejected == {'address': 0, 'length': 0, 'magic': 0}
+
+
+def test_other_senders_are_turned_down():
+    validator = PacketValidator(LAYOUT, PS_IP)
+    assert not validator.check(make_packet(1), ('192.168.1.11', 33740))
+    assert validator.rejected['address'] == 1
+
+
+@pytest.mark.parametrize('source', [PS_IP, None])
+def test_wrong_lengths_are_turned_down(source):
+    validator = PacketValidator(LAYOUT, source)
+    assert not validator.check(make_packet(1)[:-1], (PS_IP, 33740))
+    assert not validator.check(make_packet(1, '~'), (PS_IP, 33740))
+    assert validator.rejected['length'] == 2
+
+
+def test_magic_is_checked_when_any_sender_is_accepted():
+    validator = PacketValidator(LAYOUT)
+    assert validator.check(make_packet(1), ('10.0.0.1', 33740))
+    # The right length but not encrypted by a console
+    assert not validator.check(bytes(LAYOUT.size), ('10.0.0.1', 33740))
+    assert validator.rejected == {'address': 0, 'length': 0, 'magic': 1}
+
+
+def test_broadcast_accepts_any_console():
+    assert console_address('127.0.0.1') == '127.0.0.1'
+    assert console_address('192.168.1.255') is None
+
+
+def test_engine_drops_rejected_datagrams():
+    sink = QueueSink()
+    packets = [make_packet(1), b'\0' * 100, bytes(LAYOUT.size), make_packet(2)]
+    engine = ProxyEngine(QueueSource(packets), [sink])
+    engine.start()
+    engine.run()
+    engine.close()
+    assert len(sink.frames()) == 2
+    assert engine.received.value == 4
+    assert engine.validator.rejected == {'address': 0, 'length': 1, 'magic': 1}
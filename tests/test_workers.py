@@ -0,0 +1,123 @@
+import multiprocessing
+import socket
+import time
+
+import pytest
+
+import gt_workers
+from gt_async import ConsoleStream
+from gt_packet_definition import packet_layouts
+from gt_processing import salsa20_dec
+from gt_workers import SharedRing, ShardPool
+
+from synthetic import make_packets
+
+
+def test_shared_ring():
+    ring = SharedRing(4, 64)
+    # The consumer side, as a worker maps it
+    consumer = SharedRing.__new__(SharedRing)
+    consumer.__setstate__(ring.__getstate__())
+    try:
+        for i in range(4):
+            slot = ring.reserve(False)
+            slot[0] = i
+            ring.commit()
+        # Full until the consumer gives a slot back
+        assert ring.reserve(False) is None
+        assert consumer.get(0)[0] == 0
+        consumer.release()
+        slot = ring.reserve(False)
+        slot[0] = 4
+        ring.commit()
+        received = []
+        for _ in range(4):
+            received.append(consumer.get(0)[0])
+            consumer.release()
+        assert received == [1, 2, 3, 4]
+        assert consumer.get(0.01) is None
+    finally:
+        consumer.close()
+        ring.close()
+
+
+@pytest.fixture
+def sink():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(('127.0.0.1', 0))
+    s.settimeout(2)
+    yield s
+    s.close()
+
+
+def receive(s, count):
+    frames = []
+    try:
+        while len(frames) < count:
+            frames.append(s.recv(4096))
+    except socket.timeout:
+        pass
+    return frames
+
+
+def test_pool_decodes_every_console(sink):
+    target = [{'address': '127.0.0.1:{}'.format(sink.getsockname()[1]), 'format': 'decrypted'}]
+    streams = [ConsoleStream('console{}'.format(i), '127.0.0.{}'.format(i + 2), 'B', target) for i in range(3)]
+    pool = ShardPool(streams, 2)
+    pool.start()
+    packets = {stream.name: make_packets(1 + i * 1000, 20) for i, stream in enumerate(streams)}
+    try:
+        for n in range(20):
+            for stream in streams:
+                pool.submit(stream, packets[stream.name][n])
+                time.sleep(0.001)
+        frames = receive(sink, 60)
+    finally:
+        pool.close()
+    xor = packet_layouts['B'].xor
+    assert sorted(frames) == sorted(salsa20_dec(data, xor) for name in packets for data in packets[name])
+    for i, stream in enumerate(streams):
+        assert (stream.pktid, stream.forwarded, stream.worker_invalid) == (1000 * i + 20, 20, 0)
+
+
+def test_pool_counts_what_workers_turn_down(sink):
+    target = [{'address': '127.0.0.1:{}'.format(sink.getsockname()[1]), 'format': 'decrypted'}]
+    stream = ConsoleStream('console', '127.0.0.2', 'B', target)
+    pool = ShardPool([stream], 1)
+    pool.start()
+    try:
+        # No GT7 magic once decrypted
+        for _ in range(3):
+            pool.submit(stream, bytes(316))
+        pool.submit(stream, make_packets(1, 1)[0])
+        assert len(receive(sink, 1)) == 1
+    finally:
+        pool.close()
+    assert (stream.worker_invalid, stream.invalid, stream.forwarded) == (3, 0, 1)
+
+
+def test_pool_drops_when_a_worker_is_behind():
+    stream = ConsoleStream('console', '127.0.0.2', 'B', [])
+    pool = ShardPool([stream], 1, slots=4)
+    # Not started, nothing takes the packets
+    packets = make_packets(1, 6)
+    for data in packets:
+        pool.submit(stream, data)
+    assert stream.dropped == 2
+    pool.close()
+
+
+def test_workers_start_before_the_collecting_threads(monkeypatch):
+    streams = [ConsoleStream('console{}'.format(i), '127.0.0.{}'.format(i + 2), 'B', []) for i in range(2)]
+    pool = ShardPool(streams, 2)
+    started = []
+
+    class Process(multiprocessing.Process):
+        def start(self):
+            started.append([shard.thread for shard in pool.shards])
+            super().start()
+
+    monkeypatch.setattr(gt_workers.multiprocessing, 'Process', Process)
+    pool.start()
+    pool.close()
+    assert started == [[None, None], [None, None]]
@@ -75,4 +75,26 @@ class TelemetryPacket(Structure):
         #return iter(vars(self))
         #attrs = vars(self)
         #print(', '.join("%s: %s" % item for item in attrs.items()))
-        return iter(self.__dict__.values())
\ No newline at end of file
+        return iter(self.__dict__.values())
+
+
+class XSimFrame:
+    # A single TelemetryPacket for the whole session: allocated once, header written once, the same
+    # buffer is then updated in place and sent through view for every packet.
+    def __init__(self, game=b'PS_GT7', location=b'NA', pkt_type=1):
+        self.buffer = bytearray(sizeof(TelemetryPacket))
+        self.packet = TelemetryPacket.from_buffer(self.buffer)
+        self.packet.api_mode = PACKET_HEADER
+        self.packet.version = API_VERSION
+        self.packet.game = game
+        self.packet.location = location
+        self.packet.pkt_type = pkt_type
+        self.view = memoryview(self.buffer)
+        self.vehicle = None
+
+    def set_vehicle(self, vehicle):
+        # The whole field is rewritten so that a shorter name leaves no trailing bytes of the previous one
+        if vehicle != self.vehicle:
+            self.vehicle = vehicle
+            offset = TelemetryPacket.vehicle_name.offset
+            self.buffer[offset:offset + 16] = vehicle[:16].ljust(16, b'\0')